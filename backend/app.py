@@ -1,17 +1,303 @@
 # flask app placeholder
 import os
+import io
+import hmac
 import json
+import time
+import uuid
+import hashlib
+import pstats
+import cProfile
+import contextlib
+import threading
+import functools
+import numpy as np
 import pandas as pd
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Request, Response, g, request, jsonify
 from flask_cors import CORS
 from config import Config
-from utils import ensure_upload_folder, read_csv_file, standardize_household, standardize_industrial
-from ml_model import Forecaster, AnomalyDetector
-from llm_client import LLMClient
+from utils import HashingFile, LazyModule, ensure_upload_folder, parallel_map, read_csv_file, stream_standardize_csv, standardize_household, standardize_industrial, timestamp_columns
+from model_registry import ModelRegistry
+from jobs import JobQueue, report_progress
+from store import (DatasetWriter, FrameCache, append_dataset, dataset_exists, dataset_lock, dataset_path, find_upload, iter_csv, legacy_csv_path, list_datasets,
+                   read_dataset, read_manifest, read_sidecar, record_upload, write_dataset, write_sidecar)
+from serialize import FORMATS, FastJSONProvider, columnar, iter_ndjson, paginate
+from series import ROLLUPS_DIR, Rollups, extend_rollups, load_rollups, lttb
+from summary import SUMMARY_FILE, DatasetSummary, extend_summary, load_summary
+from telemetry import observe, render, span, stage_breakdown, start_trace, stop_trace
+
+# sklearn/scipy, requests and cvxpy are imported on first use so a worker starts fast (see warm_up)
+ml_model = LazyModule("ml_model")
+llm_client = LazyModule("llm_client")
+optimizer = LazyModule("optimizer")
+
+class UploadRequest(Request):
+    """Request whose uploaded files are sha256-hashed while werkzeug spools them (see upload)."""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingFile(super()._get_file_stream(total_content_length, content_type, filename, content_length))
 
 ensure_upload_folder(Config.UPLOAD_FOLDER)
 app = Flask(__name__)
+app.request_class = UploadRequest
+app.json = FastJSONProvider(app)
 CORS(app)
+frames = FrameCache(Config.UPLOAD_FOLDER, Config.FRAME_CACHE_SIZE)
+models = ModelRegistry(Config.MODEL_PATH, max_age=Config.MODEL_MAX_AGE_HOURS * 3600, max_bytes=int(Config.MODEL_MAX_MB * 1024 * 1024))
+jobs = JobQueue(Config.JOB_WORKERS, Config.JOB_MAX_PENDING, Config.JOB_TTL_SECONDS)
+_profiling = threading.Lock()  # cProfile can only follow one request at a time
+
+@functools.lru_cache(maxsize=None)
+def _llm():
+    """The process's shared LLMClient, created on first use so forked workers never share its connections."""
+    return llm_client.LLMClient()
+
+def _profile_mode():
+    """Requested X-Profile mode when the request carries the configured profiling token, else None."""
+    mode = request.headers.get("X-Profile")
+    token = request.headers.get("X-Profile-Token", "")
+    if mode not in ("stages", "cprofile") or not Config.PROFILE_TOKEN:
+        return None
+    return mode if hmac.compare_digest(token, Config.PROFILE_TOKEN) else None
+
+@app.before_request
+def _begin_request():
+    g.started = time.perf_counter()
+    g.trace_token = start_trace()
+    g.profiler = None
+    if _profile_mode() == "cprofile" and _profiling.acquire(blocking=False):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def _end_request(resp):
+    """
+    Record request latency (until the body starts streaming) and attach any
+    requested profile: stages as a Server-Timing header, cprofile as the body.
+    Work done by background jobs is not part of the request's trace.
+    """
+    elapsed = time.perf_counter() - g.started
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    observe("energy_http_request_duration_seconds", elapsed, endpoint=endpoint, method=request.method, status=resp.status_code)
+    trace = stop_trace(g.pop("trace_token"))
+    mode = _profile_mode()
+    if mode == "stages":
+        timings = [f'{stage};dur={s["ms"]:.2f};desc="{s["calls"]} calls' + (f', {s["rows"]} rows"' if s["rows"] else '"')
+                   for stage, s in stage_breakdown(trace).items()]
+        resp.headers["Server-Timing"] = ", ".join(timings + [f"total;dur={elapsed * 1000:.2f}"])
+    elif mode == "cprofile":
+        profiler = g.pop("profiler", None)
+        if profiler is None:
+            resp.headers["X-Profile"] = "busy"
+            return resp
+        profiler.disable()
+        _profiling.release()
+        out = io.StringIO()
+        out.write(f"{request.method} {request.path} -> {resp.status_code} in {elapsed * 1000:.1f} ms\n\n")
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(Config.PROFILE_TOP)
+        resp = Response(out.getvalue(), status=resp.status_code, mimetype="text/plain")
+    return resp
+
+@app.teardown_request
+def _abort_profile(exc):
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        _profiling.release()
+
+def _run_view(view, path, data):
+    """
+    Replay a JSON POST against view outside the original request; returns (body, status).
+    Only the view runs: before/after_request hooks do not, so a job's work is not
+    in the request latency metric and X-Profile applies to the submitting request only.
+    """
+    with app.test_request_context(path, method="POST", json=data):
+        resp = app.make_response(view())
+    return resp.get_json(), resp.status_code
+
+def async_capable(view):
+    """
+    Lets a JSON POST route run as a background job when the body has "async": true.
+    The route answers 202 with a job id to poll at /jobs/<id>; identical submissions
+    (same route, parameters and dataset version) made while one is in flight share it.
+    """
+    @functools.wraps(view)
+    def wrapper():
+        data = request.get_json(force=True, silent=True) or {}
+        if not data.pop("async", False):
+            return view()
+        if data.get("format") == "ndjson":
+            return jsonify({"ok": False, "error": "format 'ndjson' streams its response and cannot run as a job"}), 400
+        fname = data.get("cleaned_filename")
+        key = json.dumps([request.path, frames.version(fname) if fname else None, data], sort_keys=True, default=str)
+        try:
+            job, coalesced = jobs.submit(key, _run_view, view, request.path, data)
+        except RuntimeError as e:
+            return jsonify({"ok": False, "error": str(e)}), 503
+        body = {"ok": True, "job_id": job.id, "status": job.status, "coalesced": coalesced, "status_url": f"/jobs/{job.id}"}
+        return jsonify(body), 202, {"Location": body["status_url"]}
+    return wrapper
+
+def _parallel(func, items):
+    return parallel_map(func, items, Config.ML_WORKERS, Config.ML_BACKEND)
+
+def _forecasters(series, horizon=None, engine=None):
+    """
+    Fitted Forecasters for [(series_key, df), ...] energy_kwh series as (model, hit) pairs.
+    Unchanged data is served from the model registry; misses are fitted on the worker pool.
+    """
+    report_progress(0.1, f"fitting {len(series)} series")
+    items = [(ml_model.Forecaster(horizon=horizon, engine=engine, random_state=ml_model.series_seed(Config.RANDOM_SEED, key), auto_threshold=Config.AUTO_R2_THRESHOLD),
+              df[["timestamp", "energy_kwh"]], key) for key, df in series]
+    return models.get_or_fit_many(items, ml_model.fit_series, _parallel)
+
+def _global_forecaster(m, horizon=None, engine=None):
+    """(GlobalForecaster fitted over every series of SeriesMatrix m, registry hit)."""
+    model = ml_model.GlobalForecaster(horizon=horizon, engine=engine, random_state=Config.RANDOM_SEED, auto_threshold=Config.AUTO_R2_THRESHOLD)
+    [(fore, hit)] = models.get_or_fit_many([(model, m, "global")], ml_model.fit_series)
+    return fore, hit
+
+def _global_forecast(m, n, horizon, engine, fmt):
+    """
+    "global": true mode of /forecast: one GlobalForecaster over every series
+    of m, returning each series' forecast and their per-timestamp total. All
+    forecasts start after the dataset's latest reading (see GlobalForecaster).
+    """
+    label = m.label_col
+    if horizon is not None:
+        # a direct model also has to cover the hours a series trails the latest reading by
+        horizon = n + min(int(m.gaps().max(initial=0)), Config.FORECAST_MAX_GAP_HOURS)
+    report_progress(0.1, f"fitting one model over {m.shape[0]} series")
+    fore, hit = _global_forecaster(m, horizon, engine)
+    report_progress(0.7, "forecasting")
+    try:
+        per_series = fore.forecast_all(m, n, max_gap=Config.FORECAST_MAX_GAP_HOURS)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    total = ml_model.forecast_total(per_series)
+    field = "per_type" if label == "energy_type" else f"per_{label}"
+    extra = {"global": True, "r2": fore.r2, "model": fore.engine_used, "engines": fore.report, "model_cache": _cache_label(hit)}
+    if fmt == "ndjson":
+        rows = _concat([p.assign(**{label: key}) for key, p in per_series.items()])
+        return _rows_response(field, rows, {**extra, "total": columnar(total)}, fmt)
+    encode = columnar if fmt == "columnar" else (lambda p: p.to_dict(orient="records"))
+    return jsonify({"ok": True, field: {key: encode(p) for key, p in per_series.items()}, "total": encode(total), **extra})
+
+def _detectors(series):
+    """AnomalyDetector counterpart of _forecasters."""
+    report_progress(0.1, f"fitting {len(series)} series")
+    items = [(ml_model.AnomalyDetector(random_state=ml_model.series_seed(Config.RANDOM_SEED, key)), df[["energy_kwh"]], key) for key, df in series]
+    return models.get_or_fit_many(items, ml_model.fit_series, _parallel)
+
+ONLINE_STATE_FILE = "online_anomalies.json"
+
+def _online_anomalies(fname, m):
+    """
+    Online mode of /anomalies: each series' OnlineAnomalyDetector state is kept in
+    a dataset sidecar, so a call only scores readings appended since the previous one.
+    Returns (the latest ONLINE_MAX_FLAGGED anomalies of each series, per-series scored counts).
+    Datasets from before the columnar store have no directory for state and are scored in full.
+    """
+    path = dataset_path(Config.UPLOAD_FOLDER, fname)
+    stored = os.path.isdir(path)
+    label = m.label_col
+    results = []
+    scored = {}
+    with dataset_lock(path) if stored else contextlib.nullcontext():
+        state = (read_sidecar(path, ONLINE_STATE_FILE) if stored else None) or {}
+        for key in sorted(m.labels.tolist()):
+            det = ml_model.OnlineAnomalyDetector(max_flagged=Config.ONLINE_MAX_FLAGGED)
+            if key in state and state[key]["params"] == det.get_params():
+                det = ml_model.OnlineAnomalyDetector.from_dict(state[key], Config.ONLINE_MAX_FLAGGED)
+            # only the readings after the last one seen are sliced out of the matrix row;
+            # if the history before it no longer adds up, the detector rebuilds from the whole series
+            start = 0
+            if det.last_ts is not None:
+                start = int(np.searchsorted(m.timestamps, det.last_ts, side="right"))
+                if m.count(key, start) != det.n_seen:
+                    start = 0
+            grp = m.frame(key, "energy_kwh", start=start)
+            scored[key] = len(det.score_new(grp, "energy_kwh", seen=det.n_seen if start else None))
+            state[key] = det.to_dict()
+            rec = det.flagged.rename(columns={"value": "energy_kwh"}).assign(anomaly=True)
+            if label:
+                rec[label] = key
+            results.append(rec)
+        if stored:
+            write_sidecar(path, ONLINE_STATE_FILE, state)
+    return _concat(results), scored
+
+def _concat(frames_):
+    return pd.concat(frames_, ignore_index=True) if frames_ else pd.DataFrame()
+
+def _rows_response(field, df, extra, fmt):
+    """
+    Respond with df under `field` in the requested encoding (see serialize.FORMATS);
+    `extra` holds the other top-level keys, which ndjson sends as its header line.
+    """
+    if fmt == "ndjson":
+        return Response(iter_ndjson(df, {"ok": True, **extra}, Config.STREAM_CHUNK_ROWS), mimetype="application/x-ndjson")
+    with span("serialize.rows", rows=len(df)):
+        rows = columnar(df) if fmt == "columnar" else df.to_dict(orient="records")
+    return jsonify({"ok": True, **extra, field: rows})
+
+def _bad_format(fmt):
+    return jsonify({"ok": False, "error": f"format must be one of {', '.join(FORMATS)}"}), 400
+
+def _standardize_delta(raw, columns):
+    """
+    Bring appended rows into a dataset's cleaned schema: rows already in that
+    schema pass through, anything else goes through the dataset's normalizer.
+    """
+    raw = raw.rename(columns=lambda c: str(c).strip())
+    if not timestamp_columns(raw.columns):
+        raise ValueError("rows need a timestamp column")
+    if set(raw.columns) == set(columns):
+        delta = raw[columns].assign(timestamp=pd.to_datetime(raw["timestamp"], errors="coerce"))
+    elif "energy_type" in columns or "energy_value" in columns:
+        delta = standardize_industrial(raw)
+    else:
+        delta = standardize_household(raw)
+    if sorted(delta.columns) != sorted(columns):
+        raise ValueError(f"rows do not match dataset columns {columns}")
+    return delta[columns].dropna(subset=["timestamp"])
+
+def _summary(fname):
+    """DatasetSummary of a cleaned dataset from its sidecar, or None if the dataset does not exist."""
+    path = dataset_path(Config.UPLOAD_FOLDER, fname)
+    if os.path.isdir(path):
+        return load_summary(path, lambda: frames.matrix(fname))
+    m = frames.matrix(fname)
+    return DatasetSummary.from_frame(m) if m is not None else None
+
+def _extend_sidecars(path, delta, rows_before):
+    extend_summary(path, delta, rows_before)
+    extend_rollups(path, delta, rows_before)
+
+@functools.lru_cache(maxsize=max(Config.FRAME_CACHE_SIZE, 1))
+def _rollups(fname, version):
+    """Rollup pyramid of a dataset at a given on-disk version (see FrameCache.version)."""
+    path = dataset_path(Config.UPLOAD_FOLDER, fname)
+    if os.path.isdir(path):
+        return load_rollups(path, lambda: frames.matrix(fname))
+    return Rollups.from_frame(frames.matrix(fname))
+
+def _time_bound(value, default):
+    """Query-string time bound (ISO date/time or epoch ms) as UTC ns; naive times are taken as UTC."""
+    if value in (None, ""):
+        return default
+    ts = pd.Timestamp(int(value), unit="ms") if value.lstrip("-").isdigit() else pd.Timestamp(value)
+    return (ts.tz_convert("UTC").tz_localize(None) if ts.tzinfo else ts).value
+
+def _cache_label(hit):
+    return "hit" if hit else "miss"
+
+@app.route("/metrics")
+def metrics():
+    """
+    Prometheus text exposition of request, stage, cache and LLM metrics. Counters
+    are per process: with several server workers each scrape sees one of them.
+    """
+    return Response(render(), mimetype="text/plain; version=0.0.4")
 
 @app.route("/health")
 def health():
@@ -20,107 +306,442 @@ def health():
 @app.route("/upload", methods=["POST"])
 def upload():
     """
-    Expects multipart/form-data with file under 'file' and optional form field 'data_type' = 'household'|'industrial'
-    Returns: cleaned_filename and preview rows
+    Expects multipart/form-data with file under 'file' and optional form fields
+    'data_type' = 'household'|'industrial', 'streaming' = '1'|'0' (defaults to Config.UPLOAD_STREAMING)
+    and 'format' = 'records'|'columnar'|'ndjson' for the preview
+    Returns: cleaned_filename and preview rows. Uploads are content-addressed: the
+    same bytes uploaded again (under any name) return the dataset cleaned the first
+    time, with "deduplicated": true, unless it has been appended to since.
     """
     if "file" not in request.files:
         return jsonify({"ok": False, "error": "no file"}), 400
     f = request.files["file"]
     data_type = request.form.get("data_type", "household").lower()
-    raw = read_csv_file(f)
-    if data_type == "household":
-        cleaned = standardize_household(raw)
-        cleaned_name = (f.filename or "upload") + "_cleaned_household.csv"
+    streaming = request.form.get("streaming", "1" if Config.UPLOAD_STREAMING else "0").lower() in ("1", "true", "yes")
+    fmt = request.form.get("format", "records")
+    if fmt not in FORMATS:
+        return _bad_format(fmt)
+    kind = "household" if data_type == "household" else "industrial"
+    standardize = standardize_household if kind == "household" else standardize_industrial
+    digest = _upload_digest(f)
+    key = f"{kind}-{digest}"
+    existing = find_upload(Config.UPLOAD_FOLDER, key)
+    if existing is not None:
+        preview = read_dataset(dataset_path(Config.UPLOAD_FOLDER, existing), limit=50)
+        return _rows_response("preview", preview, {"cleaned_filename": existing, "deduplicated": True}, fmt)
+    cleaned_name = f"{f.filename or 'upload'}_{digest[:12]}_cleaned_{kind}.csv"
+    if dataset_exists(Config.UPLOAD_FOLDER, cleaned_name):
+        # the dataset cleaned from this upload has been appended to; keep it and start a new one
+        cleaned_name = f"{f.filename or 'upload'}_{uuid.uuid4().hex[:12]}_cleaned_{kind}.csv"
+    path = dataset_path(Config.UPLOAD_FOLDER, cleaned_name)
+    try:
+        preview, rows = _ingest(f, standardize, path, streaming)
+    except UnicodeDecodeError:
+        # a non-utf-8 byte past the sniffed sample: the partial dataset was discarded, parse again as latin1
+        f.stream.seek(0)
+        preview, rows = _ingest(f, standardize, path, streaming, encoding="latin1")
+    record_upload(Config.UPLOAD_FOLDER, key, cleaned_name, rows)
+    frames.invalidate(cleaned_name)
+    return _rows_response("preview", preview, {"cleaned_filename": cleaned_name, "deduplicated": False}, fmt)
+
+def _ingest(f, standardize, path, streaming, encoding=None):
+    """Clean an uploaded CSV into a new dataset at path with its sidecars; returns (preview, rows)."""
+    summary = DatasetSummary()
+    with DatasetWriter(path) as writer:
+        # finished rollup buckets go straight to the staged dataset, not kept in memory
+        rollups = Rollups(os.path.join(writer.tmp_path, ROLLUPS_DIR))
+        def sink(chunk):
+            writer.append(chunk)
+            summary.update(chunk)
+            rollups.update(chunk)
+        if streaming:
+            preview = stream_standardize_csv(f, standardize, sink, chunksize=Config.UPLOAD_CHUNK_ROWS,
+                                             sample_bytes=Config.CSV_SNIFF_BYTES, encoding=encoding)
+        else:
+            cleaned = standardize(read_csv_file(f, sample_bytes=Config.CSV_SNIFF_BYTES))
+            sink(cleaned)
+            preview = cleaned.head(50)
+        writer.write_sidecar(SUMMARY_FILE, summary.to_dict())
+        rollups.save()
+    return preview, writer.rows
+
+def _upload_digest(f):
+    """sha256 hex digest of an uploaded file's bytes."""
+    h = getattr(f.stream, "sha256", None)
+    if h is None:  # not spooled through UploadRequest
+        h = hashlib.sha256()
+        for block in iter(lambda: f.stream.read(1 << 20), b""):
+            h.update(block)
+        f.stream.seek(0)
+    return h.hexdigest()
+
+@app.route("/append", methods=["POST"])
+def append():
+    """
+    Adds new readings to an existing cleaned dataset without rewriting prior data.
+    Either multipart/form-data with a CSV under 'file' plus form field 'cleaned_filename',
+    or JSON: { "cleaned_filename": "<file>", "rows": [ {...}, ... ] }
+    Rows may be raw (wide or long) meter data, standardized with the dataset's
+    household/industrial rules, or already in the cleaned schema. Rows whose
+    timestamp + appliance/energy_type already exist are dropped as duplicates.
+    Returns: appended and duplicate row counts and the new total
+    """
+    if "file" in request.files:
+        fname = request.form.get("cleaned_filename")
+        raw = read_csv_file(request.files["file"], sample_bytes=Config.CSV_SNIFF_BYTES)
     else:
-        cleaned = standardize_industrial(raw)
-        cleaned_name = (f.filename or "upload") + "_cleaned_industrial.csv"
-    path = os.path.join(Config.UPLOAD_FOLDER, cleaned_name)
-    cleaned.to_csv(path, index=False)
-    preview = cleaned.head(50).to_dict(orient="records")
-    return jsonify({"ok": True, "cleaned_filename": cleaned_name, "preview": preview})
+        data = request.get_json(force=True)
+        fname = data.get("cleaned_filename")
+        raw = pd.DataFrame(data.get("rows") or [])
+    if not fname:
+        return jsonify({"ok": False, "error": "cleaned_filename required"}), 400
+    path = dataset_path(Config.UPLOAD_FOLDER, fname)
+    if not os.path.isdir(path):
+        legacy = frames.get(fname)
+        if legacy is None:
+            return jsonify({"ok": False, "error": "file not found"}), 404
+        # datasets from before the columnar store are converted once, then appended to in place
+        write_dataset(legacy, path)
+        write_sidecar(path, SUMMARY_FILE, DatasetSummary.from_frame(legacy).to_dict())
+        os.remove(legacy_csv_path(Config.UPLOAD_FOLDER, fname))
+    columns = [c["name"] for c in read_manifest(path)["columns"]]
+    if raw.empty:
+        return jsonify({"ok": True, "appended": 0, "duplicates": 0, "rows": read_manifest(path)["rows"]})
+    try:
+        delta = _standardize_delta(raw, columns)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    keys = [c for c in ("timestamp", "appliance", "energy_type") if c in columns]
+    received = len(delta)
+    delta = delta.drop_duplicates(subset=keys, keep="last")
+    # rows already stored are dropped under the append lock, so concurrent appends cannot both add them
+    rows, appended = append_dataset(path, delta, on_append=_extend_sidecars, keys=keys)
+    # cached frames reload on the new manifest mtime; registry models are keyed by
+    # content hash so stale ones are simply never hit; online detectors score just the delta;
+    # the summary and rollup sidecars are extended with the delta under the append lock
+    frames.invalidate(fname)
+    return jsonify({"ok": True, "appended": appended, "duplicates": received - appended, "rows": rows})
 
 @app.route("/download/<path:fname>")
 def download(fname):
-    path = os.path.join(Config.UPLOAD_FOLDER, fname)
-    if not os.path.exists(path):
+    """
+    Renders the cleaned dataset as CSV on demand; nothing is kept on disk in CSV form.
+    """
+    df = frames.get(fname)
+    if df is None:
+        return jsonify({"ok": False, "error": "not found"}), 404
+    return Response(iter_csv(df, Config.UPLOAD_CHUNK_ROWS), mimetype="text/csv",
+                    headers={"Content-Disposition": f"attachment; filename={os.path.basename(fname)}"})
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """
+    Status of a background job: queued|running|done|failed with progress (0..1).
+    Once done, "result" holds the route's JSON response and "status_code" its HTTP status.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"ok": False, "error": "job not found"}), 404
+    return jsonify({"ok": True, **job.to_dict()})
+
+@app.route("/summary/<path:fname>")
+def dataset_summary(fname):
+    """
+    Precomputed statistics of a cleaned dataset: totals, per-series shares,
+    hourly/weekday load profiles, peak hour, base load and time range.
+    """
+    summary = _summary(fname)
+    if summary is None:
+        return jsonify({"ok": False, "error": "not found"}), 404
+    return jsonify({"ok": True, "summary": summary.metrics()})
+
+@app.route("/series/<path:fname>")
+def series(fname):
+    """
+    Query args: keys=<comma-separated appliances/energy types> (default all),
+    start/end (ISO or epoch ms), points=1000, method=auto|rollup|lttb
+    Returns per-key columnar points (epoch ms timestamps) sized for plotting: raw
+    readings when they fit in `points`, else the finest precomputed rollup level
+    that does (value = bucket mean, with min/max), or with "lttb" an LTTB
+    downsample of the raw readings. No response has more than `points` points
+    per key: rollups too dense even at the coarsest level, and raw readings of
+    data too sparse to roll up, are LTTB-downsampled.
+    """
+    version = frames.version(fname)
+    if version is None:
         return jsonify({"ok": False, "error": "not found"}), 404
-    return send_file(path, as_attachment=True, download_name=fname)
+    method = request.args.get("method", "auto")
+    if method not in ("auto", "rollup", "lttb"):
+        return jsonify({"ok": False, "error": "method must be 'auto', 'rollup' or 'lttb'"}), 400
+    try:
+        points = int(request.args.get("points", 1000))
+        start = _time_bound(request.args.get("start"), np.iinfo(np.int64).min + 1)
+        end = _time_bound(request.args.get("end"), np.iinfo(np.int64).max)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    if not 3 <= points <= Config.SERIES_MAX_POINTS:
+        return jsonify({"ok": False, "error": f"points must be between 3 and {Config.SERIES_MAX_POINTS}"}), 400
+    rollups = _rollups(fname, version)
+    keys = [k for k in request.args.get("keys", "").split(",") if k] or list(rollups.labels)
+    out = {}
+    for key in keys:
+        if rollups.levels and (method == "rollup" or (method == "auto" and rollups.count(key, start, end) > points)):
+            level, agg = rollups.query(key, start, end, points)
+            out[key] = {"resolution": level, **columnar(agg)}
+            continue
+        ts, values = frames.matrix(fname).range(key, start, end)
+        resolution = "raw"
+        if len(ts) > points:
+            keep = lttb(ts, values, points)
+            ts, values, resolution = ts[keep], values[keep], "lttb"
+        out[key] = {"resolution": resolution, **columnar(pd.DataFrame({"timestamp": pd.to_datetime(ts), "value": values}))}
+    return jsonify({"ok": True, "keys": list(rollups.labels), "series": out})
 
 @app.route("/forecast", methods=["POST"])
+@async_capable
 def forecast():
     """
-    JSON: { "cleaned_filename": "<file>", "horizon": 24 }
-    Response: per-type or aggregated forecasts
+    JSON: { "cleaned_filename": "<file>", "horizon": 24, "mode": "recursive"|"direct",
+            "model": "gbr"|"hist_gbr"|"ridge"|"seasonal_naive"|"seasonal_mean"|"exp_smoothing"|"auto",
+            "format": "records"|"columnar"|"ndjson", "global": false, "async": false }
+    Response: per-type or aggregated forecasts, the engine used and each tried engine's r2/fit_ms/predict_ms.
+    With "ndjson" per-type predictions are streamed as rows carrying their energy_type.
+    "global": true fits one model across all appliances / energy types (default engine hist_gbr) and
+    returns per_appliance / per_type forecasts plus their "total"; ndjson sends the total in the header.
     """
     data = request.get_json(force=True)
     fname = data.get("cleaned_filename")
     n = int(data.get("horizon", 24))
+    mode = data.get("mode", "recursive")
+    engine = data.get("model")
+    fmt = data.get("format", "records")
     if not fname:
         return jsonify({"ok": False, "error": "cleaned_filename required"}), 400
-    path = os.path.join(Config.UPLOAD_FOLDER, fname)
-    if not os.path.exists(path):
+    if fmt not in FORMATS:
+        return _bad_format(fmt)
+    if mode not in ("recursive", "direct"):
+        return jsonify({"ok": False, "error": "mode must be 'recursive' or 'direct'"}), 400
+    direct_horizon = n if mode == "direct" else None
+    use_global = bool(data.get("global", False))
+    try:
+        (ml_model.GlobalForecaster if use_global else ml_model.Forecaster)(horizon=direct_horizon, engine=engine)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    m = frames.matrix(fname)
+    if m is None:
         return jsonify({"ok": False, "error": "file not found"}), 404
-    df = pd.read_csv(path, parse_dates=["timestamp"])
+    if use_global and m.label_col:
+        return _global_forecast(m, n, direct_horizon, engine, fmt)
     # household appliance-level
-    if "appliance" in df.columns:
-        agg = df.groupby("timestamp")["energy_kwh"].sum().reset_index()
-        fore = Forecaster()
-        r2 = fore.train(agg, "energy_kwh")
+    if m.label_col == "appliance":
+        agg = m.total("energy_kwh")
+        [(fore, hit)] = _forecasters([("total", agg)], direct_horizon, engine)
+        report_progress(0.7, "forecasting")
         preds = fore.predict_next_n(agg, n, "energy_kwh")
-        return jsonify({"ok": True, "r2": r2, "predictions": preds.to_dict(orient="records")})
-    # industrial multi-energy types
-    if "energy_type" in df.columns:
-        out = {}
-        for etype, group in df.groupby("energy_type"):
-            grp = group.rename(columns={"energy_value": "energy_kwh"})
-            fore = Forecaster()
-            r2 = fore.train(grp, "energy_kwh")
-            preds = fore.predict_next_n(grp, n, "energy_kwh")
-            out[etype] = preds.to_dict(orient="records")
-        return jsonify({"ok": True, "per_type": out})
+        return _rows_response("predictions", preds, {"r2": fore.r2, "model": fore.engine_used, "engines": fore.report,
+                                                     "model_cache": _cache_label(hit)}, fmt)
+    # industrial multi-energy types: fit per type (in parallel when ML_WORKERS > 1), then forecast every type
+    if m.label_col == "energy_type":
+        groups = [(etype, m.frame(etype, "energy_kwh")) for etype in sorted(m.labels.tolist())]
+        fitted = _forecasters(groups, direct_horizon, engine)
+        pairs = [(fore, grp) for (fore, _), (_, grp) in zip(fitted, groups)]
+        report_progress(0.7, "forecasting")
+        if Config.ML_WORKERS == 1:
+            preds = ml_model.predict_many(pairs, n, "energy_kwh")
+        else:
+            preds = _parallel(ml_model.forecast_series, [(fore, grp, n) for fore, grp in pairs])
+        cache = {etype: _cache_label(hit) for (etype, _), (_, hit) in zip(groups, fitted)}
+        used = {etype: fore.engine_used for (etype, _), (fore, _) in zip(groups, fitted)}
+        report = {etype: fore.report for (etype, _), (fore, _) in zip(groups, fitted)}
+        extra = {"model": used, "engines": report, "model_cache": cache}
+        if fmt == "ndjson":
+            rows = _concat([p.assign(energy_type=etype) for (etype, _), p in zip(groups, preds)])
+            return _rows_response("per_type", rows, extra, fmt)
+        encode = columnar if fmt == "columnar" else (lambda p: p.to_dict(orient="records"))
+        out = {etype: encode(p) for (etype, _), p in zip(groups, preds)}
+        return jsonify({"ok": True, "per_type": out, **extra})
     # single series
-    col = "energy_kwh" if "energy_kwh" in df.columns else df.columns[1]
-    df = df.rename(columns={col: "energy_kwh"})
-    fore = Forecaster()
-    r2 = fore.train(df, "energy_kwh")
+    df = m.frame("total", "energy_kwh")
+    [(fore, hit)] = _forecasters([("total", df)], direct_horizon, engine)
+    report_progress(0.7, "forecasting")
     preds = fore.predict_next_n(df, n, "energy_kwh")
-    return jsonify({"ok": True, "r2": r2, "predictions": preds.to_dict(orient="records")})
+    return _rows_response("predictions", preds, {"r2": fore.r2, "model": fore.engine_used, "engines": fore.report,
+                                                 "model_cache": _cache_label(hit)}, fmt)
 
 @app.route("/anomalies", methods=["POST"])
+@async_capable
 def anomalies():
     """
-    JSON: { "cleaned_filename": "<file>" }
-    Returns anomalies as list of rows flagged
+    JSON: { "cleaned_filename": "<file>", "method": "isolation_forest"|"online",
+            "format": "records"|"columnar"|"ndjson", "limit": null, "cursor": null, "async": false }
+    Returns anomalies as list of rows flagged. "online" scores only readings added
+    since the previous online call, against persisted hour-of-week baselines.
+    With "limit", rows come ordered by timestamp (then series) one page at a time;
+    pass the returned "next_cursor" back as "cursor" for the following page.
     """
     data = request.get_json(force=True)
     fname = data.get("cleaned_filename")
+    method = data.get("method", "isolation_forest")
+    fmt = data.get("format", "records")
+    limit = data.get("limit")
     if not fname:
         return jsonify({"ok": False, "error": "cleaned_filename required"}), 400
-    path = os.path.join(Config.UPLOAD_FOLDER, fname)
-    if not os.path.exists(path):
+    if method not in ("isolation_forest", "online"):
+        return jsonify({"ok": False, "error": "method must be 'isolation_forest' or 'online'"}), 400
+    if fmt not in FORMATS:
+        return _bad_format(fmt)
+    if limit is not None and (not isinstance(limit, int) or limit < 1):
+        return jsonify({"ok": False, "error": "limit must be a positive integer"}), 400
+    m = frames.matrix(fname)
+    if m is None:
         return jsonify({"ok": False, "error": "file not found"}), 404
-    df = pd.read_csv(path, parse_dates=["timestamp"])
-    ad = AnomalyDetector()
-    if "energy_kwh" in df.columns:
-        ad.fit(df, "energy_kwh")
+    if m.value_col != "energy_kwh" and m.label_col != "energy_type":
+        return jsonify({"ok": False, "error": "no recognizable energy column"}), 400
+    if method == "online":
+        flagged, scored = _online_anomalies(fname, m)
+        extra = {"method": "online", "scored": scored}
+    elif m.value_col == "energy_kwh":
+        df = m.to_long()
+        [(ad, hit)] = _detectors([("total", df)])
+        report_progress(0.7, "scoring")
         out = ad.detect(df, "energy_kwh")
-        return jsonify({"ok": True, "anomalies": out[out["anomaly"]].to_dict(orient="records")})
-    if "energy_value" in df.columns and "energy_type" in df.columns:
-        results = []
-        for etype, group in df.groupby("energy_type"):
-            grp = group.rename(columns={"energy_value": "energy_kwh"})
-            ad.fit(grp, "energy_kwh")
-            res = ad.detect(grp, "energy_kwh")
-            res["energy_type"] = etype
-            results.extend(res[res["anomaly"]].to_dict(orient="records"))
-        return jsonify({"ok": True, "anomalies": results})
-    return jsonify({"ok": False, "error": "no recognizable energy column"}), 400
+        flagged = out[out["anomaly"]]
+        extra = {"model_cache": _cache_label(hit)}
+    else:
+        groups = [(etype, m.frame(etype, "energy_kwh")) for etype in sorted(m.labels.tolist())]
+        fitted = _detectors(groups)
+        report_progress(0.7, "scoring")
+        scores = _parallel(ml_model.detect_series, [(ad, grp[["energy_kwh"]]) for (ad, _), (_, grp) in zip(fitted, groups)])
+        flagged = _concat([grp[res["anomaly"].to_numpy()].assign(anomaly=True, energy_type=etype)
+                           for (etype, grp), res in zip(groups, scores)])
+        extra = {"model_cache": {etype: _cache_label(hit) for (etype, _), (_, hit) in zip(groups, fitted)}}
+    if limit is not None:
+        keys = [c for c in ("timestamp", "appliance", "energy_type") if c in flagged.columns]
+        try:
+            flagged, extra["next_cursor"] = paginate(flagged, keys, limit, data.get("cursor"))
+        except ValueError as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+    return _rows_response("anomalies", flagged, extra, fmt)
+
+def _household_forecast(fname, n):
+    """(step timestamps, {appliance: forecast kWh per step}, registry hit) of one appliance-level dataset."""
+    m = frames.matrix(fname)
+    if m is None:
+        raise LookupError(f"file not found: {fname}")
+    if m.label_col != "appliance":
+        raise ValueError(f"{fname} has no appliance-level data")
+    fore, hit = _global_forecaster(m)
+    # every appliance is forecast over the same hours after the latest reading (meters that
+    # stopped early are rolled forward); ValueError if one stopped over FORECAST_MAX_GAP_HOURS ago
+    per_series = fore.forecast_all(m, n, max_gap=Config.FORECAST_MAX_GAP_HOURS)
+    if not per_series:
+        raise ValueError(f"{fname} has no readings")
+    steps = pd.DatetimeIndex(next(iter(per_series.values()))["timestamp"])
+    loads = {k: p["predicted"].to_numpy() for k, p in per_series.items()}
+    return steps, loads, hit
+
+@app.route("/optimize", methods=["POST"])
+@async_capable
+def optimize():
+    """
+    JSON: { "cleaned_filename": "<file>" | "cleaned_filenames": ["<file>", ...], "horizon": 24,
+            "prices": [24 hourly time-of-use prices, or one per forecast step],
+            "appliances": {"ev_charger": {"max_kw": 7.2, "window": [22, 6]}, ...},
+            "max_kw": null, "format": "records"|"columnar", "async": false }
+    Forecasts every household's appliances (one global model per dataset), then moves each
+    flexible appliance's forecast energy into its cheapest allowed hours, all households in
+    one batched solve. "appliances" defaults to those of optimizer.FLEXIBLE present, each
+    limited to twice its forecast peak per hour; "max_kw" caps a household's total hourly load.
+    Response: per household the baseline and optimized schedule, costs and savings; portfolio totals.
+    """
+    data = request.get_json(force=True)
+    names = data.get("cleaned_filenames") or ([data["cleaned_filename"]] if data.get("cleaned_filename") else [])
+    n = int(data.get("horizon", 24))
+    prices = data.get("prices")
+    spec = data.get("appliances")
+    max_kw = data.get("max_kw")
+    fmt = data.get("format", "records")
+    if not names:
+        return jsonify({"ok": False, "error": "cleaned_filename or cleaned_filenames required"}), 400
+    if len(names) > Config.OPTIMIZE_MAX_DATASETS:
+        return jsonify({"ok": False, "error": f"at most {Config.OPTIMIZE_MAX_DATASETS} datasets per request"}), 400
+    if not prices:
+        return jsonify({"ok": False, "error": "prices required"}), 400
+    if fmt not in ("records", "columnar"):
+        return jsonify({"ok": False, "error": "format must be records or columnar"}), 400
+
+    forecasts = []
+    for i, fname in enumerate(names):
+        report_progress(0.8 * i / len(names), f"forecasting {fname}")
+        try:
+            forecasts.append(_household_forecast(fname, n))
+        except LookupError as e:
+            return jsonify({"ok": False, "error": str(e)}), 404
+        except ValueError as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+    appliances = sorted(spec) if spec else sorted({a for _, loads, _ in forecasts for a in loads if a in optimizer.FLEXIBLE})
+    if not appliances:
+        return jsonify({"ok": False, "error": "no flexible appliances in the data; list them under 'appliances'"}), 400
+    spec = spec or {}
+
+    H, A = len(forecasts), len(appliances)
+    base = np.zeros((H, A, n))
+    inflexible = np.zeros((H, n))
+    price = np.empty((H, n))
+    allowed = np.empty((H, A, n), dtype=bool)
+    for h, (steps, loads, _) in enumerate(forecasts):
+        for a, name in enumerate(appliances):
+            base[h, a] = loads.get(name, 0.0)
+            allowed[h, a] = optimizer.hour_window(steps.hour, (spec.get(name) or {}).get("window"))
+        inflexible[h] = sum((v for k, v in loads.items() if k not in appliances), np.zeros(n))
+        try:
+            price[h] = optimizer.price_vector(prices, steps)
+        except ValueError as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+    limits = np.array([[(spec.get(name) or {}).get("max_kw", 0) for name in appliances]] * H, dtype=float)
+    limits = np.where(limits > 0, limits, 2 * base.max(axis=2))
+    headroom = float(max_kw) - inflexible if max_kw is not None else None
+    report_progress(0.8, "optimizing")
+    try:
+        shifted, movable, capped = optimizer.shift_loads(base, price, limits, allowed, headroom, Config.OPTIMIZER_SOLVER)
+    except RuntimeError as e:
+        return jsonify({"ok": False, "error": str(e)}), 501
+
+    encode = columnar if fmt == "columnar" else (lambda p: p.to_dict(orient="records"))
+    households = []
+    for h, (fname, (steps, loads, hit)) in enumerate(zip(names, forecasts)):
+        present = [a for a, name in enumerate(appliances) if name in loads]
+        schedule = pd.DataFrame({
+            "timestamp": np.tile(steps, len(present)),
+            "appliance": np.repeat([appliances[a] for a in present], n),
+            "baseline_kwh": base[h, present].reshape(-1),
+            "optimized_kwh": shifted[h, present].reshape(-1),
+        })
+        baseline_cost = float((base[h] * price[h]).sum())
+        optimized_cost = float((shifted[h] * price[h]).sum())
+        households.append({
+            "cleaned_filename": fname,
+            "baseline_cost": baseline_cost,
+            "optimized_cost": optimized_cost,
+            "savings_usd": baseline_cost - optimized_cost,
+            "shifted_kwh": float(np.abs(shifted[h] - base[h]).sum() / 2),
+            "not_shiftable": [appliances[a] for a in present if not movable[h, a]],
+            "model_cache": _cache_label(hit),
+            "schedule": encode(schedule),
+        })
+    total = {k: sum(rec[k] for rec in households) for k in ("baseline_cost", "optimized_cost", "savings_usd", "shifted_kwh")}
+    return jsonify({"ok": True, "appliances": appliances, "max_kw_respected": capped if max_kw is not None else None,
+                    "households": households, "total": total})
 
 @app.route("/recommend", methods=["POST"])
+@async_capable
 def recommend():
     """
-    JSON: { "cleaned_filename": "<file>", "price_per_kwh": 0.15, "horizon": 24, "context": "" }
-    Returns JSON recommendations (or raw text)
+    JSON: { "cleaned_filename": "<file>", "price_per_kwh": 0.15, "horizon": 24, "context": "",
+            "prices": [24 hourly time-of-use prices, optional], "async": false }
+    Returns JSON recommendations (or raw text). With "prices", load-shifting savings of the
+    flexible appliances' average day over the dataset's period are part of the metrics.
     """
     data = request.get_json(force=True)
     fname = data.get("cleaned_filename")
@@ -129,35 +750,45 @@ def recommend():
     context = data.get("context", "")
     if not fname:
         return jsonify({"ok": False, "error": "cleaned_filename required"}), 400
-    path = os.path.join(Config.UPLOAD_FOLDER, fname)
-    if not os.path.exists(path):
+    summary = _summary(fname)
+    if summary is None:
         return jsonify({"ok": False, "error": "file not found"}), 404
-    df = pd.read_csv(path, parse_dates=["timestamp"])
-
-    # Build brief metrics for the LLM prompt
-    if "appliance" in df.columns:
-        total = float(df["energy_kwh"].sum())
-        peak = int(df.assign(hour=df["timestamp"].dt.hour).groupby("hour")["energy_kwh"].sum().idxmax())
-        summary = f"total_kwh={total:.2f}, peak_hour={peak}"
-    elif "energy_type" in df.columns:
-        totals = df.groupby("energy_type")["energy_value"].sum().to_dict()
-        summary = " ".join([f"{k}={v:.2f}" for k, v in totals.items()])
-    else:
-        col = "energy_kwh" if "energy_kwh" in df.columns else df.columns[1]
-        total = float(df[col].sum())
-        peak = int(df.assign(hour=df["timestamp"].dt.hour).groupby("hour")[col].sum().idxmax())
-        summary = f"total_kwh={total:.2f}, peak_hour={peak}"
+
+    # Brief metrics for the LLM prompt, read from the precomputed summary sidecar
+    metrics = summary.prompt_metrics()
+    prices = data.get("prices")
+    if prices and summary.label_col == "appliance":
+        if len(prices) != 24:
+            return jsonify({"ok": False, "error": "prices must have 24 hourly entries"}), 400
+        moved, saved = optimizer.daily_shift(summary.hourly_profiles(), prices)
+        days = (summary.end - summary.start).days + 1 if summary.start is not None else 0
+        metrics += f" shift_kwh={moved * days:.2f} shift_usd_savings={saved * days:.2f}"
 
     system_prompt = "You are an energy advisor that produces JSON recommendations."
-    user_prompt = f"Metrics: {summary} price_per_kwh={price} context={context}"
+    user_prompt = f"Metrics: {metrics} price_per_kwh={price} context={context}"
 
-    llm = LLMClient()
-    resp = llm.generate(system_prompt, user_prompt)
+    report_progress(0.3, "generating recommendations")
+    resp = _llm().generate(system_prompt, user_prompt)
     try:
         parsed = json.loads(resp)
         return jsonify({"ok": True, "recommendations": parsed})
     except Exception:
         return jsonify({"ok": True, "recommendations_text": resp})
 
+def warm_up():
+    """
+    Load what a worker would otherwise load on its first requests: the ML, LLM
+    and optimizer modules and the most recently written datasets as matrices.
+    With PRELOAD=1 this runs at import, so a pre-forking server (gunicorn.conf.py)
+    does it once and forks workers that share the result copy-on-write.
+    """
+    for module in (ml_model, llm_client, optimizer):
+        module.load_module()
+    for name in list_datasets(Config.UPLOAD_FOLDER)[:Config.FRAME_CACHE_SIZE]:
+        frames.matrix(name)
+
+if Config.PRELOAD:
+    warm_up()
+
 if __name__ == "__main__":
     app.run(host=Config.HOST, port=Config.PORT)
@@ -17,10 +17,67 @@ class Config:
     PORT = int(os.getenv("FLASK_PORT", "5000"))
     UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", "uploads")
 
+    # Ingestion: stream uploads through parse/standardize/write in bounded chunks
+    UPLOAD_STREAMING = os.getenv("UPLOAD_STREAMING", "1") == "1"
+    UPLOAD_CHUNK_ROWS = int(os.getenv("UPLOAD_CHUNK_ROWS", "100000"))
+    CSV_SNIFF_BYTES = int(os.getenv("CSV_SNIFF_BYTES", "65536"))
+
+    # Storage: number of loaded cleaned datasets kept in memory (0 disables)
+    FRAME_CACHE_SIZE = int(os.getenv("FRAME_CACHE_SIZE", "8"))
+
+    # Start-up: PRELOAD=1 imports the ML/LLM modules and loads the most recent datasets
+    # at import (app.warm_up), for pre-forking servers such as gunicorn --preload
+    PRELOAD = os.getenv("PRELOAD", "0") == "1"
+
     # ML / Misc
     RANDOM_SEED = int(os.getenv("RANDOM_SEED", "42"))
     MODEL_PATH = os.getenv("MODEL_PATH", "models")
+    # fitted models idle longer than this, or beyond the size budget (oldest first), are evicted
+    MODEL_MAX_AGE_HOURS = float(os.getenv("MODEL_MAX_AGE_HOURS", "168"))
+    MODEL_MAX_MB = float(os.getenv("MODEL_MAX_MB", "512"))
+    # per-series fits/predictions: 1 = serial, N = N joblib workers, -1 = all cores
+    ML_WORKERS = int(os.getenv("ML_WORKERS", "1"))
+    ML_BACKEND = os.getenv("ML_BACKEND", "loky")
+    # /forecast "model": "auto" keeps the cheapest engine whose holdout R2 reaches this
+    AUTO_R2_THRESHOLD = float(os.getenv("AUTO_R2_THRESHOLD", "0.5"))
+    # /anomalies "online" returns at most this many of the latest anomalies per series
+    ONLINE_MAX_FLAGGED = int(os.getenv("ONLINE_MAX_FLAGGED", "1000"))
+
+    # rows per chunk of "format": "ndjson" responses
+    STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "10000"))
+
+    # upper bound on "points" per series for /series
+    SERIES_MAX_POINTS = int(os.getenv("SERIES_MAX_POINTS", "20000"))
+
+    # global forecasts roll series that end early forward to the latest reading, up to this many hours
+    FORECAST_MAX_GAP_HOURS = int(os.getenv("FORECAST_MAX_GAP_HOURS", "168"))
+
+    # /optimize: datasets per request; cvxpy solver for household max_kw caps ("" = cvxpy's default)
+    OPTIMIZE_MAX_DATASETS = int(os.getenv("OPTIMIZE_MAX_DATASETS", "500"))
+    OPTIMIZER_SOLVER = os.getenv("OPTIMIZER_SOLVER", "")
+
+    # Background jobs ("async": true on /forecast, /anomalies, /optimize, /recommend; poll /jobs/<id>)
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+    JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "32"))
+    JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_SECONDS", "3600"))
+
+    # Profiling: requests carrying "X-Profile-Token: <token>" and "X-Profile: stages|cprofile"
+    # get a Server-Timing stage breakdown or a cProfile report; empty token disables it
+    PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+    PROFILE_TOP = int(os.getenv("PROFILE_TOP", "40"))
 
     # LLM: optional external integration (set OPENAI_API_KEY to enable)
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
     OPENAI_API_URL = os.getenv("OPENAI_API_URL", "https://api.openai.com/v1/chat/completions")
+    LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+    LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+    # 429/5xx and connection errors are retried with exponential backoff (or Retry-After)
+    LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+    LLM_RATE_PER_SEC = float(os.getenv("LLM_RATE_PER_SEC", "0"))  # 0 = no rate limit
+    # responses are cached by normalized prompt; set LLM_CACHE_DIR to persist them across restarts
+    LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "256"))
+    LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+    LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "")
+    # LLM_CACHE_DIR files past the TTL or beyond this size (oldest first) are deleted
+    LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "64"))
@@ -0,0 +1,180 @@
+import hashlib
+import numpy as np
+import pandas as pd
+
+_NAT = np.iinfo(np.int64).min
+
+def series_columns(columns):
+    """(label column or None, value column) of a cleaned frame."""
+    if "appliance" in columns:
+        return "appliance", "energy_kwh"
+    if "energy_type" in columns:
+        return "energy_type", "energy_value"
+    value_col = "energy_kwh" if "energy_kwh" in columns else [c for c in columns if c != "timestamp"][0]
+    return None, value_col
+
+def widen(a):
+    """
+    float32 values as float64 at the decimal they were stored from (7 significant
+    digits), so a reading of 5.07 comes back as 5.07 rather than 5.070000171661377.
+    """
+    a = np.asarray(a, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mag = np.floor(np.log10(np.abs(a)))
+    finite = np.isfinite(mag)
+    scale = 10.0 ** np.where(finite, 6 - mag, 0)
+    return np.where(finite, np.round(a * scale) / scale, a)
+
+class SeriesMatrix:
+    """
+    Compact in-memory form of a cleaned dataset: one sorted int64 timestamp axis
+    (UTC ns) shared by all series and a float32 (series x time) value matrix, NaN
+    where a series has no reading, instead of a timestamp and a string label per
+    reading. Per-series work is a row slice rather than a groupby.
+    Readings repeated for a series and timestamp are summed, so the matrix holds
+    one value where the long frame had several; non-numeric readings and series
+    without any numeric reading are dropped. float32 keeps about 7 significant
+    digits: readings above 1e7 (or with finer detail) come back rounded. Values
+    are widened back to float64 (see widen) whenever they leave the matrix.
+    """
+    __slots__ = ("timestamps", "values", "labels", "label_col", "value_col", "tz", "_rows")
+
+    def __init__(self, timestamps, values, labels, label_col=None, value_col="energy_kwh", tz=None):
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float32)
+        self.labels = np.asarray(labels, dtype=str)
+        self.label_col = label_col
+        self.value_col = value_col
+        self.tz = tz
+        self._rows = {label: i for i, label in enumerate(self.labels.tolist())}
+
+    @classmethod
+    def from_long(cls, df, label_col=None, value_col=None):
+        """Build from a long-form cleaned frame (timestamp, [label], value); columns default to series_columns."""
+        if value_col is None:
+            label_col, value_col = series_columns(list(df.columns))
+        index = pd.DatetimeIndex(df["timestamp"])
+        tz = str(index.tz) if index.tz is not None else None
+        ns = (index.tz_convert("UTC").tz_localize(None) if tz else index).asi8
+        values = pd.to_numeric(df[value_col], errors="coerce").to_numpy(dtype=float)
+        if label_col:
+            codes, labels = pd.factorize(df[label_col].to_numpy())
+            labels = [str(x) for x in labels]
+        else:
+            codes, labels = np.zeros(len(df), dtype=np.int64), ["total"]
+        return cls.from_arrays(ns, codes, labels, values, label_col, value_col, tz)
+
+    @classmethod
+    def from_arrays(cls, ns, codes, labels, values, label_col=None, value_col="energy_kwh", tz=None):
+        """
+        From per-reading UTC ns timestamps, series codes into `labels` and values.
+        Readings with NaT, NaN or code -1 are skipped, as are labels left without any.
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        keep = (ns != _NAT) & ~np.isnan(values) & (codes >= 0)
+        ns, codes, values = ns[keep], codes[keep], values[keep]
+        used = np.bincount(codes, minlength=len(labels)) > 0
+        if not used.all():
+            codes = (np.cumsum(used) - 1)[codes]
+            labels = [label for label, u in zip(labels, used) if u]
+        axis, pos = np.unique(ns, return_inverse=True)
+        cells = codes * len(axis) + pos.reshape(-1)
+        size = len(labels) * len(axis)
+        sums = np.bincount(cells, weights=values, minlength=size)
+        seen = np.bincount(cells, minlength=size) > 0
+        matrix = np.where(seen, sums, np.nan).astype(np.float32).reshape(len(labels), len(axis))
+        return cls(axis, matrix, labels, label_col, value_col, tz)
+
+    @classmethod
+    def from_csv(cls, src):
+        """Build from a cleaned long-form CSV (path or buffer)."""
+        return cls.from_long(pd.read_csv(src, parse_dates=["timestamp"]))
+
+    def to_csv(self, dst=None):
+        """Write (or with no dst, return) the long-form CSV; see to_long."""
+        return self.to_long().to_csv(dst, index=False)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def nbytes(self):
+        return self.timestamps.nbytes + self.values.nbytes + self.labels.nbytes
+
+    @property
+    def index(self):
+        """The timestamp axis as a DatetimeIndex in the dataset's timezone."""
+        return self._index(self.timestamps)
+
+    def _index(self, ns):
+        index = pd.DatetimeIndex(ns.view("datetime64[ns]"))
+        return index.tz_localize("UTC").tz_convert(self.tz) if self.tz else index
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def __len__(self):
+        """Number of readings (non-missing cells)."""
+        return int(np.count_nonzero(~np.isnan(self.values)))
+
+    def row(self, key, start=0):
+        """(present mask, float64 values) of series key over the timestamp axis from position start."""
+        v = self.values[self._rows[key], start:]
+        present = ~np.isnan(v)
+        return present, widen(v)
+
+    def count(self, key, stop):
+        """Number of readings of series key before timestamp position stop."""
+        return int(np.count_nonzero(~np.isnan(self.values[self._rows[key], :stop])))
+
+    def frame(self, key, name=None, start=0):
+        """
+        Readings of series key (from timestamp position start on) as a
+        timestamp-ordered frame of timestamp and `name` (default value_col).
+        """
+        present, v = self.row(key, start)
+        return pd.DataFrame({"timestamp": self._index(self.timestamps[start:][present]), name or self.value_col: v[present]})
+
+    def total(self, name=None):
+        """Sum across series per timestamp, as a frame of timestamp and `name` (default value_col)."""
+        present = ~np.isnan(self.values)
+        sums = np.where(present, widen(self.values), 0.0).sum(axis=0)
+        return pd.DataFrame({"timestamp": self.index, name or self.value_col: sums})
+
+    def gaps(self):
+        """Per series, whole hours from its last reading to the latest reading of any series."""
+        present = ~np.isnan(self.values)
+        last = self.values.shape[1] - 1 - np.argmax(present[:, ::-1], axis=1)
+        return np.ceil((self.timestamps[-1] - self.timestamps[last]) / 3.6e12).astype(np.int64) if len(last) else last
+
+    def range(self, key, start, end):
+        """(UTC ns timestamps, values) of series key within [start, end]."""
+        if key not in self._rows:
+            return self.timestamps[:0], np.empty(0)
+        i, j = np.searchsorted(self.timestamps, start, side="left"), np.searchsorted(self.timestamps, end, side="right")
+        v = self.values[self._rows[key], i:j]
+        present = ~np.isnan(v)
+        return self.timestamps[i:j][present], widen(v[present])
+
+    def long_arrays(self):
+        """(labels, UTC ns timestamps, float64 values) of every reading, series by series."""
+        s, t = np.nonzero(~np.isnan(self.values))
+        return self.labels[s], self.timestamps[t], widen(self.values[s, t])
+
+    def to_long(self):
+        """Long-form cleaned frame: one row per reading, timestamp-major, series in first-seen order."""
+        t, s = np.nonzero(~np.isnan(self.values.T))
+        data = {"timestamp": self.index[t]}
+        if self.label_col:
+            data[self.label_col] = self.labels[s].astype(object)
+        data[self.value_col] = widen(self.values[s, t])
+        return pd.DataFrame(data)
+
+    def content_hash(self):
+        """Stable digest of the data, for keying fitted models like model_registry.content_hash."""
+        h = hashlib.sha1()
+        for part in (self.timestamps, self.values, self.labels):
+            h.update(np.ascontiguousarray(part).tobytes())
+        h.update(repr((self.label_col, self.value_col, self.tz)).encode("utf-8"))
+        return h.hexdigest()
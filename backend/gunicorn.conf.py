@@ -0,0 +1,21 @@
+# gunicorn -c gunicorn.conf.py app:app
+# With PRELOAD=1 the master imports the app once (including app.warm_up) and
+# forks the workers from it, so they share the loaded modules and datasets
+# copy-on-write and serve as soon as they are forked.
+import gc
+import os
+from config import Config
+
+bind = f"{Config.HOST}:{Config.PORT}"
+# Background jobs (/jobs/<id>) and /metrics counters live in the worker process
+# that handled the request, so the default is one worker scaled with threads.
+# With WEB_CONCURRENCY > 1 a job poll can reach a worker that does not know the
+# job (404), and /metrics only reports the worker that answers the scrape.
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+threads = int(os.getenv("WEB_THREADS", "8"))
+preload_app = Config.PRELOAD
+
+def when_ready(server):
+    # keep the cyclic GC from touching (and so copying) the preloaded objects in every worker
+    if preload_app:
+        gc.freeze()
@@ -0,0 +1,105 @@
+import time
+import uuid
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("energy_optim.jobs")
+
+_current = threading.local()
+
+def report_progress(fraction, message=None):
+    """Record progress (0..1) for the job running on this thread; a no-op outside jobs."""
+    job = getattr(_current, "job", None)
+    if job is not None:
+        job.progress = max(0.0, min(1.0, float(fraction)))
+        if message is not None:
+            job.message = message
+
+class Job:
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "queued"
+        self.progress = 0.0
+        self.message = None
+        self.result = None
+        self.status_code = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def to_dict(self):
+        out = {"job_id": self.id, "status": self.status, "progress": self.progress, "message": self.message}
+        if self.status == "done":
+            out["result"] = self.result
+            out["status_code"] = self.status_code
+        elif self.status == "failed":
+            out["error"] = self.error
+        return out
+
+class JobQueue:
+    """
+    In-process job runner: a bounded thread pool plus an id -> Job table, so
+    long requests can run in the background without an external broker.
+    Submissions with the same key while one is queued or running share that
+    job; finished jobs are kept for ttl seconds after they complete.
+    """
+    def __init__(self, workers=2, max_pending=32, ttl=3600):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="energy-job")
+        self._jobs = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, func, *args):
+        """
+        Queue func(*args) and return (job, coalesced). Raises RuntimeError when
+        max_pending jobs are already waiting or running.
+        """
+        with self._lock:
+            self._expire()
+            existing = self._inflight.get(key)
+            if existing is not None:
+                return existing, True
+            if sum(job.active for job in self._jobs.values()) >= self.max_pending:
+                raise RuntimeError("job queue is full")
+            job = Job(key)
+            self._jobs[job.id] = job
+            self._inflight[key] = job
+        self._pool.submit(self._run, job, func, args)
+        return job, False
+
+    def get(self, job_id):
+        with self._lock:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def _run(self, job, func, args):
+        job.status = "running"
+        _current.job = job
+        try:
+            job.result, job.status_code = func(*args)
+            job.status = "done"
+        except Exception as e:
+            logger.exception("job %s failed", job.id)
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            _current.job = None
+            job.progress = 1.0
+            job.finished = time.time()
+            with self._lock:
+                if self._inflight.get(job.key) is job:
+                    del self._inflight[job.key]
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished is not None and j.finished < cutoff]:
+            del self._jobs[job_id]
@@ -1,24 +1,185 @@
+import os
+import re
 import json
+import time
+import uuid
+import random
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
 import requests
+from requests.adapters import HTTPAdapter
 from config import Config
+from telemetry import inc, observe, timed
+
+logger = logging.getLogger("energy_optim.llm")
+
+_METRIC_PATTERNS = {k: re.compile(rf"{k}=([0-9\\.]+)") for k in ("total_kwh", "avg_hourly_kwh", "peak_hour", "price_per_kwh", "shift_kwh", "shift_usd_savings")}
+_WHITESPACE = re.compile(r"\s+")
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+def normalize_prompt(text):
+    return _WHITESPACE.sub(" ", text or "").strip()
+
+class ResponseCache:
+    """
+    LRU of LLM responses keyed by normalized prompts, with a TTL. When `path`
+    is set, entries are also written there as one JSON file per key so they
+    survive restarts; files past the TTL or beyond `max_bytes` (oldest first)
+    are evicted on every write.
+    """
+    def __init__(self, maxsize=256, ttl=24 * 3600, path=None, max_bytes=64 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        raw = json.dumps([normalize_prompt(p) for p in parts])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + ".json")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl:
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                del self._entries[key]
+        if not self.path:
+            return None
+        try:
+            with open(self._file(key), encoding="utf-8") as fh:
+                created, value = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return None
+        if now - created > self.ttl:
+            _remove(self._file(key))
+            return None
+        self._remember(key, created, value)
+        return value
+
+    def put(self, key, value):
+        created = time.time()
+        self._remember(key, created, value)
+        if self.path:
+            tmp = f"{self._file(key)}.tmp-{uuid.uuid4().hex}"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump([created, value], fh)
+            os.replace(tmp, self._file(key))
+            self.evict()
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if now - st.st_mtime > self.ttl:
+                _remove(path)
+            else:
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+
+    def _remember(self, key, created, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (created, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+class RateLimiter:
+    """At most `concurrency` calls in flight and, if rate > 0, call starts spaced 1/rate seconds apart."""
+    def __init__(self, concurrency=4, rate=0.0):
+        self._slots = threading.BoundedSemaphore(max(1, concurrency))
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._slots.acquire()
+        if self._interval:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next)
+                self._next = start + self._interval
+            if start > now:
+                time.sleep(start - now)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._slots.release()
+        return False
 
 class LLMClient:
+    """
+    Meant to be created once and shared: it holds a keep-alive session, the
+    concurrency/rate limiter and the response cache for external calls.
+    """
     def __init__(self):
         self.api_key = Config.OPENAI_API_KEY
         self.api_url = Config.OPENAI_API_URL
+        self.model = Config.LLM_MODEL
+        self.timeout = Config.LLM_TIMEOUT
+        self.max_retries = Config.LLM_MAX_RETRIES
+        self.limiter = RateLimiter(Config.LLM_MAX_CONCURRENCY, Config.LLM_RATE_PER_SEC)
+        self.cache = ResponseCache(Config.LLM_CACHE_SIZE, Config.LLM_CACHE_TTL_SECONDS, Config.LLM_CACHE_DIR or None,
+                                   int(Config.LLM_CACHE_MAX_MB * 1024 * 1024))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, Config.LLM_MAX_CONCURRENCY))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
     def generate(self, system_prompt: str, user_prompt: str) -> str:
         """
-        If OPENAI_API_KEY is set, perform an external call (OpenAI-compatible).
+        If OPENAI_API_KEY is set, perform an external call (OpenAI-compatible),
+        answering repeated prompts from the response cache.
         Otherwise, use a simple rule-based generator to produce JSON recommendations.
         """
         if self.api_key and self.api_key.strip() != "":
-            return self._call_external(system_prompt, user_prompt)
+            key = ResponseCache.key(self.model, system_prompt, user_prompt)
+            cached = self.cache.get(key)
+            inc("energy_llm_cache_total", result="hit" if cached is not None else "miss")
+            if cached is not None:
+                logger.info("llm cache hit")
+                return cached
+            resp = self._call_external(system_prompt, user_prompt)
+            self.cache.put(key, resp)
+            return resp
         return self._rule_based(system_prompt, user_prompt)
 
+    @timed("llm.call")
     def _call_external(self, system_prompt, user_prompt):
         payload = {
-            "model": "gpt-4o-mini",
+            "model": self.model,
             "messages": [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
@@ -27,25 +188,50 @@ class LLMClient:
             "temperature": 0.2
         }
         headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
-        r = requests.post(self.api_url, json=payload, headers=headers, timeout=30)
-        r.raise_for_status()
-        j = r.json()
-        return j["choices"][0]["message"]["content"]
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            t0 = time.perf_counter()
+            try:
+                with self.limiter:
+                    r = self.session.post(self.api_url, json=payload, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                observe("energy_llm_request_duration_seconds", time.perf_counter() - t0, outcome=type(e).__name__)
+                if last:
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                observe("energy_llm_request_duration_seconds", time.perf_counter() - t0, outcome=str(r.status_code))
+                if r.status_code not in _RETRY_STATUS or last:
+                    r.raise_for_status()
+                    j = r.json()
+                    return j["choices"][0]["message"]["content"]
+                delay = self._backoff(attempt, r.headers.get("Retry-After"))
+            logger.warning("llm call failed (attempt %d), retrying in %.2fs", attempt + 1, delay)
+            time.sleep(delay)
+
+    @staticmethod
+    def _backoff(attempt, retry_after=None):
+        try:
+            return min(float(retry_after), 60.0)
+        except (TypeError, ValueError):
+            return min(0.5 * 2 ** attempt, 30.0) * (0.5 + random.random() / 2)
 
     def _rule_based(self, system_prompt, user_prompt):
         """
         Very small heuristic generator that extracts a few metrics and returns JSON suggestions.
         The prompt is expected to contain strings like: total_kwh=XXX, peak_hour=HH, price_per_kwh=Y.YY
+        and, when a tariff was given, shift_kwh=X shift_usd_savings=Y from the load-shifting optimizer.
         """
-        import re
         def find_num(k):
-            m = re.search(rf"{k}=([0-9\\.]+)", user_prompt)
+            m = _METRIC_PATTERNS[k].search(user_prompt)
             return float(m.group(1)) if m else None
 
         total_kwh = find_num("total_kwh")
         avg = find_num("avg_hourly_kwh")
         peak = find_num("peak_hour")
         price = find_num("price_per_kwh") or 0.15
+        shift_kwh = find_num("shift_kwh") or 0
+        shift_usd = find_num("shift_usd_savings") or 0
 
         immediate = []
         scheduled = []
@@ -68,9 +254,10 @@ class LLMClient:
 
         scheduled.append({
             "title": "Shift flexible loads to off-peak hours",
-            "description": "Schedule EV charging, dishwashers, and laundry during off-peak/night.",
+            "description": "Schedule EV charging, dishwashers, and laundry during off-peak/night."
+                           + (f" About {shift_kwh:g} kWh can move to cheaper hours." if shift_kwh else ""),
             "estimated_kwh_savings": 0,
-            "estimated_usd_savings": 0
+            "estimated_usd_savings": round(shift_usd, 2)
         })
 
         investment.append({
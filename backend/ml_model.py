@@ -1,12 +1,24 @@
 import numpy as np
 import pandas as pd
-from sklearn.ensemble import GradientBoostingRegressor, IsolationForest
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import lfilter
+from sklearn.base import BaseEstimator, RegressorMixin
+from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor, IsolationForest
+from sklearn.linear_model import Ridge
 from sklearn.model_selection import train_test_split
 import logging
+import time
+import zlib
+from telemetry import span, timed
 
 logger = logging.getLogger("energy_optim.ml")
 
+def series_seed(base_seed, series_key):
+    """Deterministic per-series random_state, independent of fit order or worker."""
+    return (base_seed + zlib.crc32(str(series_key).encode("utf-8"))) % (2 ** 32)
+
 def create_lag_features(df, value_col='energy_kwh', lags=24):
+    """DataFrame form of the lag features, for ad-hoc analysis; Forecaster uses LagFeatures."""
     df = df.copy().sort_values('timestamp')
     for lag in range(1, lags+1):
         df[f'lag_{lag}'] = df[value_col].shift(lag)
@@ -14,49 +26,564 @@ def create_lag_features(df, value_col='energy_kwh', lags=24):
     df = df.dropna().reset_index(drop=True)
     return df
 
-class Forecaster:
-    def __init__(self, lags=24):
+def series_arrays(df, value_col='energy_kwh'):
+    """Return (values, timestamps) in time order as a float ndarray and a DatetimeIndex."""
+    index = pd.DatetimeIndex(df['timestamp'])
+    values = df[value_col].to_numpy(dtype=float)
+    if not index.is_monotonic_increasing:
+        order = np.argsort(index.asi8)
+        order = np.concatenate([order[~index.isna()[order]], order[index.isna()[order]]])
+        index, values = index.take(order), values[order]
+    return values, index
+
+class LagFeatures:
+    """
+    Lag/calendar design matrix shared by Forecaster training and inference.
+    Lags are read through a strided sliding-window view of one contiguous float
+    array and written straight into a single preallocated feature matrix, so
+    no per-lag columns or intermediate frames are materialized.
+    lags: int n for 1..n, or any iterable of lags (e.g. [*range(1, 25), 168]).
+    calendar: any of 'hour', 'weekday', 'holiday' (1.0 on dates in `holidays`).
+    """
+    CALENDAR = ('hour', 'weekday', 'holiday')
+
+    def __init__(self, lags=24, calendar=('hour',), holidays=()):
+        self.lags = tuple(range(1, lags + 1)) if isinstance(lags, int) else tuple(sorted(set(lags)))
+        unknown = set(calendar) - set(self.CALENDAR)
+        if unknown:
+            raise ValueError(f"unknown calendar features: {sorted(unknown)}")
+        self.calendar = tuple(calendar)
+        self.holidays = tuple(sorted({str(pd.Timestamp(d).date()) for d in holidays}))
+
+    @property
+    def max_lag(self):
+        return self.lags[-1]
+
+    @property
+    def names(self):
+        return [f'lag_{k}' for k in self.lags] + list(self.calendar)
+
+    def get_params(self):
+        return {'lags': list(self.lags), 'calendar': list(self.calendar), 'holidays': list(self.holidays)}
+
+    def fill_calendar(self, out, index):
+        """Write calendar columns for `index` into `out` (rows x len(calendar)); NaT rows become NaN."""
+        if index.tz is not None:
+            index = index.tz_localize(None)
+        for j, name in enumerate(self.calendar):
+            if name == 'hour':
+                out[:, j] = index.hour
+            elif name == 'weekday':
+                out[:, j] = index.weekday
+            else:
+                out[:, j] = np.isin(index.normalize().values.astype('datetime64[D]'), np.array(self.holidays, dtype='datetime64[D]'))
+        out[index.isna()] = np.nan
+
+    @timed('lags', rows=lambda xy: len(xy[0]))
+    def training_matrix(self, values, index, horizon=1):
+        """
+        Build (X, Y) from a time-ordered series. Row i targets position
+        t = max_lag + i; Y holds the next `horizon` values from t onwards
+        as a view into `values`. Rows with any missing input are dropped.
+        """
+        values = np.ascontiguousarray(values, dtype=float)
+        width = self.max_lag + horizon
+        rows = max(len(values) - width + 1, 0)
+        X = np.empty((rows, len(self.lags) + len(self.calendar)))
+        if rows == 0:
+            return X, np.empty((0, horizon))
+        win = sliding_window_view(values, width)
+        for j, k in enumerate(self.lags):
+            X[:, j] = win[:, self.max_lag - k]
+        self.fill_calendar(X[:, len(self.lags):], index[self.max_lag:self.max_lag + rows])
+        Y = win[:, self.max_lag:]
+        keep = ~(np.isnan(X).any(axis=1) | np.isnan(Y).any(axis=1))
+        if not keep.all():
+            X, Y = X[keep], Y[keep]
+        return X, Y
+
+def lag_window(df, lags, value_col='energy_kwh'):
+    """
+    Return (window, last_timestamp) where window holds the last `lags` values
+    oldest-first, front-padded with the series mean when the history is short.
+    Only the timestamps are sorted; the frame itself is never copied.
+    """
+    vals, index = series_arrays(df, value_col)
+    window = vals[-lags:]
+    if len(window) < lags:
+        window = np.concatenate([np.full(lags - len(window), vals.mean()), window])
+    return window, index[-1]
+
+class SeasonalBaseline(BaseEstimator, RegressorMixin):
+    """
+    Seasonal-naive / seasonal-mean forecaster on the lag matrix: predicts the
+    mean of the lag columns that are multiples of `period` (just lag_period
+    with the default 1..24 lags). Nothing to fit.
+    """
+    def __init__(self, lags=tuple(range(1, 25)), period=24):
+        self.lags = lags
+        self.period = period
+
+    def fit(self, X, y):
+        self.columns_ = [j for j, k in enumerate(self.lags) if k % self.period == 0]
+        if not self.columns_:
+            raise ValueError(f"seasonal baseline needs a lag that is a multiple of {self.period}")
+        return self
+
+    def predict(self, X):
+        return np.asarray(X)[:, self.columns_].mean(axis=1)
+
+class SeasonalNaive(SeasonalBaseline):
+    """Repeats the value one season ago (lag_period)."""
+    def fit(self, X, y):
+        if self.period not in self.lags:
+            raise ValueError(f"seasonal naive needs lag {self.period}")
+        self.columns_ = [list(self.lags).index(self.period)]
+        return self
+
+class ExpSmoothing(BaseEstimator, RegressorMixin):
+    """
+    Simple exponential smoothing over the lag window: the forecast is the
+    alpha-weighted level sum(alpha * (1 - alpha) ** (k - 1) * lag_k), normalized
+    over the available lags. alpha is picked from `alphas` by least squares.
+    """
+    def __init__(self, lags=tuple(range(1, 25)), alphas=tuple(round(0.05 * i, 2) for i in range(1, 21))):
         self.lags = lags
-        self.model = GradientBoostingRegressor()
+        self.alphas = alphas
+
+    def _weights(self, alpha):
+        k = np.asarray(self.lags, dtype=float)
+        w = alpha * (1 - alpha) ** (k - 1)
+        return w / w.sum()
+
+    def fit(self, X, y):
+        L = np.asarray(X)[:, :len(self.lags)]
+        sse = [float(((L @ self._weights(a) - y) ** 2).sum()) for a in self.alphas]
+        self.alpha_ = self.alphas[int(np.argmin(sse))]
+        self.weights_ = self._weights(self.alpha_)
+        return self
+
+    def predict(self, X):
+        return np.asarray(X)[:, :len(self.lags)] @ self.weights_
+
+# cheapest first; 'auto' walks this list and keeps the first engine that is accurate enough
+ENGINES = ('seasonal_naive', 'seasonal_mean', 'exp_smoothing', 'ridge', 'hist_gbr', 'gbr')
+# engines that can fit a multi-output (direct-mode) target
+DIRECT_ENGINES = ('ridge',)
+
+def make_engine(name, features, random_state=None):
+    if name == 'gbr':
+        return GradientBoostingRegressor(random_state=random_state)
+    if name == 'hist_gbr':
+        return HistGradientBoostingRegressor(random_state=random_state)
+    if name == 'ridge':
+        return Ridge()
+    if name == 'seasonal_naive':
+        return SeasonalNaive(lags=features.lags)
+    if name == 'seasonal_mean':
+        return SeasonalBaseline(lags=features.lags)
+    if name == 'exp_smoothing':
+        return ExpSmoothing(lags=features.lags)
+    raise ValueError(f"unknown forecasting engine: {name}")
 
+class Forecaster:
+    """
+    Lag/calendar regressor. By default it forecasts recursively, one hour at a time,
+    feeding predictions back as lags. With `horizon` set it runs in direct mode:
+    one multi-output model predicts all `horizon` steps from a single window.
+    engine: one of ENGINES, or 'auto' to fit them cheapest-first and keep the first
+    whose holdout R2 reaches auto_threshold (else the most accurate one).
+    Defaults to 'gbr' for recursive and 'ridge' for direct mode.
+    """
+    def __init__(self, lags=24, horizon=None, calendar=('hour',), holidays=(), random_state=None, engine=None, auto_threshold=0.5):
+        self.features = LagFeatures(lags, calendar, holidays)
+        self.horizon = horizon
+        self.random_state = random_state
+        self.engine = engine or ('gbr' if horizon is None else 'ridge')
+        self.auto_threshold = auto_threshold
+        allowed = ENGINES if horizon is None else DIRECT_ENGINES
+        if self.engine != 'auto' and self.engine not in allowed:
+            raise ValueError(f"engine must be one of {', '.join(allowed)} or auto" + (" in direct mode" if horizon is not None else ""))
+        self.model = None if self.engine == 'auto' else make_engine(self.engine, self.features, random_state)
+        self.engine_used = None if self.engine == 'auto' else self.engine
+        self.report = {}
+        self.r2 = None
+
+    @property
+    def lags(self):
+        return self.features.max_lag
+
+    def get_params(self):
+        params = {**self.features.get_params(), 'horizon': self.horizon, 'engine': self.engine, 'random_state': self.random_state}
+        if self.engine == 'auto':
+            params['auto_threshold'] = self.auto_threshold
+        else:
+            params.update(self.model.get_params())
+        return params
+
+    def _engine(self, name):
+        return make_engine(name, self.features, self.random_state)
+
+    @timed('model.fit')
     def train(self, df, value_col='energy_kwh'):
-        Xy = create_lag_features(df, value_col, lags=self.lags)
-        X = Xy[[c for c in Xy.columns if c.startswith('lag_')] + ['hour']]
-        y = Xy[value_col]
+        values, index = series_arrays(df, value_col)
+        X, Y = self.features.training_matrix(values, index, self.horizon or 1)
+        return self._select(X, Y)
+
+    def _select(self, X, Y):
+        """Fit the engine (or, for 'auto', the candidates) on a holdout split of (X, Y); returns R2."""
+        y = Y if self.horizon is not None else Y[:, 0]
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-        self.model.fit(X_train, y_train)
-        score = self.model.score(X_test, y_test)
-        logger.info('Forecaster R2: %s', score)
-        return float(score)
+        if self.engine != 'auto':
+            candidates = [(self.engine, self.model)]
+        else:
+            names = ENGINES if self.horizon is None else DIRECT_ENGINES
+            candidates = ((name, self._engine(name)) for name in names)
+        best = None
+        for name, model in candidates:
+            t0 = time.perf_counter()
+            try:
+                model.fit(X_train, y_train)
+            except ValueError as e:
+                # a baseline may not apply to this lag set; auto just moves on
+                if self.engine != 'auto':
+                    raise
+                logger.info('Forecaster engine %s skipped: %s', name, e)
+                continue
+            t1 = time.perf_counter()
+            score = float(model.score(X_test, y_test))
+            t2 = time.perf_counter()
+            self.report[name] = {'r2': score, 'fit_ms': round((t1 - t0) * 1000, 3), 'predict_ms': round((t2 - t1) * 1000, 3)}
+            if best is None or score > best[2]:
+                best = (name, model, score)
+            if self.engine == 'auto' and score >= self.auto_threshold:
+                best = (name, model, score)
+                break
+        self.engine_used, self.model, score = best
+        logger.info('Forecaster R2: %s (%s)', score, self.engine_used)
+        self.r2 = score
+        return self.r2
 
-    def predict_next_n(self, df, n_steps=24, value_col='energy_kwh'):
-        df_copy = df.copy().sort_values('timestamp').reset_index(drop=True)
-        preds = []
-        last = df_copy[value_col].tolist()
+    @timed('model.predict', rows=lambda out: out.size)
+    def predict_batch(self, windows, last_timestamps, n_steps=24, static=None):
+        """
+        Forecast many series with this model at once.
+        windows: (n_series, max_lag) array of recent values, oldest first.
+        last_timestamps: each series' last observed timestamp.
+        static: optional (n_series, k) per-series features appended after the calendar ones.
+        Returns an (n_series, n_steps) array. Recursive mode advances all series
+        in lockstep with one predict call per step; direct mode uses one call.
+        """
+        windows = np.asarray(windows, dtype=float)
+        n_series = len(windows)
+        n_lags = len(self.features.lags)
+        lag_idx = np.asarray(self.features.lags)
+        steps = n_steps if self.horizon is None else 1
+        # calendar features of every future step, computed once up front
+        future = pd.DatetimeIndex(last_timestamps).repeat(steps) + pd.to_timedelta(np.tile(np.arange(1, steps + 1), n_series), unit='h')
+        cal = np.empty((n_series * steps, len(self.features.calendar)))
+        self.features.fill_calendar(cal, future)
+        cal = cal.reshape(n_series, steps, -1)
+        static = np.empty((n_series, 0)) if static is None else np.asarray(static, dtype=float)
+        X = np.empty((n_series, n_lags + cal.shape[2] + static.shape[1]))
+        X[:, n_lags + cal.shape[2]:] = static
+        n_cal = n_lags + cal.shape[2]
+        if self.horizon is not None:
+            if n_steps > self.horizon:
+                raise ValueError(f"direct-mode model was trained for horizon {self.horizon}, got {n_steps}")
+            X[:, :n_lags] = windows[:, -lag_idx]
+            X[:, n_lags:n_cal] = cal[:, 0]
+            return self.model.predict(X)[:, :n_steps]
+        # ring buffer: slot `head` holds the oldest value and is overwritten next
+        ring = windows.copy()
+        head = 0
+        out = np.empty((n_series, n_steps))
         for step in range(n_steps):
-            lags = last[-self.lags:]
-            if len(lags) < self.lags:
-                lags = [np.mean(last)] * (self.lags - len(lags)) + lags
-            hour = (df_copy['timestamp'].iloc[-1] + pd.Timedelta(hours=step + 1)).hour
-            X = np.array(lags[::-1] + [hour]).reshape(1, -1)
-            yhat = float(self.model.predict(X)[0])
-            preds.append(yhat)
-            last.append(yhat)
-        start = df_copy['timestamp'].iloc[-1] + pd.Timedelta(hours=1)
-        ts = pd.date_range(start, periods=n_steps, freq='H')
-        return pd.DataFrame({'timestamp': ts, 'predicted': preds})
+            X[:, :n_lags] = ring[:, (head - lag_idx) % self.lags]
+            X[:, n_lags:n_cal] = cal[:, step]
+            yhat = self.model.predict(X)
+            out[:, step] = yhat
+            ring[:, head] = yhat
+            head = (head + 1) % self.lags
+        return out
+
+    def predict_next_n(self, df, n_steps=24, value_col='energy_kwh'):
+        window, last = lag_window(df, self.lags, value_col)
+        preds = self.predict_batch(window[None, :], [last], n_steps)[0]
+        return _forecast_frame(last, preds)
+
+def _forecast_frame(last, preds):
+    start = last + pd.Timedelta(hours=1)
+    ts = pd.date_range(start, periods=len(preds), freq='h')
+    return pd.DataFrame({'timestamp': ts, 'predicted': preds})
+
+class GlobalForecaster(Forecaster):
+    """
+    One Forecaster fitted on many series stacked together (e.g. every appliance
+    or meter of a dataset), instead of one model per series. Each series is
+    divided by its scale (mean absolute value) so series of different size
+    share lag patterns, and the model also sees a series-id and log-scale
+    feature. Inference runs all series through one predict_batch call.
+    Defaults to 'hist_gbr', which handles the larger stacked matrix best and
+    treats the series id as categorical when there are at most 255 series.
+    train() and forecast_all() take a SeriesMatrix or a long frame with a
+    `series_col` column; series unseen at training time are forecast with
+    their own window's scale and no id. forecast_all() puts every series on
+    the hourly grid after the latest reading of any series: one that ends
+    earlier is rolled forward over its gap first, so the per-timestamp total
+    always sums every series.
+    """
+    MAX_CATEGORIES = 255
+
+    def __init__(self, lags=24, horizon=None, calendar=('hour',), holidays=(), random_state=None, engine=None, auto_threshold=0.5):
+        super().__init__(lags, horizon, calendar, holidays, random_state, engine or ('hist_gbr' if horizon is None else 'ridge'), auto_threshold)
+        self.keys = []
+        self.scales = np.empty(0)
+
+    def _engine(self, name):
+        model = super()._engine(name)
+        if isinstance(model, HistGradientBoostingRegressor) and 0 < len(self.keys) <= self.MAX_CATEGORIES:
+            n = len(self.features.names)
+            model.set_params(categorical_features=np.arange(n + 2) == n)
+        return model
+
+    def _static(self, codes, scales):
+        return np.column_stack([codes, np.log(scales)])
+
+    @staticmethod
+    def _scale(values):
+        scale = np.nanmean(np.abs(values)) if len(values) else np.nan
+        return scale if np.isfinite(scale) and scale > 0 else 1.0
+
+    @staticmethod
+    def _series(data, value_col, series_col):
+        """(key, frame) per series in key order."""
+        if isinstance(data, pd.DataFrame):
+            return [(str(key), grp) for key, grp in data.groupby(series_col, sort=True)]
+        return [(key, data.frame(key, value_col)) for key in sorted(data.labels.tolist())]
+
+    @timed('model.fit')
+    def train(self, df, value_col='energy_kwh', series_col='series'):
+        groups = self._series(df, value_col, series_col)
+        self.keys = [key for key, _ in groups]
+        scales, blocks = [], []
+        for code, (_, grp) in enumerate(groups):
+            values, index = series_arrays(grp, value_col)
+            scale = self._scale(values)
+            X, Y = self.features.training_matrix(values / scale, index, self.horizon or 1)
+            blocks.append((np.hstack([X, self._static(np.full(len(X), code), np.full(len(X), scale))]), Y))
+            scales.append(scale)
+        self.scales = np.asarray(scales)
+        X = np.vstack([b[0] for b in blocks])
+        Y = np.vstack([b[1] for b in blocks])
+        if self.engine != 'auto':
+            self.model = self._engine(self.engine)
+        return self._select(X, Y)
+
+    def forecast_all(self, df, n_steps=24, value_col='energy_kwh', series_col='series', max_gap=None):
+        """
+        Forecast every series of df (see train) for the n_steps hours after the
+        latest reading of any series; returns {series key: frame of timestamp/predicted}.
+        Raises ValueError if a series ends more than max_gap hours before that reading,
+        or if a direct-mode model's horizon does not cover n_steps plus the largest gap.
+        """
+        codes = {key: i for i, key in enumerate(self.keys)}
+        keys, windows, lasts, static = [], [], [], []
+        for key, grp in self._series(df, value_col, series_col):
+            window, last = lag_window(grp, self.lags, value_col)
+            code = codes.get(key, -1)
+            scale = self.scales[code] if code >= 0 else self._scale(window)
+            keys.append(key)
+            windows.append(window / scale)
+            lasts.append(last)
+            static.append((code, scale))
+        if not keys:
+            return {}
+        common = max(lasts)
+        gaps = np.array([int(np.ceil((common - last) / pd.Timedelta(hours=1))) for last in lasts])
+        if max_gap is not None and gaps.max() > max_gap:
+            stale = [key for key, gap in zip(keys, gaps) if gap > max_gap]
+            raise ValueError(f"series ending more than {max_gap}h before the latest reading: {', '.join(map(str, stale))}")
+        if self.horizon is not None and n_steps + gaps.max() > self.horizon:
+            raise ValueError(f"series trail the latest reading by up to {gaps.max()}h; "
+                             f"a direct-mode model needs horizon >= {n_steps + gaps.max()}, has {self.horizon}")
+        codes_, scales = np.asarray(static).T
+        preds = self.predict_batch(np.stack(windows), lasts, n_steps + gaps.max(), self._static(codes_, scales)) * scales[:, None]
+        return {key: _forecast_frame(common, row[gap:gap + n_steps]) for key, gap, row in zip(keys, gaps, preds)}
+
+def forecast_total(per_series):
+    """Aggregate forecast: the per-series predictions summed per timestamp."""
+    frames = list(per_series.values())
+    if not frames:
+        return pd.DataFrame({'timestamp': pd.Series(dtype='datetime64[ns]'), 'predicted': pd.Series(dtype=float)})
+    return pd.concat(frames).groupby('timestamp', as_index=False)['predicted'].sum()
+
+def predict_many(jobs, n_steps=24, value_col='energy_kwh'):
+    """
+    Forecast several series, each with its own fitted Forecaster.
+    jobs: iterable of (forecaster, df). Series sharing a forecaster are stacked
+    into one predict_batch call. Returns DataFrames in the order of jobs.
+    """
+    jobs = list(jobs)
+    windows = [lag_window(df, fore.lags, value_col) for fore, df in jobs]
+    by_model = {}
+    for i, (fore, _) in enumerate(jobs):
+        by_model.setdefault(id(fore), (fore, []))[1].append(i)
+    out = [None] * len(jobs)
+    for fore, idx in by_model.values():
+        preds = fore.predict_batch(np.stack([windows[i][0] for i in idx]), [windows[i][1] for i in idx], n_steps)
+        for row, i in zip(preds, idx):
+            out[i] = _forecast_frame(windows[i][1], row)
+    return out
 
 class AnomalyDetector:
-    def __init__(self):
-        self.model = IsolationForest(contamination=0.02, random_state=42)
+    def __init__(self, random_state=42):
+        self.model = IsolationForest(contamination=0.02, random_state=random_state)
+
+    def get_params(self):
+        return self.model.get_params()
 
     def fit(self, df, value_col='energy_kwh'):
         X = df[[value_col]].values
-        self.model.fit(X)
+        with span('anomaly.fit', rows=len(X)):
+            self.model.fit(X)
 
     def detect(self, df, value_col='energy_kwh'):
         X = df[[value_col]].values
-        preds = self.model.predict(X)
+        with span('anomaly.detect', rows=len(X)):
+            preds = self.model.predict(X)
         out = df.copy()
         out['anomaly'] = (preds == -1)
         return out
+
+class OnlineAnomalyDetector:
+    """
+    Streaming detector with O(1) state per point: an EWMA mean and variance per
+    seasonal bucket (hour of week by default, or hour of day with period=24).
+    Each reading is scored against its bucket's state before being absorbed,
+    so a call only touches readings newer than the last one seen. Buckets
+    with fewer than `warmup` readings never flag. `flagged` keeps the latest
+    `max_flagged` anomalies; n_flagged counts all of them.
+    """
+    def __init__(self, alpha=0.1, threshold=4.0, warmup=8, period=168, max_flagged=1000):
+        if period not in (24, 168):
+            raise ValueError("period must be 24 (hour of day) or 168 (hour of week)")
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self.period = period
+        self.max_flagged = max_flagged
+        self.reset()
+
+    def get_params(self):
+        return {'alpha': self.alpha, 'threshold': self.threshold, 'warmup': self.warmup, 'period': self.period}
+
+    def reset(self):
+        self.mean = np.zeros(self.period)
+        self.var = np.zeros(self.period)
+        self.count = np.zeros(self.period, dtype=np.int64)
+        self.last_ts = None
+        self.n_seen = 0
+        self.n_flagged = 0
+        self.flagged = pd.DataFrame({'timestamp': pd.Series(dtype='datetime64[ns]'), 'value': pd.Series(dtype=float), 'score': pd.Series(dtype=float)})
+
+    def to_dict(self):
+        """JSON-able state; flagged timestamps are kept as UTC ns plus their time zone."""
+        ts = pd.DatetimeIndex(self.flagged['timestamp'])
+        return {'params': self.get_params(), 'mean': self.mean.tolist(), 'var': self.var.tolist(), 'count': self.count.tolist(),
+                'last_ts': self.last_ts, 'n_seen': self.n_seen, 'n_flagged': self.n_flagged,
+                'flagged': {'timestamp': ts.asi8.tolist(), 'tz': str(ts.tz) if ts.tz is not None else None,
+                            'value': self.flagged['value'].tolist(), 'score': self.flagged['score'].tolist()}}
+
+    @classmethod
+    def from_dict(cls, data, max_flagged=1000):
+        det = cls(**data['params'], max_flagged=max_flagged)
+        det.mean, det.var = np.asarray(data['mean'], dtype=float), np.asarray(data['var'], dtype=float)
+        det.count = np.asarray(data['count'], dtype=np.int64)
+        det.last_ts, det.n_seen, det.n_flagged = data['last_ts'], data['n_seen'], data['n_flagged']
+        flagged = data['flagged']
+        if flagged['timestamp']:
+            ts = pd.DatetimeIndex(np.asarray(flagged['timestamp'], dtype='datetime64[ns]'))
+            ts = ts.tz_localize('UTC').tz_convert(flagged['tz']) if flagged['tz'] else ts
+            det.flagged = pd.DataFrame({'timestamp': ts, 'value': flagged['value'], 'score': flagged['score']}).iloc[-max_flagged:].reset_index(drop=True)
+        return det
+
+    def _buckets(self, index):
+        if index.tz is not None:
+            index = index.tz_localize(None)
+        hour = index.hour.to_numpy()
+        return hour if self.period == 24 else index.weekday.to_numpy() * 24 + hour
+
+    def update(self, index, values):
+        """
+        Score then absorb time-ordered readings. Returns (z-scores, anomaly flags).
+        The per-point EWMA recurrences are evaluated per bucket with lfilter.
+        """
+        values = np.asarray(values, dtype=float)
+        z = np.zeros(len(values))
+        flags = np.zeros(len(values), dtype=bool)
+        buckets = self._buckets(index)
+        a = self.alpha
+        for b in np.unique(buckets):
+            pos = np.flatnonzero(buckets == b)
+            x = values[pos]
+            m0, v0, c0 = self.mean[b], self.var[b], self.count[b]
+            if c0 == 0:
+                m0, v0 = x[0], 0.0
+            m = lfilter([a], [1, a - 1], x, zi=[(1 - a) * m0])[0]
+            m_prev = np.concatenate([[m0], m[:-1]])
+            d = x - m_prev
+            v = lfilter([(1 - a) * a], [1, a - 1], d ** 2, zi=[(1 - a) * v0])[0]
+            v_prev = np.concatenate([[v0], v[:-1]])
+            z[pos] = d / np.sqrt(np.maximum(v_prev, 1e-12))
+            flags[pos] = (c0 + np.arange(len(x)) >= self.warmup) & (np.abs(z[pos]) > self.threshold)
+            self.mean[b], self.var[b], self.count[b] = m[-1], v[-1], c0 + len(x)
+        return z, flags
+
+    @timed('anomaly.online', rows=len)
+    def score_new(self, df, value_col='energy_kwh', seen=None):
+        """
+        Score the rows of df that are newer than the last reading seen and return
+        them with 'score' and 'anomaly' columns. If previously seen history no
+        longer matches (the dataset was replaced, not appended to), state is rebuilt.
+        df may hold only the newer rows when `seen` gives the caller's count of
+        readings at or before the last one seen.
+        """
+        index = pd.DatetimeIndex(df['timestamp'])
+        values = df[value_col].to_numpy(dtype=float)
+        ts = index.asi8
+        valid = ~index.isna() & ~np.isnan(values)
+        if self.last_ts is not None:
+            if seen is None:
+                seen = int((valid & (ts <= self.last_ts)).sum())
+            if seen != self.n_seen:
+                logger.info('OnlineAnomalyDetector history changed; rebuilding state')
+                self.reset()
+        new = valid if self.last_ts is None else valid & (ts > self.last_ts)
+        rows = np.flatnonzero(new)
+        rows = rows[np.argsort(ts[rows], kind='stable')]
+        z, flags = self.update(index[rows], values[rows])
+        if len(rows):
+            self.n_seen += len(rows)
+            self.last_ts = int(ts[rows[-1]])
+        out = df.iloc[rows].assign(score=z, anomaly=flags)
+        if flags.any():
+            hits = pd.DataFrame({'timestamp': index[rows][flags], 'value': values[rows][flags], 'score': z[flags]})
+            self.flagged = hits if self.flagged.empty else pd.concat([self.flagged, hits], ignore_index=True)
+            self.flagged = self.flagged.iloc[-self.max_flagged:].reset_index(drop=True)
+            self.n_flagged += int(flags.sum())
+        return out
+
+def fit_series(model, df, value_col='energy_kwh'):
+    """Fit a Forecaster or AnomalyDetector on one series and return it; picklable for process pools."""
+    if isinstance(model, Forecaster):
+        model.train(df, value_col)
+    else:
+        model.fit(df, value_col)
+    return model
+
+def forecast_series(fore, df, n_steps=24, value_col='energy_kwh'):
+    return fore.predict_next_n(df, n_steps, value_col)
+
+def detect_series(detector, df, value_col='energy_kwh'):
+    return detector.detect(df, value_col)
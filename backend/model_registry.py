@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+import logging
+import pandas as pd
+from telemetry import inc, span
+from utils import joblib
+
+logger = logging.getLogger("energy_optim.registry")
+
+def content_hash(df):
+    """Stable digest of a frame's values (index ignored), used to key fitted models."""
+    if not isinstance(df, pd.DataFrame):
+        return df.content_hash()
+    h = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return hashlib.sha1(h.tobytes()).hexdigest()
+
+class ModelRegistry:
+    """
+    On-disk cache of fitted models under Config.MODEL_PATH.
+    Entries are keyed by training-data content hash, series key, model type and
+    hyperparameters, so a dataset that has not changed is never refit.
+    Files idle for longer than max_age seconds are dropped, then the least
+    recently used ones until the directory fits in max_bytes.
+    """
+    def __init__(self, root, max_age=7 * 24 * 3600, max_bytes=512 * 1024 * 1024):
+        self.root = root
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, kind, data_hash, series_key, params):
+        raw = json.dumps([kind, data_hash, str(series_key), params], sort_keys=True, default=str)
+        return f"{kind}-{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+    def _path(self, key):
+        return os.path.join(self.root, key + ".joblib")
+
+    def load(self, key):
+        path = self._path(key)
+        try:
+            with span("model.load"):
+                model = joblib.load(path)
+        except (FileNotFoundError, EOFError):
+            return None
+        os.utime(path)
+        return model
+
+    def save(self, key, model):
+        path = self._path(key)
+        tmp = f"{path}.tmp-{uuid.uuid4().hex}"
+        with span("model.save"):
+            joblib.dump(model, tmp)
+        os.replace(tmp, path)
+        self.evict()
+
+    def get_or_fit(self, model, df, series_key, fit):
+        """
+        Return (fitted model, hit). `model` is a fresh unfitted instance whose
+        get_params() identifies the configuration; `fit(model, df)` trains it
+        and returns it.
+        """
+        return self.get_or_fit_many([(model, df, series_key)], fit)[0]
+
+    def get_or_fit_many(self, items, fit, mapper=None):
+        """
+        Batch form of get_or_fit over (model, df, series_key) items. Cache
+        misses are fitted through `mapper(fit, [(model, df), ...])`, e.g. a
+        process-pool map; lookups and saves stay in the calling process.
+        """
+        results = [None] * len(items)
+        pending = []
+        for i, (model, df, series_key) in enumerate(items):
+            kind = type(model).__name__
+            key = self.key(kind, content_hash(df), series_key, model.get_params())
+            cached = self.load(key)
+            inc("energy_model_cache_total", kind=kind, result="hit" if cached is not None else "miss")
+            if cached is not None:
+                logger.info("model cache hit: %s %s", kind, series_key)
+                results[i] = (cached, True)
+            else:
+                logger.info("model cache miss: %s %s", kind, series_key)
+                pending.append((i, key))
+        with self._lock:
+            self.hits += len(items) - len(pending)
+            self.misses += len(pending)
+        if pending:
+            jobs = [(items[i][0], items[i][1]) for i, _ in pending]
+            fitted = mapper(fit, jobs) if mapper is not None else [fit(m, d) for m, d in jobs]
+            for (i, key), model in zip(pending, fitted):
+                self.save(key, model)
+                results[i] = (model, False)
+        return results
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith(".joblib"):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if now - st.st_mtime > self.max_age:
+                _remove(path)
+            else:
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,140 @@
+import threading
+import functools
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from telemetry import span
+
+try:
+    import cvxpy as cp
+except ImportError:  # optional: only needed for a household-level max_kw cap
+    cp = None
+
+# appliances treated as shiftable when a request does not list its own
+FLEXIBLE = ("ev_charger", "washer", "dryer", "dishwasher", "pool_pump", "water_heater")
+
+def hour_window(hours, window):
+    """Bool mask of `hours` inside [start, end] hour-of-day, inclusive; start > end wraps past midnight."""
+    hours = np.asarray(hours)
+    if window is None:
+        return np.ones(hours.shape, dtype=bool)
+    start, end = (int(h) % 24 for h in window)
+    if start <= end:
+        return (hours >= start) & (hours <= end)
+    return (hours >= start) | (hours <= end)
+
+def price_vector(prices, timestamps):
+    """
+    Per-step prices for `timestamps`: a list as long as the horizon is used as is,
+    a 24-entry list is a time-of-use tariff indexed by hour of day.
+    """
+    prices = np.asarray(prices, dtype=float)
+    if len(prices) == len(timestamps):
+        return prices
+    if len(prices) == 24:
+        return prices[pd.DatetimeIndex(timestamps).hour]
+    raise ValueError(f"prices must have 24 hourly entries or one per forecast step ({len(timestamps)})")
+
+def _greedy(base, price, ub):
+    """
+    Exact solution without a coupling cap: every (household, appliance) row is
+    a fractional knapsack, so its energy fills the cheapest allowed hours up to
+    ub, ties going to hours that already carry its load. Rows are solved at once.
+    """
+    energy = base.sum(axis=1)
+    order = np.lexsort((-base, price), axis=1)
+    cap = np.take_along_axis(ub, order, axis=1)
+    before = np.cumsum(cap, axis=1) - cap
+    take = np.clip(energy[:, None] - before, 0, cap)
+    out = np.empty_like(base)
+    np.put_along_axis(out, order, take, axis=1)
+    return out
+
+class ShiftLP:
+    """
+    Linear program for households whose flexible appliances share an hourly
+    headroom (import limit minus inflexible load). Built once per problem shape
+    with cvxpy Parameters, so later solves only swap in values and the solver
+    can warm-start from the previous solution.
+    """
+    def __init__(self, households, appliances, steps):
+        rows = households * appliances
+        self.x = cp.Variable((rows, steps), nonneg=True)
+        self.price = cp.Parameter((rows, steps))
+        self.ub = cp.Parameter((rows, steps), nonneg=True)
+        self.energy = cp.Parameter(rows, nonneg=True)
+        self.headroom = cp.Parameter((households, steps), nonneg=True)
+        per_household = sp.kron(sp.eye(households), np.ones((1, appliances)), format="csr")
+        constraints = [self.x <= self.ub, cp.sum(self.x, axis=1) == self.energy, per_household @ self.x <= self.headroom]
+        self.problem = cp.Problem(cp.Minimize(cp.sum(cp.multiply(self.price, self.x))), constraints)
+        self._lock = threading.Lock()
+
+    def solve(self, base, price, ub, headroom, solver=None):
+        """Optimal schedule, or None when the caps leave no feasible schedule."""
+        with self._lock:
+            self.price.value = price
+            self.ub.value = ub
+            self.energy.value = base.sum(axis=1)
+            self.headroom.value = headroom
+            self.problem.solve(solver=solver or None, warm_start=True)
+            if self.problem.status not in (cp.OPTIMAL, cp.OPTIMAL_INACCURATE):
+                return None
+            return np.clip(self.x.value, 0, ub)
+
+@functools.lru_cache(maxsize=8)
+def _lp(households, appliances, steps):
+    return ShiftLP(households, appliances, steps)
+
+def shift_loads(baseline, prices, max_kw, allowed=None, headroom=None, solver=None):
+    """
+    Cheapest schedule of flexible load for many households in one batch.
+    baseline: (H, A, T) forecast kWh per household, flexible appliance and hourly step;
+      each appliance's horizon total is kept and re-placed within its allowed hours.
+    prices: (H, T) per-step prices. max_kw: (H, A) per-step limit of each appliance.
+    allowed: optional (H, A, T) bool mask of hours an appliance may run.
+    headroom: optional (H, T) flexible kWh each household may draw per step; needs cvxpy.
+    Returns (schedule (H, A, T), shifted (H, A) bool, capped: whether headroom was honoured).
+    Rows whose energy does not fit in their allowed hours keep their baseline;
+    negative forecast values count as zero.
+    """
+    base = np.clip(np.asarray(baseline, dtype=float), 0.0, None)
+    H, A, T = base.shape
+    price = np.broadcast_to(np.asarray(prices, dtype=float)[:, None, :], base.shape).reshape(H * A, T)
+    ub = np.broadcast_to(np.asarray(max_kw, dtype=float)[:, :, None], base.shape).copy()
+    if allowed is not None:
+        ub[~np.asarray(allowed, dtype=bool)] = 0.0
+    ub = ub.reshape(H * A, T)
+    flat = base.reshape(H * A, T)
+    fits = flat.sum(axis=1) <= ub.sum(axis=1) * (1 + 1e-9) + 1e-9
+    # rows that cannot be shifted are pinned to their baseline
+    ub[~fits] = flat[~fits]
+    capped = headroom is not None
+    with span("optimize.solve", rows=H * A):
+        if capped:
+            if cp is None:
+                raise RuntimeError("a household max_kw needs cvxpy installed")
+            x = _lp(H, A, T).solve(flat, price, ub, np.maximum(np.asarray(headroom, dtype=float), 0.0), solver)
+            if x is None:
+                capped = False
+        if not capped:
+            x = _greedy(flat, price, ub)
+    return x.reshape(H, A, T), fits.reshape(H, A), capped
+
+def daily_shift(profiles, prices, max_kw=None, windows=None):
+    """
+    Average-day savings from shifting each flexible appliance's mean hourly
+    profile under a 24-hour tariff: returns (kWh moved per day, cost saved per day).
+    profiles: {appliance: 24 mean kWh}. max_kw defaults to twice each profile's peak.
+    """
+    names = [a for a in profiles if a in FLEXIBLE]
+    if not names:
+        return 0.0, 0.0
+    base = np.array([profiles[a] for a in names], dtype=float)[None]
+    price = np.asarray(prices, dtype=float)[None]
+    limit = np.array([(max_kw or {}).get(a, 2 * base[0, i].max()) for i, a in enumerate(names)])[None]
+    hours = np.arange(24)
+    allowed = np.array([hour_window(hours, (windows or {}).get(a)) for a in names])[None]
+    x, _, _ = shift_loads(base, price, limit, allowed)
+    moved = float(np.abs(x - base).sum() / 2)
+    saved = float(((base - x) * price[:, None, :]).sum())
+    return moved, saved
@@ -0,0 +1,113 @@
+import json
+import base64
+import datetime
+import numpy as np
+import pandas as pd
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+from telemetry import span
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder is used instead
+    orjson = None
+
+# Response encodings for row-shaped results:
+#   records   list of row objects (the original format)
+#   columnar  one array per column, datetimes as epoch milliseconds
+#   ndjson    streamed application/x-ndjson: a header object, then one row per line
+FORMATS = ("records", "columnar", "ndjson")
+
+def _orjson_default(o):
+    if isinstance(o, (datetime.date, datetime.datetime)):
+        return http_date(o)
+    if isinstance(o, np.generic):
+        return o.item()
+    return DefaultJSONProvider.default(o)
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider that encodes with orjson when it is installed. Output
+    matches the default provider (sorted keys, RFC 822 dates), except that
+    NaN/inf become null instead of invalid JSON tokens.
+    """
+    def dumps(self, obj, **kwargs):
+        # orjson only does compact output; indented (debug) dumps go through the stdlib
+        with span("json.encode"):
+            if orjson is None or set(kwargs) - {"separators"} or kwargs.get("separators", (",", ":")) != (",", ":"):
+                return super().dumps(obj, **kwargs)
+            opts = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+            if self.sort_keys:
+                opts |= orjson.OPT_SORT_KEYS
+            return orjson.dumps(obj, default=_orjson_default, option=opts).decode("utf-8")
+
+def dumps(obj):
+    """Compact JSON text, via orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_orjson_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, default=DefaultJSONProvider.default, separators=(",", ":"))
+
+def columnar(df):
+    """{column: [values...]} with datetimes as epoch milliseconds and missing values as null."""
+    out = {}
+    for c in df.columns:
+        s = df[c]
+        if pd.api.types.is_datetime64_any_dtype(s):
+            ns = pd.DatetimeIndex(s).asi8
+            vals = (ns // 1_000_000).astype(object)
+            vals[ns == np.iinfo(np.int64).min] = None
+            out[str(c)] = vals.tolist()
+        elif pd.api.types.is_float_dtype(s):
+            a = s.to_numpy()
+            out[str(c)] = np.where(np.isfinite(a), a, None).tolist() if not np.isfinite(a).all() else a.tolist()
+        else:
+            out[str(c)] = s.astype(object).where(s.notna(), None).tolist()
+    return out
+
+def iter_ndjson(df, head=None, chunk_rows=10_000):
+    """Yield NDJSON text: an optional header object line, then the rows (ISO timestamps) in bounded chunks."""
+    if head is not None:
+        yield dumps(head) + "\n"
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_json(orient="records", lines=True, date_format="iso", date_unit="ms", double_precision=15)
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(dumps(values).encode("utf-8")).decode("ascii")
+
+def decode_cursor(token):
+    """Inverse of encode_cursor; raises ValueError on a malformed token."""
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+
+def _key_values(df, keys):
+    return [pd.DatetimeIndex(df[k]).asi8 if pd.api.types.is_datetime64_any_dtype(df[k]) else df[k].astype(str).to_numpy()
+            for k in keys]
+
+def paginate(df, keys, limit, cursor=None):
+    """
+    Keyset pagination: sort by keys, keep rows strictly after the cursor (the
+    last key of the previous page) and return (page, next_cursor or None).
+    Datetime keys are compared as UTC nanoseconds, others as strings; cursors
+    stay valid when rows are appended to the underlying dataset.
+    """
+    df = df.sort_values(keys, kind="stable")
+    if cursor is not None:
+        after = decode_cursor(cursor)
+        kinds = [int if pd.api.types.is_datetime64_any_dtype(df[k]) else str for k in keys]
+        if (not isinstance(after, list) or len(after) != len(keys)
+                or any(type(v) is not kind for v, kind in zip(after, kinds))):
+            raise ValueError("invalid cursor")
+        cols = _key_values(df, keys)
+        mask = np.zeros(len(df), dtype=bool)
+        equal = np.ones(len(df), dtype=bool)
+        for col, val in zip(cols, after):
+            mask |= equal & (col > val)
+            equal &= col == val
+        df = df[mask]
+    page = df.iloc[:limit]
+    if len(df) <= limit:
+        return page, None
+    last = [v.item() if isinstance(v, np.generic) else v for v in (col[-1] for col in _key_values(page, keys))]
+    return page, encode_cursor(last)
@@ -0,0 +1,268 @@
+import os
+import shutil
+import uuid
+import numpy as np
+import pandas as pd
+from store import dataset_lock, read_manifest, read_sidecar, write_sidecar
+from dataset import SeriesMatrix, series_columns
+
+# A dataset's rollups live in <dataset>/rollups/: meta.json (columns, labels,
+# row count, kept levels) and <level>/<code>.bin, one array of REC per series
+# sorted by bucket. New readings only rewrite a series' trailing bucket and
+# append after it; a file is rewritten whole only for readings older than its
+# last bucket. Writers hold the dataset lock; readers take it shared and copy.
+ROLLUPS_DIR = "rollups"
+META_FILE = "meta.json"
+# rollup pyramid levels, finest first: name -> bucket width in ns
+LEVELS = {name: int(pd.Timedelta(name).value) for name in ("1h", "6h", "1D", "7D")}
+REC = np.dtype([("bucket", "<i8"), ("sum", "<f8"), ("count", "<i8"), ("min", "<f8"), ("max", "<f8")])
+
+def _utc_ns(s):
+    return pd.DatetimeIndex(s).asi8
+
+def _long_arrays(df, label_col, value_col):
+    """
+    (series codes, their labels, UTC ns timestamps, float values) sorted by
+    code then time, with rows lacking a timestamp or value dropped.
+    """
+    if isinstance(df, SeriesMatrix):
+        labels, ts, values = df.long_arrays()
+        code, uniques = pd.factorize(labels)
+    else:
+        ts = _utc_ns(df["timestamp"])
+        values = pd.to_numeric(df[value_col], errors="coerce").to_numpy(dtype=float)
+        keep = (ts != np.iinfo(np.int64).min) & ~np.isnan(values)
+        ts, values = ts[keep], values[keep]
+        # factorized after the filter, so series without a single reading (e.g. text-only) get no label
+        if label_col:
+            code, uniques = pd.factorize(df[label_col].to_numpy()[keep], use_na_sentinel=False)
+        else:
+            code, uniques = np.zeros(len(ts), dtype=np.intp), ["total"]
+    order = np.lexsort((ts, code))
+    return code[order], [str(u) for u in uniques], ts[order], values[order]
+
+def _resolution(code, ts):
+    """Median spacing (ns) of consecutive readings within a series (grouped by code, time-sorted), or None without any."""
+    steps = np.diff(ts)[code[1:] == code[:-1]]
+    steps = steps[steps > 0]
+    return int(np.median(steps)) if len(steps) else None
+
+def _combine(rec, start):
+    """One record per run of rec beginning at the indices in start."""
+    out = rec[start]
+    out["sum"] = np.add.reduceat(rec["sum"], start)
+    out["count"] = np.add.reduceat(rec["count"], start)
+    out["min"] = np.minimum.reduceat(rec["min"], start)
+    out["max"] = np.maximum.reduceat(rec["max"], start)
+    return out
+
+def _buckets(code, bucket, values):
+    """Aggregates of readings grouped by code and bucket-sorted within it, per (code, bucket): (codes, REC records)."""
+    rec = np.empty(len(code), dtype=REC)
+    rec["bucket"], rec["sum"], rec["count"] = bucket, values, 1
+    rec["min"] = rec["max"] = rec["sum"]
+    if not len(rec):
+        return code, rec
+    start = np.flatnonzero(np.r_[True, (code[1:] != code[:-1]) | (rec["bucket"][1:] != rec["bucket"][:-1])])
+    return code[start], _combine(rec, start)
+
+def _merge(old, new):
+    """Records of one series merged and sorted by bucket."""
+    rec = np.concatenate([old, new])
+    rec = rec[np.argsort(rec["bucket"], kind="stable")]
+    return _combine(rec, np.flatnonzero(np.r_[True, rec["bucket"][1:] != rec["bucket"][:-1]]))
+
+class Rollups:
+    """
+    Multi-resolution pyramid of per-series bucket aggregates (sum, count, min,
+    max) at the LEVELS coarser than the data's own spacing (finer ones would
+    just copy readings). Aggregates merge, so update() folds in upload chunks
+    or appended rows touching only each series' trailing bucket. With `root`
+    set, records go straight to files there and nothing is held in memory;
+    save() then commits the row count. update() also takes a SeriesMatrix;
+    like DatasetSummary, `rows` only counts long-form rows.
+    """
+    def __init__(self, root=None, label_col=None, value_col=None):
+        self.root = root
+        self.label_col = label_col
+        self.value_col = value_col
+        self.labels = []
+        self.rows = 0
+        self.levels = None  # chosen from the first readings seen
+        self._records = {}  # (level, code) -> REC array when root is None
+        if root:
+            os.makedirs(root, exist_ok=True)
+
+    def update(self, df):
+        if isinstance(df, SeriesMatrix):
+            if self.value_col is None:
+                self.label_col, self.value_col = df.label_col, df.value_col
+        else:
+            if self.value_col is None:
+                self.label_col, self.value_col = series_columns(list(df.columns))
+            self.rows += len(df)
+        inverse, uniques, ts, values = _long_arrays(df, self.label_col, self.value_col)
+        if not len(ts):
+            return self
+        index = {label: i for i, label in enumerate(self.labels)}
+        lookup = np.array([index.setdefault(label, len(index)) for label in uniques], dtype="<i4")
+        self.labels = list(index)
+        code = lookup[inverse]  # still grouped by series, time-sorted within each
+        if self.levels is None:
+            res = _resolution(code, ts)
+            self.levels = [name for name, width in LEVELS.items() if res is None or width > res]
+        for level in self.levels:
+            width = LEVELS[level]
+            codes, rec = _buckets(code, ts // width * width, values)
+            bounds = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1], True])
+            for lo, hi in zip(bounds[:-1], bounds[1:]):
+                self._extend(level, int(codes[lo]), rec[lo:hi])
+        return self
+
+    def _file(self, level, code):
+        return os.path.join(self.root, level, f"{code}.bin")
+
+    def _extend(self, level, code, rec):
+        """
+        Fold bucket-sorted records into one series, rewriting only its trailing
+        bucket when they follow on. Callers hold the dataset lock.
+        """
+        if self.root is None:
+            old = self._records.get((level, code))
+            self._records[level, code] = rec if old is None else _merge(old, rec)
+            return
+        path = self._file(level, code)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "r+b" if os.path.exists(path) else "w+b") as fh:
+            # a partial record left by an interrupted write is overwritten
+            pos = fh.seek(0, os.SEEK_END) // REC.itemsize * REC.itemsize
+            if pos:
+                fh.seek(pos - REC.itemsize)
+                last = np.frombuffer(fh.read(REC.itemsize), dtype=REC)
+                if rec["bucket"][0] < last["bucket"][0]:
+                    # readings from before the series' last bucket: merge the whole file
+                    fh.seek(0)
+                    rec, pos = _merge(np.frombuffer(fh.read(pos), dtype=REC), rec), 0
+                elif rec["bucket"][0] == last["bucket"][0]:
+                    rec, pos = np.concatenate([_merge(last, rec[:1]), rec[1:]]), pos - REC.itemsize
+            fh.seek(pos)
+            fh.write(rec.tobytes())
+            fh.truncate()
+
+    def _read(self, level, code):
+        """A copy of one series' records, read under a shared dataset lock since appends rewrite files in place."""
+        if self.root is None:
+            return self._records.get((level, code), np.empty(0, dtype=REC))
+        path = self._file(level, code)
+        with dataset_lock(os.path.dirname(self.root), shared=True):
+            try:
+                with open(path, "rb") as fh:
+                    return np.fromfile(fh, dtype=REC, count=os.fstat(fh.fileno()).st_size // REC.itemsize)
+            except FileNotFoundError:
+                return np.empty(0, dtype=REC)
+
+    @classmethod
+    def from_frame(cls, df, root=None):
+        return cls(root).update(df)
+
+    def save(self):
+        """Commit the files under root as covering `rows` rows."""
+        meta = {"label_col": self.label_col, "value_col": self.value_col, "rows": self.rows,
+                "labels": self.labels, "levels": self.levels}
+        write_sidecar(self.root, META_FILE, meta)
+
+    @classmethod
+    def load(cls, path):
+        """The saved pyramid of the dataset directory at path, or None when absent."""
+        root = os.path.join(path, ROLLUPS_DIR)
+        meta = read_sidecar(root, META_FILE) if os.path.isdir(root) else None
+        if meta is None:
+            return None
+        r = cls(root, meta["label_col"], meta["value_col"])
+        r.rows, r.labels, r.levels = meta["rows"], meta["labels"], meta["levels"]
+        return r
+
+    def count(self, key, start, end):
+        """Readings of series key within [start, end] (UTC ns), from the finest level; None without levels."""
+        if not self.levels:
+            return None
+        return int(self._slice(self.levels[0], key, start, end)["count"].sum())
+
+    def _slice(self, level, key, start, end):
+        if key not in self.labels:
+            return np.empty(0, dtype=REC)
+        rec = self._read(level, self.labels.index(key))
+        width = LEVELS[level]
+        i = np.searchsorted(rec["bucket"], start // width * width, side="left")
+        j = np.searchsorted(rec["bucket"], end, side="right")
+        return np.array(rec[i:j])
+
+    def query(self, key, start, end, points):
+        """
+        Finest level with at most `points` buckets in range, else the coarsest
+        one LTTB-downsampled to `points` buckets; returns (level name, frame of
+        timestamp/value(mean)/min/max/count). Requires levels.
+        """
+        for level in self.levels:
+            rec = self._slice(level, key, start, end)
+            if len(rec) <= points:
+                break
+        else:
+            rec = rec[lttb(rec["bucket"], rec["sum"] / rec["count"], points)]
+        return level, pd.DataFrame({"timestamp": pd.to_datetime(rec["bucket"]), "value": rec["sum"] / rec["count"],
+                                    "min": rec["min"], "max": rec["max"], "count": rec["count"]})
+
+def load_rollups(path, load_frame):
+    """
+    Rollups of the dataset at path. When missing or stale they are rebuilt
+    from load_frame() under the dataset lock and swapped in whole.
+    """
+    r = Rollups.load(path)
+    if r is not None and r.rows == read_manifest(path)["rows"]:
+        return r
+    with dataset_lock(path):
+        r = Rollups.load(path)
+        rows = read_manifest(path)["rows"]
+        if r is not None and r.rows == rows:
+            return r
+        root = os.path.join(path, ROLLUPS_DIR)
+        tmp = f"{root}.tmp-{uuid.uuid4().hex}"
+        r = Rollups.from_frame(load_frame(), tmp)
+        r.rows = rows
+        r.save()
+        old = None
+        if os.path.exists(root):
+            old = f"{root}.old-{uuid.uuid4().hex}"
+            os.replace(root, old)
+        os.replace(tmp, root)
+        if old:
+            shutil.rmtree(old, ignore_errors=True)
+    return Rollups.load(path)
+
+def extend_rollups(path, delta, rows_before):
+    """Fold appended rows into the on-disk rollups; stale ones are left for load_rollups to rebuild."""
+    r = Rollups.load(path)
+    if r is None or r.rows != rows_before:
+        return
+    r.update(delta).save()
+
+def lttb(x, y, n):
+    """Indices of the Largest-Triangle-Three-Buckets downsample of (x, y) to n points."""
+    size = len(x)
+    if n >= size:
+        return np.arange(size)
+    if n < 3:
+        return np.array([0, size - 1][:n], dtype=int)
+    x = x.astype(float)
+    edges = np.r_[np.floor(np.linspace(1, size - 1, n - 1)).astype(int), size]
+    out = np.empty(n, dtype=int)
+    out[0], out[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nxt = slice(edges[i + 1], edges[i + 2])
+        cx, cy = x[nxt].mean(), y[nxt].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
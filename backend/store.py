@@ -0,0 +1,413 @@
+import os
+import json
+import shutil
+import uuid
+import threading
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from telemetry import span
+from dataset import SeriesMatrix, series_columns
+
+try:
+    import fcntl
+except ImportError:  # not on Windows: appends are then serialized within one process only
+    fcntl = None
+
+logger = logging.getLogger("energy_optim.store")
+
+# A cleaned dataset lives in a directory next to where its CSV used to be:
+#   <UPLOAD_FOLDER>/<cleaned_filename>.cols/
+#       manifest.json   column names, kinds, dtypes, row count
+#       0.bin, 1.bin    one raw little-endian array per column, memory-mappable
+#       2.cats.json     category list of a text column, append-only
+#       *.json          optional sidecars derived from the data (e.g. summary.json)
+# Timestamps are int64 nanoseconds, numbers float64, text columns int32 codes
+# into their category list. Measurement columns are always float64: text in
+# them (e.g. a fuel_mix column) is stored as NaN. Stores written before
+# category lists moved out of the manifest keep them inline until appended to.
+# Uploads are content-addressed: <UPLOAD_FOLDER>/.uploads/<digest>.json maps the
+# digest of a raw upload to the dataset cleaned from it (see find_upload).
+STORE_SUFFIX = ".cols"
+MANIFEST = "manifest.json"
+LOCK_FILE = ".lock"
+FORMAT_VERSION = 1
+UPLOAD_INDEX = ".uploads"
+VALUE_COLUMNS = ("energy_kwh", "energy_value")
+
+def dataset_path(folder, name):
+    return os.path.join(folder, name + STORE_SUFFIX)
+
+def legacy_csv_path(folder, name):
+    return os.path.join(folder, name)
+
+def dataset_exists(folder, name):
+    return os.path.isdir(dataset_path(folder, name)) or os.path.isfile(legacy_csv_path(folder, name))
+
+def list_datasets(folder):
+    """Names of the cleaned datasets in folder, most recently written first."""
+    found = []
+    for entry in os.scandir(folder):
+        if entry.is_dir() and entry.name.endswith(STORE_SUFFIX):
+            try:
+                mtime = os.stat(os.path.join(entry.path, MANIFEST)).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            found.append((mtime, entry.name[:-len(STORE_SUFFIX)]))
+        elif entry.is_file() and entry.name.endswith(".csv"):
+            found.append((entry.stat().st_mtime_ns, entry.name))
+    return [name for _, name in sorted(found, reverse=True)]
+
+def find_upload(folder, digest):
+    """
+    Name of the dataset cleaned from the upload with this digest, or None when
+    there is none or it has since been appended to (it no longer matches the upload).
+    """
+    try:
+        with open(os.path.join(folder, UPLOAD_INDEX, digest + ".json"), encoding="utf-8") as fh:
+            entry = json.load(fh)
+        if read_manifest(dataset_path(folder, entry["name"]))["rows"] == entry["rows"]:
+            return entry["name"]
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+    return None
+
+def record_upload(folder, digest, name, rows):
+    index = os.path.join(folder, UPLOAD_INDEX)
+    os.makedirs(index, exist_ok=True)
+    write_sidecar(index, digest + ".json", {"name": name, "rows": rows})
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST), encoding="utf-8") as fh:
+        return json.load(fh)
+
+def read_sidecar(path, name):
+    try:
+        with open(os.path.join(path, name), encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+def write_sidecar(path, name, data):
+    """Atomically (re)write a JSON sidecar file inside a dataset directory."""
+    tmp = os.path.join(path, f"{name}.tmp-{uuid.uuid4().hex}")
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(data, fh)
+    os.replace(tmp, os.path.join(path, name))
+
+def _categories_file(i):
+    return f"{i}.cats.json"
+
+def _categories(path, i, col):
+    """Category list of column i, cut to the manifest's count (an interrupted append may leave extra entries)."""
+    if "categories" in col:
+        return col["categories"]
+    return (read_sidecar(path, _categories_file(i)) or [])[:col["n_categories"]]
+
+def _column_spec(name, s):
+    if name in VALUE_COLUMNS:
+        return {"name": name, "kind": "float", "dtype": "<f8"}
+    if pd.api.types.is_datetime64_any_dtype(s):
+        tz = str(s.dt.tz) if s.dt.tz is not None else None
+        return {"name": name, "kind": "datetime", "dtype": "<i8", "tz": tz}
+    if pd.api.types.is_numeric_dtype(s) or pd.api.types.is_bool_dtype(s):
+        return {"name": name, "kind": "float", "dtype": "<f8"}
+    try:
+        pd.to_numeric(s[s.notna()], errors="raise")
+        return {"name": name, "kind": "float", "dtype": "<f8"}
+    except (ValueError, TypeError):
+        return {"name": name, "kind": "category", "dtype": "<i4", "n_categories": 0}
+
+def _encode_column(col, codes_index, s):
+    """
+    Encode one column of a chunk per its manifest spec, updating the timestamp
+    max in place; new text values are added to codes_index (value -> code).
+    """
+    if col["kind"] == "datetime":
+        s = pd.to_datetime(s, errors="coerce")
+        if col["tz"] is not None:
+            s = s.dt.tz_convert("UTC").dt.tz_localize(None)
+        arr = s.to_numpy(dtype="datetime64[ns]").view("<i8")
+        valid = arr[arr != np.iinfo(np.int64).min]
+        if len(valid):
+            col["max"] = max(int(valid.max()), col.get("max") if col.get("max") is not None else int(valid.max()))
+        return arr
+    if col["kind"] == "float":
+        errors = "coerce" if col["name"] in VALUE_COLUMNS else "raise"
+        return pd.to_numeric(s, errors=errors).to_numpy(dtype="<f8", na_value=np.nan)
+    codes = np.full(len(s), -1, dtype="<i4")
+    mask = s.notna().to_numpy()
+    inverse, uniques = pd.factorize(s[mask])
+    lookup = np.empty(len(uniques), dtype="<i4")
+    for j, u in enumerate(map(str, uniques)):
+        lookup[j] = codes_index.setdefault(u, len(codes_index))
+    codes[mask] = lookup[inverse]
+    return codes
+
+class DatasetWriter:
+    """
+    Writes a cleaned dataset chunk by chunk into a temporary directory and
+    swaps it into place on close(), so readers never see a half-written store.
+    Use as a context manager; an exception discards the partial output.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+        os.makedirs(self.tmp_path)
+        self.columns = None
+        self.rows = 0
+        self._files = []
+        self._codes = []
+
+    def append(self, df):
+        if self.columns is None:
+            self.columns = [_column_spec(str(c), df[c]) for c in df.columns]
+            self._files = [open(os.path.join(self.tmp_path, f"{i}.bin"), "wb") for i in range(len(self.columns))]
+            self._codes = [{} for _ in self.columns]
+        elif [str(c) for c in df.columns] != [c["name"] for c in self.columns]:
+            raise ValueError("chunk columns do not match dataset columns")
+        for i, col in enumerate(self.columns):
+            self._files[i].write(_encode_column(col, self._codes[i], df.iloc[:, i]).tobytes())
+        self.rows += len(df)
+
+    def write_sidecar(self, name, data):
+        """Stage a sidecar so it is swapped in together with the data on close()."""
+        write_sidecar(self.tmp_path, name, data)
+
+    def close(self):
+        for fh in self._files:
+            fh.close()
+        for i, col in enumerate(self.columns or []):
+            if col["kind"] == "category":
+                write_sidecar(self.tmp_path, _categories_file(i), list(self._codes[i]))
+                col["n_categories"] = len(self._codes[i])
+        manifest = {"format": FORMAT_VERSION, "rows": self.rows, "columns": self.columns or []}
+        with open(os.path.join(self.tmp_path, MANIFEST), "w", encoding="utf-8") as fh:
+            json.dump(manifest, fh)
+        old = None
+        if os.path.exists(self.path):
+            old = f"{self.path}.old-{uuid.uuid4().hex}"
+            os.replace(self.path, old)
+        os.replace(self.tmp_path, self.path)
+        if old:
+            shutil.rmtree(old, ignore_errors=True)
+
+    def abort(self):
+        for fh in self._files:
+            fh.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+def write_dataset(df, path):
+    with DatasetWriter(path) as w:
+        w.append(df)
+
+_append_lock = threading.Lock()
+
+@contextmanager
+def dataset_lock(path, shared=False):
+    """
+    Lock on one dataset, held across threads and server worker processes alike
+    (flock on a lock file inside the dataset directory): exclusive for writers,
+    shared for readers of files that writers update in place.
+    """
+    if fcntl is None:
+        with _append_lock:
+            yield
+        return
+    with open(os.path.join(path, LOCK_FILE), "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+def _drop_stored(path, m, keys, df, encoded, stored_max=None):
+    """
+    Drop rows of an encoded chunk whose `keys` match a row already stored.
+    Only stored rows inside the chunk's range of the first key are compared,
+    and none at all when the chunk starts after `stored_max` of that key.
+    """
+    names = [c["name"] for c in m["columns"]]
+    idx = [names.index(k) for k in keys]
+    first, col = encoded[idx[0]], m["columns"][idx[0]]
+    if not m["rows"] or (stored_max is not None and first.min() > stored_max):
+        return df, encoded
+    stored = _map_column(path, idx[0], col["dtype"], m["rows"])
+    near = np.flatnonzero((stored >= first.min()) & (stored <= first.max()))
+    if not len(near):
+        return df, encoded
+    old = pd.MultiIndex.from_arrays([np.asarray(_map_column(path, i, m["columns"][i]["dtype"], m["rows"])[near]) for i in idx])
+    keep = ~pd.MultiIndex.from_arrays([encoded[i] for i in idx]).isin(old)
+    return df[keep], [data[keep] for data in encoded]
+
+def append_dataset(path, df, on_append=None, keys=None):
+    """
+    Append rows to an existing dataset in place: column files are extended and
+    only the manifest is rewritten (atomically, last), so prior data is never
+    rewritten and a crash mid-append leaves the previous row count intact.
+    df must have the dataset's columns. With `keys`, rows whose key columns
+    match a stored row are dropped first, under the same lock as the write.
+    Returns (new total row count, rows appended).
+    on_append(path, df, rows_before) runs under the dataset lock once the rows
+    are committed, for keeping sidecars in step.
+    """
+    with dataset_lock(path):
+        m = read_manifest(path)
+        names = [c["name"] for c in m["columns"]]
+        if sorted(str(c) for c in df.columns) != sorted(names):
+            raise ValueError(f"rows must have columns {names}")
+        df = df[names]
+        cats = [_categories(path, i, col) if col["kind"] == "category" else [] for i, col in enumerate(m["columns"])]
+        indexes = [{u: j for j, u in enumerate(c)} for c in cats]
+        # encoding moves the timestamp max forward; the stored one bounds the duplicate check
+        stored_max = m["columns"][names.index(keys[0])].get("max") if keys else None
+        encoded = [_encode_column(col, index, df.iloc[:, i]) for i, (col, index) in enumerate(zip(m["columns"], indexes))]
+        if keys and len(df):
+            df, encoded = _drop_stored(path, m, keys, df, encoded, stored_max)
+        if not len(df):
+            return m["rows"], 0
+        # category lists only grow, so they can go in ahead of the manifest that makes their codes live
+        for i, (col, c, index) in enumerate(zip(m["columns"], cats, indexes)):
+            if len(index) > len(c) or "categories" in col:
+                write_sidecar(path, _categories_file(i), list(index))
+                col.pop("categories", None)
+            if col["kind"] == "category":
+                col["n_categories"] = len(index)
+        for i, (col, data) in enumerate(zip(m["columns"], encoded)):
+            with open(os.path.join(path, f"{i}.bin"), "r+b" if m["rows"] else "wb") as fh:
+                # drop any tail left by an append that crashed before its manifest was written
+                fh.truncate(m["rows"] * np.dtype(col["dtype"]).itemsize)
+                fh.seek(0, os.SEEK_END)
+                fh.write(data.tobytes())
+        rows_before = m["rows"]
+        m["rows"] += len(df)
+        write_sidecar(path, MANIFEST, m)
+        if on_append is not None:
+            on_append(path, df, rows_before)
+        return m["rows"], len(df)
+
+def _map_column(path, i, dtype, rows):
+    if rows == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(os.path.join(path, f"{i}.bin"), dtype=dtype, mode="r", shape=(rows,))
+
+def read_dataset(path, limit=None):
+    """Load a columnar dataset directory (or its first `limit` rows) into a long-form DataFrame."""
+    m = read_manifest(path)
+    data = {}
+    for i, col in enumerate(m["columns"]):
+        arr = _map_column(path, i, col["dtype"], m["rows"])[:limit]
+        if col["kind"] == "datetime":
+            ts = np.array(arr).view("datetime64[ns]")
+            data[col["name"]] = pd.DatetimeIndex(ts).tz_localize("UTC").tz_convert(col["tz"]) if col["tz"] else ts
+        elif col["kind"] == "float":
+            data[col["name"]] = np.array(arr)
+        else:
+            cats = np.asarray(_categories(path, i, col) + [np.nan], dtype=object)
+            data[col["name"]] = cats[np.array(arr)]
+    return pd.DataFrame(data)
+
+def read_matrix(path):
+    """
+    Load a columnar dataset directory as a SeriesMatrix straight from its
+    column files: label codes and timestamps are used as stored, no long frame.
+    """
+    m = read_manifest(path)
+    cols = {col["name"]: (i, col) for i, col in enumerate(m["columns"])}
+    label_col, value_col = series_columns(list(cols))
+    if "timestamp" not in cols or cols["timestamp"][1]["kind"] != "datetime" or (label_col and cols[label_col][1]["kind"] != "category"):
+        return SeriesMatrix.from_long(read_dataset(path))
+    rows = m["rows"]
+    i, ts = cols["timestamp"]
+    ns = np.array(_map_column(path, i, ts["dtype"], rows))
+    i, col = cols[value_col]
+    raw = _map_column(path, i, col["dtype"], rows)
+    if col["kind"] == "category":
+        # stores from before value columns were always float: numeric categories only
+        cats = pd.to_numeric(pd.Series(_categories(path, i, col) + [None], dtype=object), errors="coerce").to_numpy(dtype=float)
+        values = cats[np.array(raw)]
+    else:
+        values = np.array(raw, dtype=float)
+    if label_col:
+        i, lab = cols[label_col]
+        codes, labels = np.array(_map_column(path, i, lab["dtype"], rows)), _categories(path, i, lab)
+    else:
+        codes, labels = np.zeros(rows, dtype=np.int64), ["total"]
+    return SeriesMatrix.from_arrays(ns, codes, labels, values, label_col, value_col, ts["tz"])
+
+def iter_csv(df, chunk_rows=100_000):
+    """Render a frame as CSV text in bounded pieces, for streaming downloads."""
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_csv(index=False, header=(start == 0))
+
+class FrameCache:
+    """
+    Bounded LRU of loaded cleaned datasets, held as SeriesMatrix and keyed by
+    dataset name and on-disk mtime, so a rewritten dataset is never served
+    stale. Cached matrices are shared between requests and must be treated as
+    read-only. get() reads the long frame from disk for the few callers that
+    need every original row.
+    """
+    def __init__(self, folder, maxsize=8):
+        self.folder = folder
+        self.maxsize = maxsize
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _locate(self, name):
+        path = dataset_path(self.folder, name)
+        if os.path.isdir(path):
+            return os.stat(os.path.join(path, MANIFEST)).st_mtime_ns, lambda: read_dataset(path), lambda: read_matrix(path)
+        csv_path = legacy_csv_path(self.folder, name)
+        if os.path.isfile(csv_path):
+            return os.stat(csv_path).st_mtime_ns, lambda: pd.read_csv(csv_path, parse_dates=["timestamp"]), lambda: SeriesMatrix.from_csv(csv_path)
+        return None, None, None
+
+    def version(self, name):
+        """On-disk version stamp (mtime_ns) of a dataset, or None if it does not exist."""
+        return self._locate(name)[0]
+
+    def get(self, name):
+        """Long-form cleaned frame for name, read from disk (not cached), or None if no such dataset exists."""
+        load = self._locate(name)[1]
+        return load() if load is not None else None
+
+    def matrix(self, name):
+        """Return the SeriesMatrix for name, or None if no such dataset exists."""
+        mtime, _, load = self._locate(name)
+        if load is None:
+            return None
+        key = (name, mtime)
+        with self._lock:
+            if key in self._frames:
+                self._frames.move_to_end(key)
+                return self._frames[key]
+        with span("frame.load") as rec:
+            df = load()
+            rec["rows"] = len(df)
+        logger.debug("frame cache miss: %s (%s series x timestamps)", name, df.shape)
+        if self.maxsize > 0:
+            with self._lock:
+                for k in [k for k in self._frames if k[0] == name]:
+                    del self._frames[k]
+                self._frames[key] = df
+                while len(self._frames) > self.maxsize:
+                    self._frames.popitem(last=False)
+        return df
+
+    def invalidate(self, name=None):
+        with self._lock:
+            for k in [k for k in self._frames if name is None or k[0] == name]:
+                del self._frames[k]
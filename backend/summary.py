@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+from store import read_manifest, read_sidecar, write_sidecar
+from dataset import SeriesMatrix, widen
+
+SUMMARY_FILE = "summary.json"
+
+def _bucket_sums(present, values, buckets, size):
+    """Per-series (sums, counts) of readings by bucket index of each timestamp, via one-hot products."""
+    onehot = np.zeros((len(buckets), size))
+    onehot[np.arange(len(buckets)), buckets] = 1.0
+    return values @ onehot, np.rint(present @ onehot).astype(int)
+
+class DatasetSummary:
+    """
+    Mergeable aggregates of a cleaned dataset: per-series totals plus hour-of-day
+    and weekday sums/counts, and the time range. update() folds in new rows, so
+    the summary built at upload can be extended on append without a rescan;
+    metrics() derives profiles, peak hour, base load and shares from it.
+    Series are aggregated from a SeriesMatrix; long frames are converted first.
+    `rows` counts long-form rows (to match the store manifest), so it only
+    advances for frames.
+    """
+    def __init__(self, label_col=None, value_col=None):
+        self.label_col = label_col
+        self.value_col = value_col
+        self.rows = 0
+        self.start = None
+        self.end = None
+        self.series = {}
+
+    def update(self, data):
+        if isinstance(data, pd.DataFrame):
+            self.rows += len(data)
+            data = SeriesMatrix.from_long(data, self.label_col, self.value_col) if self.value_col else SeriesMatrix.from_long(data)
+        if self.value_col is None:
+            self.label_col, self.value_col = data.label_col, data.value_col
+        if not data.shape[1]:
+            return self
+        index = data.index
+        self.start = index[0] if self.start is None else min(self.start, index[0])
+        self.end = index[-1] if self.end is None else max(self.end, index[-1])
+        present = ~np.isnan(data.values)
+        values = np.where(present, widen(data.values), 0.0)
+        present = present.astype(float)
+        hours = _bucket_sums(present, values, index.hour.to_numpy(), 24)
+        weekdays = _bucket_sums(present, values, index.weekday.to_numpy(), 7)
+        for i, label in enumerate(data.labels.tolist()):
+            s = self.series.setdefault(label, {"total": 0.0, "count": 0, "hour_sum": [0.0] * 24, "hour_count": [0] * 24,
+                                               "weekday_sum": [0.0] * 7, "weekday_count": [0] * 7})
+            s["total"] += float(values[i].sum())
+            s["count"] += int(present[i].sum())
+            for key, (sums, counts) in (("hour", hours), ("weekday", weekdays)):
+                s[f"{key}_sum"] = (np.asarray(s[f"{key}_sum"]) + sums[i]).tolist()
+                s[f"{key}_count"] = (np.asarray(s[f"{key}_count"]) + counts[i]).tolist()
+        return self
+
+    def to_dict(self):
+        return {"label_col": self.label_col, "value_col": self.value_col, "rows": self.rows,
+                "start": self.start.isoformat() if self.start is not None else None,
+                "end": self.end.isoformat() if self.end is not None else None,
+                "series": self.series}
+
+    @classmethod
+    def from_dict(cls, data):
+        s = cls(data["label_col"], data["value_col"])
+        s.rows = data["rows"]
+        s.start = pd.Timestamp(data["start"]) if data["start"] else None
+        s.end = pd.Timestamp(data["end"]) if data["end"] else None
+        s.series = data["series"]
+        return s
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls().update(df)
+
+    def _profile(self, key, size):
+        """Mean load per bucket: each series' mean reading summed across series (NaN where no data)."""
+        total = np.zeros(size)
+        seen = np.zeros(size, dtype=bool)
+        for s in self.series.values():
+            counts = np.asarray(s[f"{key}_count"])
+            total += np.divide(s[f"{key}_sum"], counts, out=np.zeros(size), where=counts > 0)
+            seen |= counts > 0
+        return np.where(seen, total, np.nan)
+
+    def hourly_profiles(self):
+        """{series: 24 mean readings by hour of day}, for series seen at every hour."""
+        return {k: [h / c for h, c in zip(s["hour_sum"], s["hour_count"])]
+                for k, s in self.series.items() if all(s["hour_count"])}
+
+    def metrics(self):
+        hourly = self._profile("hour", 24)
+        weekday = self._profile("weekday", 7)
+        hour_sums = np.sum([s["hour_sum"] for s in self.series.values()], axis=0) if self.series else np.zeros(24)
+        hour_seen = np.sum([s["hour_count"] for s in self.series.values()], axis=0) > 0 if self.series else np.zeros(24, dtype=bool)
+        totals = {k: s["total"] for k, s in self.series.items()}
+        grand = sum(totals.values())
+        has_data = bool(hour_seen.any())
+        return {
+            "rows": self.rows,
+            "start": self.start.isoformat() if self.start is not None else None,
+            "end": self.end.isoformat() if self.end is not None else None,
+            "value_col": self.value_col,
+            "label_col": self.label_col,
+            "total": grand,
+            "totals": totals,
+            "shares": {k: (v / grand if grand else 0.0) for k, v in totals.items()},
+            "hourly_profile": [None if np.isnan(x) else float(x) for x in hourly],
+            "weekday_profile": [None if np.isnan(x) else float(x) for x in weekday],
+            "peak_hour": int(np.argmax(np.where(hour_seen, hour_sums, -np.inf))) if has_data else None,
+            "avg_hourly": float(np.nanmean(hourly)) if has_data else None,
+            "base_load": float(np.nanmin(hourly)) if has_data else None,
+        }
+
+    def prompt_metrics(self):
+        """One-line metrics for the advisor prompt, in the key=value form the rule-based advisor parses."""
+        m = self.metrics()
+        if self.label_col == "energy_type":
+            parts = [f"{k}={v:.2f}" for k, v in m["totals"].items()]
+        else:
+            parts = [f"total_kwh={m['total']:.2f}"]
+            if m["peak_hour"] is not None:
+                parts[0] += f", peak_hour={m['peak_hour']}"
+        if m["avg_hourly"] is not None:
+            unit = "" if self.label_col == "energy_type" else "_kwh"
+            parts.append(f"avg_hourly{unit}={m['avg_hourly']:.3f} base_load{unit}={m['base_load']:.3f}")
+            if self.label_col == "energy_type":
+                parts.append(f"peak_hour={m['peak_hour']}")
+        if self.label_col and len(m["shares"]) > 1:
+            parts.append("shares: " + ", ".join(f"{k}={v:.1%}" for k, v in sorted(m["shares"].items(), key=lambda kv: -kv[1])))
+        if m["start"]:
+            parts.append(f"period={m['start']}..{m['end']}")
+        return " ".join(parts)
+
+def load_summary(path, load_frame):
+    """
+    Summary sidecar of the dataset at path, rebuilt from load_frame() (and saved)
+    when it is missing or does not cover the manifest's rows.
+    """
+    data = read_sidecar(path, SUMMARY_FILE)
+    if data is not None and data["rows"] == read_manifest(path)["rows"]:
+        return DatasetSummary.from_dict(data)
+    summary = DatasetSummary.from_frame(load_frame())
+    summary.rows = read_manifest(path)["rows"]
+    write_sidecar(path, SUMMARY_FILE, summary.to_dict())
+    return summary
+
+def extend_summary(path, delta, rows_before):
+    """
+    Fold appended rows into the sidecar. A sidecar that did not cover exactly
+    rows_before rows is left alone; load_summary rebuilds it on next read.
+    """
+    data = read_sidecar(path, SUMMARY_FILE)
+    if data is None or data["rows"] != rows_before:
+        return
+    write_sidecar(path, SUMMARY_FILE, DatasetSummary.from_dict(data).update(delta).to_dict())
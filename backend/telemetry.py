@@ -0,0 +1,131 @@
+import time
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+
+# In-process metrics (histograms and counters keyed by name + labels) rendered
+# in Prometheus text format, plus per-request stage traces for profiling.
+# Work done in joblib worker processes (ML_WORKERS > 1) is not recorded, and each
+# web server worker process keeps (and on /metrics reports) only its own series.
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRICS = {
+    "energy_http_request_duration_seconds": ("histogram", "Request latency by endpoint, method and status (until the body starts streaming)."),
+    "energy_stage_duration_seconds": ("histogram", "Latency of instrumented pipeline stages."),
+    "energy_stage_rows_total": ("counter", "Rows processed by instrumented pipeline stages."),
+    "energy_model_cache_total": ("counter", "Model registry lookups by model kind and result (hit/miss)."),
+    "energy_llm_request_duration_seconds": ("histogram", "External LLM HTTP calls by outcome, including retried attempts."),
+    "energy_llm_cache_total": ("counter", "LLM response cache lookups by result (hit/miss)."),
+}
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_trace = contextvars.ContextVar("energy_trace", default=None)
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                h[0][i] += 1
+                break
+        h[1] += value
+        h[2] += 1
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+@contextmanager
+def span(stage, rows=None):
+    """
+    Time a block as `stage`. The yielded dict's "rows" may be set inside the
+    block when the row count is only known afterwards.
+    """
+    rec = {"rows": rows}
+    t0 = time.perf_counter()
+    try:
+        yield rec
+    finally:
+        elapsed = time.perf_counter() - t0
+        observe("energy_stage_duration_seconds", elapsed, stage=stage)
+        if rec["rows"] is not None:
+            inc("energy_stage_rows_total", rec["rows"], stage=stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((stage, elapsed, rec["rows"]))
+
+def timed(stage, rows=None):
+    """Decorator form of span; rows(result) gives the row count to record."""
+    def wrap(func):
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            with span(stage) as rec:
+                result = func(*args, **kwargs)
+                if rows is not None:
+                    rec["rows"] = rows(result)
+                return result
+        return inner
+    return wrap
+
+def start_trace():
+    """Collect this context's spans from now on; returns a token for stop_trace."""
+    return _trace.set([])
+
+def stop_trace(token):
+    """Stop collecting and return the spans as [(stage, seconds, rows), ...]."""
+    trace = _trace.get()
+    _trace.reset(token)
+    return trace or []
+
+def stage_breakdown(trace):
+    """Spans summed per stage, in first-seen order: {stage: {"ms", "calls", "rows"}}."""
+    out = {}
+    for stage, seconds, rows in trace:
+        s = out.setdefault(stage, {"ms": 0.0, "calls": 0, "rows": 0})
+        s["ms"] += seconds * 1000
+        s["calls"] += 1
+        s["rows"] += rows or 0
+    return out
+
+def _labels(pairs, extra=()):
+    pairs = list(pairs) + list(extra)
+    if not pairs:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+def render():
+    """All metrics in Prometheus text exposition format (version 0.0.4)."""
+    with _lock:
+        histograms = {k: (list(v[0]), v[1], v[2]) for k, v in _histograms.items()}
+        counters = dict(_counters)
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        if kind == "histogram":
+            for (n, labels), (buckets, total, count) in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, c in zip(BUCKETS, buckets):
+                    cumulative += c
+                    lines.append(f"{name}_bucket{_labels(labels, [('le', repr(bound))])} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {total!r}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+        else:
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{_labels(labels)} {value!r}")
+    return "\n".join(lines) + "\n"
@@ -1,33 +1,176 @@
-import io
+import itertools
+import hashlib
+import importlib
+import threading
 import pandas as pd
 import numpy as np
 from datetime import datetime
 import os
+from telemetry import span, timed
 
 def ensure_upload_folder(path: str):
     os.makedirs(path, exist_ok=True)
 
-def read_csv_file(file_storage):
+class LazyModule:
+    """
+    Stand-in for a module that is only imported on first attribute access (or
+    load_module()), keeping heavy dependencies out of process start-up.
+    pandas and numpy are still imported eagerly by app and store, and they
+    dominate import time, so deferring the rest saves comparatively little.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load_module(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load_module(), attr)
+
+joblib = LazyModule("joblib")
+
+class HashingFile:
+    """
+    Writable file wrapper that feeds every written byte to a sha256, so an
+    upload is hashed while it is spooled rather than in a second pass.
+    Everything else (read, seek, ...) goes to the wrapped file.
+    """
+    def __init__(self, fh):
+        self._fh = fh
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self._fh.write(data)
+
+    def __getattr__(self, attr):
+        return getattr(self._fh, attr)
+
+    def __iter__(self):
+        return iter(self._fh)
+
+def parallel_map(func, items, n_jobs=1, backend="loky"):
+    """
+    Call func(*item) for every item, in order. With n_jobs > 1 the calls run on a
+    joblib worker pool (processes by default); results come back in input order,
+    so serial and parallel runs are interchangeable.
+    """
+    items = list(items)
+    if n_jobs == 1 or len(items) < 2:
+        return [func(*item) for item in items]
+    return joblib.Parallel(n_jobs=min(n_jobs, len(items)) if n_jobs > 0 else n_jobs, backend=backend)(joblib.delayed(func)(*item) for item in items)
+
+CSV_DELIMITERS = [",", ";", "\t"]
+
+def sniff_csv(stream, sample_bytes=64 * 1024):
+    """
+    Peek at the head of a binary stream and return (sep, encoding).
+    Only the sample is decoded; the stream is rewound for the real parse.
+    """
+    pos = stream.tell()
+    sample = stream.read(sample_bytes)
+    stream.seek(pos)
+    try:
+        text = sample.decode("utf-8")
+        encoding = "utf-8"
+    except UnicodeDecodeError as e:
+        # a multi-byte character cut in half by the sample boundary is still utf-8
+        if len(sample) == sample_bytes and e.start >= len(sample) - 3:
+            text = sample[:e.start].decode("utf-8")
+            encoding = "utf-8"
+        else:
+            text = sample.decode("latin1")
+            encoding = "latin1"
+    header = next((line for line in text.splitlines() if line.strip()), "")
+    for sep in CSV_DELIMITERS:
+        if len(header.split(sep)) >= 2:
+            return sep, encoding
+    return ",", encoding
+
+@timed("csv.parse", rows=len)
+def read_csv_file(file_storage, sample_bytes=64 * 1024):
     """
     Accepts Werkzeug FileStorage and returns a pandas DataFrame.
-    Tries common delimiters and handles encoding issues.
+    Delimiter and encoding are sniffed from a small sample, then the file is parsed once
+    (twice, as latin1, if a byte past the sample turns out not to be utf-8).
     """
-    content = file_storage.read()
+    stream = getattr(file_storage, "stream", file_storage)
+    pos = stream.tell()
+    sep, encoding = sniff_csv(stream, sample_bytes)
     try:
-        text = content.decode("utf-8")
-    except Exception:
-        text = content.decode("latin1")
-    # try delimiters
-    for sep in [",", ";", "\t"]:
-        try:
-            df = pd.read_csv(io.StringIO(text), sep=sep)
-            if df.shape[1] >= 2:
-                return df
-        except Exception:
-            continue
-    # fallback
-    return pd.read_csv(io.StringIO(text))
+        return pd.read_csv(stream, sep=sep, encoding=encoding)
+    except UnicodeDecodeError:
+        stream.seek(pos)
+        return pd.read_csv(stream, sep=sep, encoding="latin1")
+
+def iter_csv_chunks(file_storage, chunksize=100_000, sample_bytes=64 * 1024, encoding=None):
+    """
+    Like read_csv_file, but yields DataFrames of at most `chunksize` rows
+    so the whole upload never has to be held in memory. `encoding` overrides the
+    sniffed one; a non-utf-8 byte past the sample raises UnicodeDecodeError
+    mid-stream, after earlier chunks were yielded, so callers restart as latin1.
+    """
+    stream = getattr(file_storage, "stream", file_storage)
+    sep, sniffed = sniff_csv(stream, sample_bytes)
+    with pd.read_csv(stream, sep=sep, encoding=encoding or sniffed, chunksize=chunksize) as reader:
+        while True:
+            with span("csv.parse") as rec:
+                chunk = next(reader, None)
+                rec["rows"] = 0 if chunk is None else len(chunk)
+            if chunk is None:
+                return
+            yield chunk
+
+def stream_standardize_csv(file_storage, standardize, sink, chunksize=100_000, preview_rows=50, sample_bytes=64 * 1024, encoding=None):
+    """
+    Parse and standardize an uploaded CSV chunk by chunk, handing each cleaned
+    chunk to `sink` (e.g. a DatasetWriter's append).
+    Returns the first `preview_rows` cleaned rows as a DataFrame.
+    Files without a timestamp column are standardized in one piece, because
+    their synthetic timestamps are anchored on the total row count.
+    """
+    chunks = iter_csv_chunks(file_storage, chunksize, sample_bytes, encoding)
+    first = next(chunks)
+    if not timestamp_columns(first.columns):
+        chunks = iter([pd.concat([first, *chunks], ignore_index=True)])
+    else:
+        chunks = itertools.chain([first], chunks)
+
+    preview = []
+    n_preview = 0
+    for chunk in chunks:
+        cleaned = standardize(chunk)
+        sink(cleaned)
+        if n_preview < preview_rows:
+            preview.append(cleaned.head(preview_rows - n_preview))
+            n_preview += len(preview[-1])
+    return pd.concat(preview, ignore_index=True)
+
+def timestamp_columns(columns):
+    return [c for c in (str(c).strip() for c in columns) if 'time' in c.lower() or 'timestamp' in c.lower() or 'date' in c.lower()]
+
+def _wide_to_long(df, value_cols, label_col, value_col, labels=None):
+    """
+    Reshape wide meter columns into long rows (timestamp, label, value) without
+    iterating rows. Output order is row-major: every column of the first row,
+    then every column of the second row, and so on.
+    """
+    labels = list(value_cols) if labels is None else list(labels)
+    n, k = len(df), len(value_cols)
+    out = pd.DataFrame({
+        'timestamp': df['timestamp'].array.repeat(k),
+        label_col: np.tile(np.asarray(labels, dtype=object), n),
+        value_col: df[value_cols].to_numpy().reshape(-1),
+    })
+    return out.dropna(subset=['timestamp'])
 
+@timed("standardize", rows=len)
 def standardize_household(df):
     """
     Normalize household appliance-level CSVs to a long form:
@@ -38,7 +181,7 @@ def standardize_household(df):
     df.columns = [str(c).strip() for c in df.columns]
 
     # find timestamp column
-    ts_cols = [c for c in df.columns if 'time' in c.lower() or 'timestamp' in c.lower() or 'date' in c.lower()]
+    ts_cols = timestamp_columns(df.columns)
     if len(ts_cols) == 0:
         df['timestamp'] = pd.date_range(datetime.utcnow() - pd.Timedelta(hours=len(df)-1), periods=len(df), freq='H')
     else:
@@ -48,13 +191,8 @@ def standardize_household(df):
     # detect appliance columns like fridge_kwh, hvac_kwh, etc.
     appliance_cols = [c for c in df.columns if c.lower().endswith('_kwh') or ('appliance' in c.lower() and c != 'appliances')]
     if appliance_cols:
-        records = []
-        for _, row in df.iterrows():
-            for c in appliance_cols:
-                records.append({'timestamp': row['timestamp'], 'appliance': c.replace('_kwh', ''), 'energy_kwh': row[c]})
-        out = pd.DataFrame(records)
-        out = out.dropna(subset=['timestamp'])
-        return out
+        labels = [c.replace('_kwh', '') for c in appliance_cols]
+        return _wide_to_long(df, appliance_cols, 'appliance', 'energy_kwh', labels)
 
     # If there's explicit 'appliance' and an energy column
     energy_cols = [c for c in df.columns if 'kwh' in c.lower() or 'energy' in c.lower()]
@@ -69,6 +207,7 @@ def standardize_household(df):
     df['energy_kwh'] = 0.0
     return df[['timestamp', 'energy_kwh']]
 
+@timed("standardize", rows=len)
 def standardize_industrial(df):
     """
     Normalize industrial CSVs into long form:
@@ -77,7 +216,7 @@ def standardize_industrial(df):
     """
     df = df.copy()
     df.columns = [str(c).strip() for c in df.columns]
-    ts_cols = [c for c in df.columns if 'time' in c.lower() or 'timestamp' in c.lower() or 'date' in c.lower()]
+    ts_cols = timestamp_columns(df.columns)
     if len(ts_cols) == 0:
         df['timestamp'] = pd.date_range(datetime.utcnow() - pd.Timedelta(hours=len(df)-1), periods=len(df), freq='H')
     else:
@@ -86,13 +225,7 @@ def standardize_industrial(df):
 
     energy_cols = [c for c in df.columns if any(x in c.lower() for x in ['kwh', 'energy', 'gas', 'fuel', 'therm', 'liters', 'mwh'])]
     if energy_cols:
-        records = []
-        for _, row in df.iterrows():
-            for c in energy_cols:
-                records.append({'timestamp': row['timestamp'], 'energy_type': c, 'energy_value': row[c]})
-        out = pd.DataFrame(records)
-        out = out.dropna(subset=['timestamp'])
-        return out
+        return _wide_to_long(df, energy_cols, 'energy_type', 'energy_value')
 
     # fallback
     df['energy_value'] = 0.0
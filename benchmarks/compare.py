@@ -0,0 +1,54 @@
+"""
+Compare two benchmarks/run.py result files step by step.
+
+    python benchmarks/compare.py OLD.json NEW.json [--threshold 1.25]
+
+Exits with status 1 when any step present in both got slower than the
+threshold ratio (and took at least --min-seconds in the new run), or started
+failing.
+"""
+import sys
+import json
+import argparse
+
+KEY = ("kind", "layout", "rows", "series", "workers", "step")
+DEFAULTS = {"workers": 1}  # results written before --workers existed ran with ML_WORKERS=1
+
+def load(path):
+    with open(path, encoding="utf-8") as fh:
+        report = json.load(fh)
+    return report, {tuple(r.get(k, DEFAULTS.get(k)) for k in KEY): r for r in report["results"]}
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=1.25, help="new/old wall-time ratio counted as a regression")
+    p.add_argument("--min-seconds", type=float, default=0.01, help="ignore regressions on steps faster than this")
+    a = p.parse_args()
+    old_report, old = load(a.old)
+    new_report, new = load(a.new)
+    print(f"old {str(old_report.get('commit'))[:12]}  new {str(new_report.get('commit'))[:12]}")
+    print(f"{'kind':>10} {'layout':>6} {'rows':>9} {'ser':>4} {'wrk':>3} {'step':<28} {'old s':>9} {'new s':>9} {'ratio':>6} {'old MB':>8} {'new MB':>8}")
+    regressions = 0
+    for key in sorted(set(old) & set(new), key=str):
+        o, n = old[key], new[key]
+        if not (o["ok"] and n["ok"]):
+            flag = "  FAILING" if o["ok"] and not n["ok"] else ""
+            regressions += bool(flag)
+            print(f"{key[0]:>10} {key[1]:>6} {key[2]:>9} {key[3]:>4} {key[4]:>3} {key[5]:<28} {'ok' if o['ok'] else 'fail':>9} {'ok' if n['ok'] else 'fail':>9}{flag}")
+            continue
+        ratio = n["wall_s"] / o["wall_s"] if o["wall_s"] else float("inf")
+        slow = ratio > a.threshold and n["wall_s"] >= a.min_seconds
+        regressions += slow
+        mem = lambda r: f"{r['peak_mb']:8.1f}" if r.get("peak_mb") is not None else f"{'-':>8}"
+        print(f"{key[0]:>10} {key[1]:>6} {key[2]:>9} {key[3]:>4} {key[4]:>3} {key[5]:<28} {o['wall_s']:9.4f} {n['wall_s']:9.4f} {ratio:6.2f} {mem(o)} {mem(n)}"
+              + ("  SLOWER" if slow else ""))
+    only = len(set(old) ^ set(new))
+    if only:
+        print(f"{only} step(s) present in only one file")
+    print(f"{regressions} regression(s)")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
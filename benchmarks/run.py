@@ -0,0 +1,223 @@
+"""
+Times the ingest -> forecast -> recommend pipeline on synthetic data, library
+functions first and then every Flask endpoint through the test client, and
+writes wall time and peak traced memory per step as JSON.
+
+    python benchmarks/run.py --rows 1e3 1e4 1e5 --kinds household industrial
+    python benchmarks/run.py --kinds industrial --series 4 16 64 --workers 1 2 4 --steps api.forecast api.anomalies
+    python benchmarks/compare.py benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+Peak memory is what tracemalloc sees (Python objects and numpy buffers) above
+the level at the start of the step; --no-memory turns tracing off for timing
+that is free of its overhead. Work done in ML_WORKERS pool processes is not
+traced, so compare peaks across --workers with care.
+"""
+import os
+import io
+import sys
+import json
+import time
+import platform
+import shutil
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+import warnings
+import logging
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+BACKEND = os.path.join(ROOT, "backend")
+
+def git_info():
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+def measure(fn, repeat=1, memory=True):
+    """Run fn `repeat` times; returns (last result, best wall seconds, peak MB of the first run or None)."""
+    best, peak, result = None, None, None
+    for i in range(repeat):
+        trace = memory and i == 0
+        if trace:
+            tracemalloc.start()
+        t0 = time.perf_counter()
+        try:
+            result = fn()
+        finally:
+            wall = time.perf_counter() - t0
+            if trace:
+                peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+        best = wall if best is None else min(best, wall)
+    return result, best, peak
+
+class Suite:
+    def __init__(self, repeat, memory, steps):
+        self.repeat = repeat
+        self.memory = memory
+        self.steps = steps
+        self.results = []
+
+    def run(self, case, step, fn, repeat=None):
+        """Time one step; failures are recorded (not raised) so later steps still run. Returns fn's result or None."""
+        if self.steps and not any(step.startswith(s) for s in self.steps):
+            return None
+        rec = {"step": step, **case}
+        try:
+            result, rec["wall_s"], rec["peak_mb"] = measure(fn, repeat or self.repeat, self.memory)
+            rec["ok"] = True
+        except Exception as e:
+            result, rec["ok"], rec["error"] = None, False, f"{type(e).__name__}: {e}"
+        self.results.append(rec)
+        status = f"{rec['wall_s']:9.4f}s {rec['peak_mb'] or 0:9.1f}MB" if rec["ok"] else "FAILED " + rec["error"][:60]
+        print(f"{case['kind']:>10} {case['layout']:>6} {case['rows']:>9} {case['series']:>4} {case['workers']:>3} {step:<28} {status}",
+              flush=True)
+        return result
+
+def _check(resp):
+    if resp.status_code >= 400:
+        raise RuntimeError(f"HTTP {resp.status_code}: {resp.get_data(as_text=True)[:200]}")
+    return resp
+
+def _drop_models(backend):
+    """Empty the model registry so the next .cold step fits again."""
+    for name in os.listdir(backend.models.root):
+        os.remove(os.path.join(backend.models.root, name))
+
+def bench_case(suite, backend, kind, layout, rows, series, workers, engine, seed):
+    import pandas as pd
+    from synth import generate
+    from utils import read_csv_file, standardize_household, standardize_industrial
+    from ml_model import AnomalyDetector, Forecaster, create_lag_features, fit_series
+    client = backend.app.test_client()
+    backend.Config.ML_WORKERS = workers[0]
+    case = {"kind": kind, "layout": layout, "rows": rows, "series": series, "workers": workers[0]}
+    standardize = standardize_household if kind == "household" else standardize_industrial
+
+    raw_df = suite.run(case, "synth.generate", lambda: generate(kind, rows, series, layout, seed=seed), repeat=1)
+    if raw_df is None:
+        raw_df = generate(kind, rows, series, layout, seed=seed)
+    csv = raw_df.to_csv(index=False).encode("utf-8")
+    case["csv_mb"] = round(len(csv) / 2 ** 20, 3)
+
+    parsed = suite.run(case, "utils.read_csv_file", lambda: read_csv_file(io.BytesIO(csv)))
+    if parsed is None:
+        parsed = read_csv_file(io.BytesIO(csv))
+    cleaned = suite.run(case, f"utils.standardize_{kind}", lambda: standardize(parsed))
+    if cleaned is None:
+        cleaned = standardize(parsed)
+    label, value_col = ("appliance", "energy_kwh") if kind == "household" else ("energy_type", "energy_value")
+    values = pd.to_numeric(cleaned[value_col], errors="coerce")
+    agg = cleaned.assign(energy_kwh=values).groupby("timestamp")["energy_kwh"].sum().reset_index()
+
+    suite.run(case, "ml.create_lag_features", lambda: create_lag_features(agg, "energy_kwh"))
+    fore = suite.run(case, "ml.Forecaster.train", lambda: fit_series(Forecaster(engine=engine, random_state=seed), agg, "energy_kwh"), repeat=1)
+    if fore is not None:
+        suite.run(case, "ml.Forecaster.predict_next_n", lambda: fore.predict_next_n(agg, 24, "energy_kwh"))
+    scored = cleaned.assign(energy_kwh=values).dropna(subset=["energy_kwh"])
+    det = suite.run(case, "ml.AnomalyDetector.fit", lambda: fit_series(AnomalyDetector(random_state=seed), scored, "energy_kwh"), repeat=1)
+    if det is not None:
+        suite.run(case, "ml.AnomalyDetector.detect", lambda: det.detect(scored, "energy_kwh"))
+
+    fname = f"bench-{kind}-{layout}-{rows}-{series}.csv"
+    upload = lambda: _check(client.post(
+        "/upload", data={"file": (io.BytesIO(csv), fname), "data_type": kind}, content_type="multipart/form-data")).get_json()
+    up = suite.run(case, "api.upload", upload, repeat=1)
+    if up is None:
+        try:
+            up = upload()
+        except Exception:
+            return
+    name = up["cleaned_filename"]
+    # the same bytes again are served from the content-addressed upload index
+    suite.run(case, "api.upload.dedup", upload, repeat=1)
+    ts_col = "timestamp" if "timestamp" in raw_df.columns else "date"
+    next_start = pd.Timestamp(raw_df[ts_col].max()) + pd.Timedelta(days=1)
+    delta = generate(kind, max(rows // 100, 10), series, layout, seed=seed + 1, start=str(next_start.date()))
+    delta_csv = delta.to_csv(index=False).encode("utf-8")
+    suite.run(case, "api.append", lambda: _check(client.post(
+        "/append", data={"file": (io.BytesIO(delta_csv), "delta.csv"), "cleaned_filename": name},
+        content_type="multipart/form-data")), repeat=1)
+    suite.run(case, "api.download", lambda: _check(client.get(f"/download/{name}")).data)
+    suite.run(case, "api.summary", lambda: _check(client.get(f"/summary/{name}")))
+    suite.run(case, "api.series", lambda: _check(client.get(f"/series/{name}?points=1000")))
+    body = {"cleaned_filename": name, "horizon": 24}
+    if engine:
+        body["model"] = engine
+    # only industrial data fits and scores one model per energy type on the ML_WORKERS pool
+    for n_workers in workers if kind == "industrial" else workers[:1]:
+        backend.Config.ML_WORKERS = n_workers
+        _drop_models(backend)
+        wcase = {**case, "workers": n_workers}
+        suite.run(wcase, "api.forecast.cold", lambda: _check(client.post("/forecast", json=body)), repeat=1)
+        suite.run(wcase, "api.forecast.warm", lambda: _check(client.post("/forecast", json=body)))
+        suite.run(wcase, "api.anomalies.cold", lambda: _check(client.post("/anomalies", json={"cleaned_filename": name})), repeat=1)
+        suite.run(wcase, "api.anomalies.warm", lambda: _check(client.post("/anomalies", json={"cleaned_filename": name})))
+    backend.Config.ML_WORKERS = workers[0]
+    suite.run(case, "api.anomalies.online", lambda: _check(client.post("/anomalies", json={"cleaned_filename": name, "method": "online"})), repeat=1)
+    suite.run(case, "api.recommend", lambda: _check(client.post("/recommend", json={"cleaned_filename": name})))
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--rows", type=float, nargs="+", default=[1e3, 1e4, 1e5], help="CSV rows per case (1e3 .. 1e7)")
+    p.add_argument("--kinds", nargs="+", default=["household", "industrial"], choices=["household", "industrial"])
+    p.add_argument("--layouts", nargs="+", default=["wide", "long", "sample"], help="skipped where a kind does not support one")
+    p.add_argument("--series", type=int, nargs="+", default=[4], help="appliances / energy types per case (sites for the sample layout)")
+    p.add_argument("--workers", type=int, nargs="+", default=[1],
+                   help="ML_WORKERS values swept over the industrial forecast/anomaly steps; the first is used everywhere else")
+    p.add_argument("--engine", default=None, help="forecasting engine (default: the Forecaster default)")
+    p.add_argument("--steps", nargs="*", default=[], help="only run steps starting with these prefixes, e.g. api. ml.Forecaster")
+    p.add_argument("--repeat", type=int, default=3, help="timed runs per step; the fastest is kept (fits and first calls run once)")
+    p.add_argument("--no-memory", dest="memory", action="store_false", help="skip tracemalloc peak tracking")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("-o", "--out", default=None, help="output JSON (default: benchmarks/results/<commit>.json)")
+    a = p.parse_args()
+    out = os.path.abspath(a.out) if a.out else None
+
+    work = tempfile.mkdtemp(prefix="energy-bench-")
+    try:
+        os.environ.update(UPLOAD_FOLDER=os.path.join(work, "uploads"), MODEL_PATH=os.path.join(work, "models"),
+                          OPENAI_API_KEY="", LLM_CACHE_DIR="", PYTHONWARNINGS="ignore")  # also quiets pool workers
+        sys.path[:0] = [HERE, BACKEND]
+        os.chdir(BACKEND)
+        warnings.filterwarnings("ignore")
+        import numpy, pandas, sklearn
+        from synth import LAYOUTS
+        import app as backend
+        backend.app.logger.setLevel(logging.CRITICAL)  # failing steps are recorded, not logged
+
+        suite = Suite(a.repeat, a.memory, a.steps)
+        for kind in a.kinds:
+            for layout in a.layouts:
+                if layout not in LAYOUTS[kind]:
+                    continue
+                for series in a.series:
+                    for rows in a.rows:
+                        bench_case(suite, backend, kind, layout, int(rows), series, a.workers, a.engine, a.seed)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    info = git_info()
+    report = {
+        "suite": "energy-pipeline",
+        "version": 1,
+        **info,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "env": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+                "numpy": numpy.__version__, "pandas": pandas.__version__, "sklearn": sklearn.__version__},
+        "params": {k: v for k, v in vars(a).items() if k != "out"},
+        "results": suite.results,
+    }
+    out = out or os.path.join(HERE, "results", f"{(info['commit'] or 'unknown')[:12]}{'-dirty' if info['dirty'] else ''}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=1)
+    print(f"wrote {out}")
+
+if __name__ == "__main__":
+    main()
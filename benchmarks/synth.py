@@ -0,0 +1,109 @@
+"""
+Synthetic energy CSVs at arbitrary scale, shaped like the packaged samples or
+like the wide/long layouts the standardizers accept.
+
+    python benchmarks/synth.py household 1000000 --layout long --series 8 -o /tmp/h.csv
+"""
+import argparse
+import numpy as np
+import pandas as pd
+
+APPLIANCES = ["fridge", "hvac", "water_heater", "washer", "dryer", "dishwasher", "oven", "lighting",
+              "ev_charger", "tv", "computer", "pool_pump"]
+ENERGY_TYPES = ["electricity_kwh", "natural_gas_kwh", "petrol_liters", "coal_kg", "diesel_liters", "steam_mwh",
+                "solar_generation_kwh", "propane_therms"]
+LAYOUTS = {"household": ("wide", "long", "sample"), "industrial": ("wide", "sample")}
+
+def _names(base, n):
+    """n distinct series names, cycling base with numeric suffixes past its length."""
+    return [base[i % len(base)] + (f"_{i // len(base)}" if i >= len(base) else "") for i in range(n)]
+
+def _load(rng, timestamps, n_series):
+    """Daily/weekly-seasonal positive load, shape (len(timestamps), n_series)."""
+    hours = timestamps.hour.to_numpy()[:, None]
+    weekday = timestamps.weekday.to_numpy()[:, None]
+    scale = rng.uniform(0.2, 3.0, n_series)[None, :]
+    phase = rng.uniform(0, 24, n_series)[None, :]
+    daily = 1 + 0.6 * np.sin(2 * np.pi * (hours - phase) / 24)
+    weekly = np.where(weekday >= 5, 1.15, 1.0)
+    noise = rng.gamma(8.0, 1 / 8.0, (len(timestamps), n_series))
+    return np.round(scale * daily * weekly * noise, 4)
+
+def generate(kind="household", rows=10_000, series=4, layout="wide", freq="h", seed=0, start="2024-01-01"):
+    """
+    A DataFrame of about `rows` CSV rows:
+      wide    timestamp + one <name>_kwh (household) or energy-type column per series
+      long    timestamp, appliance, energy_kwh (household only)
+      sample  the packaged household_energy.csv / business_energy.csv schema,
+              one row per site per day with `series` sites
+    """
+    if layout not in LAYOUTS[kind]:
+        raise ValueError(f"{kind} layouts: {', '.join(LAYOUTS[kind])}")
+    rng = np.random.default_rng(seed)
+    if layout == "sample":
+        return _sample(kind, rng, rows, series, start)
+    periods = rows if layout == "wide" else -(-rows // series)
+    ts = pd.date_range(start, periods=periods, freq=freq)
+    values = _load(rng, ts, series)
+    if kind == "household":
+        names = _names(APPLIANCES, series)
+        if layout == "long":
+            df = pd.DataFrame({"timestamp": ts.repeat(series), "appliance": np.tile(names, periods),
+                               "energy_kwh": values.reshape(-1)})
+            return df.iloc[:rows]
+        cols = [f"{n}_kwh" for n in names]
+    else:
+        cols = _names(ENERGY_TYPES, series)
+    df = pd.DataFrame(values, columns=cols)
+    df.insert(0, "timestamp", ts)
+    return df
+
+def _sample(kind, rng, rows, sites, start):
+    n = rows
+    day = pd.date_range(start, periods=-(-n // sites), freq="D").repeat(sites)[:n]
+    site = np.tile(np.arange(1, sites + 1), -(-n // sites))[:n]
+    tariff = np.round(rng.uniform(0.11, 0.18, n), 3)
+    if kind == "household":
+        elec = np.round(rng.gamma(9, 0.55, n), 2)
+        df = pd.DataFrame({
+            "date": day.strftime("%Y-%m-%d"), "household_id": [f"H_{i:03d}" for i in site],
+            "occupants": rng.integers(1, 7, n), "square_footage": rng.integers(450, 2200, n),
+            "avg_temp_c": np.round(rng.normal(24, 5, n), 1), "appliance_count": rng.integers(3, 14, n),
+            "electricity_kwh": elec, "gas_kg_lpg": np.round(np.where(rng.random(n) < 0.3, rng.uniform(0.5, 1.5, n), 0), 2),
+            "petrol_liters": np.round(np.where(rng.random(n) < 0.2, rng.uniform(1, 6, n), 0), 2),
+            "solar_generation_kwh": np.round(np.where(rng.random(n) < 0.6, rng.uniform(0, 2, n), 0), 2),
+            "is_weekend": (day.weekday >= 5).astype(int), "tariff_per_kwh_usd": tariff,
+        })
+        df["daily_cost_usd"] = np.round(df["electricity_kwh"] * tariff + df["gas_kg_lpg"] * 0.9, 2)
+        return df
+    elec = np.round(rng.gamma(4, 8, n), 2)
+    gas = np.round(np.where(rng.random(n) < 0.5, rng.uniform(200, 1000, n), 0), 2)
+    petrol = np.round(np.where(rng.random(n) < 0.2, rng.uniform(5, 60, n), 0), 2)
+    coal = np.round(np.where(rng.random(n) < 0.1, rng.uniform(50, 400, n), 0), 2)
+    df = pd.DataFrame({
+        "date": day.strftime("%Y-%m-%d"), "business_id": [f"BIZ_{i:03d}" for i in site],
+        "employees": rng.integers(3, 250, n), "building_area_sqft": rng.integers(800, 9000, n),
+        "operating_hours": rng.choice([8, 10, 12, 16, 24], n), "devices_count": rng.integers(10, 500, n),
+        "electricity_kwh": elec, "petrol_liters": petrol, "coal_kg": coal, "natural_gas_kwh": gas,
+        "petrol_kwh_eq": np.round(petrol * 9.7, 2), "coal_kwh_eq": np.round(coal * 8.1, 2),
+    })
+    df["total_kwh_equiv"] = np.round(elec + gas + df["petrol_kwh_eq"] + df["coal_kwh_eq"], 2)
+    df["fuel_mix"] = np.where(gas > 0, "electricity+natgas", "electricity")
+    df["tariff_per_kwh_usd"] = tariff
+    df["daily_cost_usd"] = np.round(elec * tariff + gas * 0.05, 2)
+    return df
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("kind", choices=list(LAYOUTS))
+    p.add_argument("rows", type=float)
+    p.add_argument("--series", type=int, default=4, help="appliances / energy types (sites for --layout sample)")
+    p.add_argument("--layout", default="wide")
+    p.add_argument("--freq", default="h")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("-o", "--out", required=True)
+    a = p.parse_args()
+    generate(a.kind, int(a.rows), a.series, a.layout, a.freq, a.seed).to_csv(a.out, index=False)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,30 @@
 import streamlit as st
-import requests, io, pandas as pd, os, plotly.express as px
+import requests, time, pandas as pd, os, plotly.express as px
 
 API = os.getenv("API_BASE", "http://localhost:5000")
+TIMEOUT = float(os.getenv("API_TIMEOUT", "30"))
+JOB_TIMEOUT = float(os.getenv("API_JOB_TIMEOUT", "600"))
+
+def run_job(path, payload, label):
+    """Submit a background job to the API and poll it with a progress bar; returns (ok, json)."""
+    r = requests.post(f"{API}{path}", json={**payload, "async": True}, timeout=TIMEOUT)
+    if r.status_code != 202:
+        return r.ok, (r.json() if r.headers.get("content-type", "").startswith("application/json") else {})
+    status_url = API + r.json()["status_url"]
+    bar = st.progress(0.0, text=label)
+    deadline = time.time() + JOB_TIMEOUT
+    while time.time() < deadline:
+        j = requests.get(status_url, timeout=TIMEOUT).json()
+        bar.progress(j.get("progress", 0.0), text=j.get("message") or label)
+        if j.get("status") == "done":
+            bar.empty()
+            return 200 <= j["status_code"] < 300, j["result"]
+        if j.get("status") == "failed" or not j.get("ok"):
+            bar.empty()
+            return False, j
+        time.sleep(0.5)
+    bar.empty()
+    return False, {"error": "timed out waiting for the API"}
 
 st.set_page_config(page_title="Energy Consumption Optimization Advisor", layout="wide")
 st.title("Energy Consumption Optimization Advisor — Full MVP")
@@ -20,11 +43,17 @@ if st.button("Show packaged sample CSV"):
     else:
         st.error("Sample not found in packaged data folder.")
 
+@st.cache_data(ttl=600, show_spinner=False)
+def fetch_series(cleaned, start, end, points, rows):
+    """Cached /series call; `rows` is only part of the cache key, so appended data is refetched."""
+    r = requests.get(f"{API}/series/{cleaned}", params={"start": start, "end": end, "points": points}, timeout=TIMEOUT)
+    return r.json()
+
 uploaded = st.file_uploader("Upload CSV", type=["csv"])
 if uploaded:
     files = {"file": (uploaded.name, uploaded.getvalue(), "text/csv")}
     with st.spinner("Uploading..."):
-        r = requests.post(f"{API}/upload", files=files, data={"data_type": dtype})
+        r = requests.post(f"{API}/upload", files=files, data={"data_type": dtype}, timeout=JOB_TIMEOUT)
     if not r.ok:
         st.error("Upload failed: " + r.text)
     else:
@@ -38,39 +67,39 @@ if uploaded:
             st.dataframe(preview.head(50))
 
             if st.button("Download cleaned CSV"):
-                rr = requests.get(f"{API}/download/{cleaned}")
+                rr = requests.get(f"{API}/download/{cleaned}", timeout=JOB_TIMEOUT)
                 if rr.ok:
                     st.download_button("Download cleaned file", rr.content, file_name=cleaned, mime="text/csv")
                 else:
                     st.error("Download failed.")
 
             st.subheader("Visualize cleaned data")
-            rr = requests.get(f"{API}/download/{cleaned}")
-            if rr.ok:
-                dfc = pd.read_csv(io.StringIO(rr.content.decode("utf-8")), parse_dates=["timestamp"])
-                if dtype == "household":
-                    if "appliance" in dfc.columns:
-                        agg = dfc.groupby(["timestamp", "appliance"])["energy_kwh"].sum().reset_index()
-                        fig = px.line(agg, x="timestamp", y="energy_kwh", color="appliance", title="Appliance-level consumption")
-                        st.plotly_chart(fig, use_container_width=True)
+            info = requests.get(f"{API}/summary/{cleaned}", timeout=TIMEOUT).json()
+            if info.get("ok") and info["summary"]["start"]:
+                summary = info["summary"]
+                first, last = pd.Timestamp(summary["start"]).date(), pd.Timestamp(summary["end"]).date()
+                span = st.date_input("Time range", (first, last), min_value=first, max_value=last)
+                start, end = span if len(span) == 2 else (first, last)
+                points = st.select_slider("Points per series", [250, 500, 1000, 2000, 5000], value=1000)
+                js = fetch_series(cleaned, str(start), f"{end}T23:59:59.999", points, summary["rows"])
+                if js.get("ok"):
+                    plot = pd.concat([pd.DataFrame({"timestamp": pd.to_datetime(v["timestamp"], unit="ms"), "value": v["value"], "series": k})
+                                      for k, v in js["series"].items()], ignore_index=True)
+                    resolutions = sorted({v["resolution"] for v in js["series"].values()})
+                    labels = {"value": summary["value_col"], "series": summary["label_col"] or "series"}
+                    if dtype == "household":
+                        title = "Appliance-level consumption" if summary["label_col"] == "appliance" else "Household consumption"
                     else:
-                        fig = px.line(dfc, x="timestamp", y="energy_kwh", title="Household consumption")
-                        st.plotly_chart(fig, use_container_width=True)
+                        title = "Industrial energy types" if summary["label_col"] == "energy_type" else "Industrial consumption"
+                    fig = px.line(plot, x="timestamp", y="value", color="series" if summary["label_col"] else None, labels=labels, title=title)
+                    st.plotly_chart(fig, use_container_width=True)
+                    st.caption("Resolution: " + ", ".join(resolutions))
                 else:
-                    if "energy_type" in dfc.columns:
-                        agg = dfc.groupby(["timestamp", "energy_type"])["energy_value"].sum().reset_index()
-                        fig = px.line(agg, x="timestamp", y="energy_value", color="energy_type", title="Industrial energy types")
-                        st.plotly_chart(fig, use_container_width=True)
-                    else:
-                        col = "energy_value" if "energy_value" in dfc.columns else dfc.columns[1]
-                        fig = px.line(dfc, x="timestamp", y=col, title="Industrial consumption")
-                        st.plotly_chart(fig, use_container_width=True)
+                    st.error("Series API error")
 
                 if st.button("Detect anomalies"):
-                    with st.spinner("Detecting anomalies..."):
-                        r2 = requests.post(f"{API}/anomalies", json={"cleaned_filename": cleaned})
-                    if r2.ok:
-                        j2 = r2.json()
+                    ok2, j2 = run_job("/anomalies", {"cleaned_filename": cleaned}, "Detecting anomalies...")
+                    if ok2:
                         anoms = j2.get("anomalies", [])
                         st.write("Anomalies found:", len(anoms))
                         if len(anoms) > 0:
@@ -80,11 +109,10 @@ if uploaded:
 
                 st.subheader("Forecast & recommendations")
                 horizon = st.slider("Forecast horizon (hours)", 6, 168, 24)
+                per_series = st.checkbox("Per-appliance / per-type forecasts (one global model)")
                 if st.button("Run forecast"):
-                    with st.spinner("Forecasting..."):
-                        r3 = requests.post(f"{API}/forecast", json={"cleaned_filename": cleaned, "horizon": horizon})
-                    if r3.ok:
-                        j3 = r3.json()
+                    ok3, j3 = run_job("/forecast", {"cleaned_filename": cleaned, "horizon": horizon, "global": per_series}, "Forecasting...")
+                    if ok3:
                         st.json(j3)
                     else:
                         st.error("Forecast API error")
@@ -93,10 +121,8 @@ if uploaded:
                 context = st.text_input("Context (optional): e.g. 'residential, EV owner'")
 
                 if st.button("Get recommendations"):
-                    with st.spinner("Generating recommendations..."):
-                        r4 = requests.post(f"{API}/recommend", json={"cleaned_filename": cleaned, "price_per_kwh": price, "horizon": horizon, "context": context})
-                    if r4.ok:
-                        j4 = r4.json()
+                    ok4, j4 = run_job("/recommend", {"cleaned_filename": cleaned, "price_per_kwh": price, "horizon": horizon, "context": context}, "Generating recommendations...")
+                    if ok4:
                         if "recommendations" in j4:
                             st.json(j4["recommendations"])
                         else:
@@ -0,0 +1,21 @@
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+import pytest
+
+# backend modules import each other top-level (the app is run from backend/)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "backend"), os.path.join(ROOT, "benchmarks")]
+
+# Config reads the environment once, at first import: point the app at scratch storage
+_work = tempfile.mkdtemp(prefix="energy-tests-")
+atexit.register(shutil.rmtree, _work, ignore_errors=True)
+os.environ.update(UPLOAD_FOLDER=os.path.join(_work, "uploads"), MODEL_PATH=os.path.join(_work, "models"),
+                  OPENAI_API_KEY="", LLM_CACHE_DIR="", PRELOAD="0")
+
+@pytest.fixture
+def client():
+    import app
+    return app.app.test_client()
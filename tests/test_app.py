@@ -0,0 +1,316 @@
+import io
+import pytest
+from test_utils import _latin1_after_sample
+
+@pytest.mark.parametrize("streaming", ["1", "0"])
+def test_upload_latin1_past_sample(client, streaming):
+    data = _latin1_after_sample()
+    r = client.post("/upload", data={"file": (io.BytesIO(data), f"latin1-{streaming}.csv"), "data_type": "household", "streaming": streaming},
+                    content_type="multipart/form-data")
+    assert r.status_code == 200, r.get_data(as_text=True)[:300]
+    name = r.get_json()["cleaned_filename"]
+    summary = client.get(f"/summary/{name}").get_json()
+    assert summary["ok"]
+    csv = client.get(f"/download/{name}").get_data(as_text=True)
+    assert len(csv.strip().splitlines()) == 5001
+
+def _upload(client, df, name, kind="household"):
+    r = client.post("/upload", data={"file": (io.BytesIO(df.to_csv(index=False).encode()), name), "data_type": kind},
+                    content_type="multipart/form-data")
+    assert r.status_code == 200, r.get_data(as_text=True)[:300]
+    return r.get_json()["cleaned_filename"]
+
+def test_online_anomalies_score_only_appended_rows(client):
+    import numpy as np
+    import pandas as pd
+    from ml_model import OnlineAnomalyDetector
+    from synth import generate
+    raw = generate("household", 3000, 3, "wide", seed=3)
+    head, tail = raw.iloc[:2900], raw.iloc[2900:].copy()
+    tail.iloc[40, 1] = 500.0  # a spike in the appended part
+    name = _upload(client, head, "online.csv")
+    first = client.post("/anomalies", json={"cleaned_filename": name, "method": "online"}).get_json()
+    assert set(first["scored"].values()) == {2900}
+    rows = _standardized_rows(tail)
+    assert client.post("/append", json={"cleaned_filename": name, "rows": rows}).get_json()["appended"] == len(rows)
+    second = client.post("/anomalies", json={"cleaned_filename": name, "method": "online"}).get_json()
+    assert set(second["scored"].values()) == {100}
+    # same flags as one detector fed the whole series at once
+    full = client.get(f"/download/{name}").get_data(as_text=True)
+    df = pd.read_csv(io.StringIO(full), parse_dates=["timestamp"])
+    got = pd.DataFrame(second["anomalies"])
+    for key, grp in df.groupby("appliance"):
+        det = OnlineAnomalyDetector()
+        det.score_new(grp.sort_values("timestamp", kind="stable"), "energy_kwh")
+        mine = got[got["appliance"] == key]
+        np.testing.assert_allclose(np.sort(mine["energy_kwh"].to_numpy()), np.sort(det.flagged["value"].to_numpy()))
+    assert (got["energy_kwh"] == 500.0).any()
+
+def _standardized_rows(wide):
+    from utils import standardize_household
+    out = standardize_household(wide)
+    out["timestamp"] = out["timestamp"].dt.strftime("%Y-%m-%d %H:%M:%S")
+    return out.to_dict(orient="records")
+
+def test_global_forecast_total_over_misaligned_series(client):
+    from test_ml_model import _misaligned
+    long = _misaligned()
+    wide = long.pivot(index="timestamp", columns="appliance", values="energy_kwh").add_suffix("_kwh").reset_index()
+    name = _upload(client, wide, "misaligned.csv")
+    for mode in ("recursive", "direct"):
+        j = client.post("/forecast", json={"cleaned_filename": name, "global": True, "model": "ridge", "mode": mode, "horizon": 12,
+                                           "format": "columnar"}).get_json()
+        assert j["ok"], j
+        starts = {p["timestamp"][0] for p in j["per_appliance"].values()}
+        assert starts == {j["total"]["timestamp"][0]} and len(j["total"]["timestamp"]) == 12
+
+def test_optimize_baseline_covers_appliances_that_stopped_early(client):
+    import pandas as pd
+    from test_ml_model import _misaligned
+    long = _misaligned()
+    wide = long.pivot(index="timestamp", columns="appliance", values="energy_kwh").add_suffix("_kwh").reset_index()
+    name = _upload(client, wide, "optimize-misaligned.csv")
+    tou = [0.10] * 7 + [0.20] * 10 + [0.35] * 5 + [0.12] * 2
+    j = client.post("/optimize", json={"cleaned_filename": name, "prices": tou, "horizon": 24}).get_json()
+    assert j["ok"], j
+    schedule = pd.DataFrame(j["households"][0]["schedule"])
+    ev = schedule[schedule["appliance"] == "ev_charger"]
+    assert len(ev) == 24 and (ev["baseline_kwh"] > 0).all()
+    assert pd.to_datetime(ev["timestamp"]).min() > pd.Timestamp(long["timestamp"].max())
+
+def _anomalies(client, **body):
+    r = client.post("/anomalies", json=body)
+    assert r.status_code == 200, r.get_data(as_text=True)[:300]
+    return r
+
+def test_anomaly_formats_and_pages_match_unpaginated(client):
+    import base64
+    import json
+    import pandas as pd
+    from synth import generate
+    name = _upload(client, generate("household", 2000, 3, "wide", seed=7), "pages.csv")
+    rows = _anomalies(client, cleaned_filename=name).get_json()["anomalies"]
+    full = [(pd.Timestamp(r["timestamp"]).tz_localize(None), r["appliance"]) for r in rows]
+    assert len(full) > 10
+
+    cols = _anomalies(client, cleaned_filename=name, format="columnar").get_json()["anomalies"]
+    assert list(zip(pd.to_datetime(cols["timestamp"], unit="ms"), cols["appliance"])) == full
+    lines = _anomalies(client, cleaned_filename=name, format="ndjson").get_data(as_text=True).splitlines()
+    assert json.loads(lines[0])["ok"]
+    streamed = [json.loads(line) for line in lines[1:]]
+    assert [(pd.Timestamp(r["timestamp"]).tz_localize(None), r["appliance"]) for r in streamed] == full
+
+    paged, cursor = [], None
+    while True:
+        body = _anomalies(client, cleaned_filename=name, format="columnar", limit=4, cursor=cursor).get_json()
+        page = body["anomalies"]
+        assert len(page["timestamp"]) <= 4
+        paged += zip(pd.to_datetime(page["timestamp"], unit="ms"), page["appliance"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert sorted(paged) == paged and sorted(paged) == sorted(full)
+
+    for bad in ([1, 2], ["2024-01-01", "fridge"], 5, [1], "not json"):
+        token = base64.urlsafe_b64encode(json.dumps(bad).encode()).decode()
+        r = client.post("/anomalies", json={"cleaned_filename": name, "limit": 4, "cursor": token})
+        assert r.status_code == 400 and r.get_json()["error"] == "invalid cursor", bad
+    r = client.post("/anomalies", json={"cleaned_filename": name, "limit": 4, "cursor": "%%%"})
+    assert r.status_code == 400
+
+def test_parallel_fit_and_forecast_match_serial(client, monkeypatch, tmp_path):
+    import app
+    from config import Config
+    from model_registry import ModelRegistry
+    from synth import generate
+    name = _upload(client, generate("industrial", 400, 3, "wide", seed=11), "workers.csv", kind="industrial")
+    out = {}
+    for workers in (1, 2):
+        monkeypatch.setattr(Config, "ML_WORKERS", workers)
+        # an empty registry per run, so both runs fit rather than load
+        monkeypatch.setattr(app, "models", ModelRegistry(str(tmp_path / f"models-{workers}")))
+        fore = client.post("/forecast", json={"cleaned_filename": name, "horizon": 12}).get_json()
+        anom = client.post("/anomalies", json={"cleaned_filename": name}).get_json()
+        assert set(fore["model_cache"].values()) == {"miss"}
+        out[workers] = (fore["per_type"], anom["anomalies"])
+    assert len(out[1][0]) == 3
+    assert out[2] == out[1]
+
+def _engine_cases():
+    from ml_model import DIRECT_ENGINES, ENGINES
+    return [("recursive", e) for e in ENGINES + ("auto",)] + [("direct", e) for e in DIRECT_ENGINES + ("auto",)]
+
+@pytest.mark.parametrize("mode,engine", _engine_cases())
+def test_every_engine_forecasts_the_same_schema(client, mode, engine):
+    from ml_model import DIRECT_ENGINES, ENGINES
+    from test_ml_model import _misaligned
+    long = _misaligned()
+    wide = long.pivot(index="timestamp", columns="appliance", values="energy_kwh").add_suffix("_kwh").reset_index()
+    name = _upload(client, wide, "engines.csv")
+    j = client.post("/forecast", json={"cleaned_filename": name, "model": engine, "mode": mode, "horizon": 12}).get_json()
+    assert j["ok"], j
+    assert j["model"] in (ENGINES if mode == "recursive" else DIRECT_ENGINES)
+    if engine != "auto":
+        assert j["model"] == engine and list(j["engines"]) == [engine]
+    assert j["model"] in j["engines"]
+    assert [set(p) for p in j["predictions"]] == [{"timestamp", "predicted"}] * 12
+    assert all(isinstance(p["predicted"], float) for p in j["predictions"])
+
+def test_append_drops_rows_already_stored(client):
+    import pandas as pd
+    from synth import generate
+    raw = generate("household", 300, 3, "wide", seed=7)
+    name = _upload(client, raw.iloc[:200], "append-dups.csv")
+    post = lambda rows: client.post("/append", json={"cleaned_filename": name, "rows": rows})
+    rows = _standardized_rows(raw.iloc[190:220])
+    # cleaned-schema rows: 10 hours already stored, 20 new, each sent twice
+    j = post(rows + rows).get_json()
+    assert (j["appended"], j["duplicates"], j["rows"]) == (60, 120, 660)
+    assert post(rows).get_json()["appended"] == 0
+    # raw wide rows go through the household normalizer; the overlap is dropped the same way
+    wide = raw.iloc[215:240].assign(timestamp=lambda d: d["timestamp"].astype(str)).to_dict(orient="records")
+    j = post(wide).get_json()
+    assert (j["appended"], j["duplicates"], j["rows"]) == (60, 15, 720)
+    stored = pd.read_csv(io.StringIO(client.get(f"/download/{name}").get_data(as_text=True)))
+    assert not stored.duplicated(["timestamp", "appliance"]).any()
+
+def test_append_tz_aware_rows(client):
+    import pandas as pd
+    ts = pd.date_range("2024-03-01", periods=48, freq="h", tz="Europe/Berlin")
+    wide = pd.DataFrame({"timestamp": ts.astype(str), "fridge_kwh": 0.5})
+    name = _upload(client, wide.iloc[:36], "tz-append.csv")
+    # the same instants in another offset are duplicates; the rest are new
+    utc = pd.DataFrame({"timestamp": ts[30:].tz_convert("UTC").astype(str), "fridge_kwh": 0.5})
+    j = client.post("/append", json={"cleaned_filename": name, "rows": utc.to_dict(orient="records")}).get_json()
+    assert j["ok"], j
+    assert (j["appended"], j["duplicates"], j["rows"]) == (12, 6, 48)
+
+def test_append_rejects_bad_requests(client):
+    from synth import generate
+    name = _upload(client, generate("household", 50, 2, "wide", seed=1), "append-errors.csv")
+    r = client.post("/append", json={"cleaned_filename": name, "rows": [{"fridge_kwh": 1.0}]})
+    assert r.status_code == 400 and "timestamp" in r.get_json()["error"]
+    r = client.post("/append", json={"cleaned_filename": "nope.csv", "rows": [{"timestamp": "2024-01-01", "fridge_kwh": 1.0}]})
+    assert r.status_code == 404
+
+def test_online_anomalies_state_lives_with_the_dataset(client, monkeypatch, tmp_path):
+    import os
+    import numpy as np
+    import pandas as pd
+    import app
+    from config import Config
+    from ml_model import OnlineAnomalyDetector
+    from model_registry import ModelRegistry
+    from test_utils import _industrial
+    raw = _industrial(3000, seed=4)
+    raw.loc[[1800, 2400, 2800], "electricity_kwh"] = 5000.0
+    name = _upload(client, raw.iloc[:2000], "online-plant.csv", kind="industrial")
+    forest = _anomalies(client, cleaned_filename=name).get_json()
+    online = _anomalies(client, cleaned_filename=name, method="online").get_json()
+    assert {"timestamp", "energy_type", "energy_kwh", "anomaly"} <= set(online["anomalies"][0]) and "energy_value" not in online["anomalies"][0]
+    assert set(forest["anomalies"][0]) <= set(online["anomalies"][0])
+    path = os.path.join(os.environ["UPLOAD_FOLDER"], name + ".cols")
+    assert os.path.exists(os.path.join(path, app.ONLINE_STATE_FILE))
+    # an emptied model registry does not reset the detectors
+    monkeypatch.setattr(app, "models", ModelRegistry(str(tmp_path / "models")))
+    monkeypatch.setattr(Config, "ONLINE_MAX_FLAGGED", 2)
+    tail = raw.iloc[2000:].rename(columns={"date_time": "timestamp"})
+    client.post("/append", json={"cleaned_filename": name, "rows": tail.to_dict(orient="records")})
+    j = _anomalies(client, cleaned_filename=name, method="online").get_json()
+    assert j["scored"]["electricity_kwh"] == 1000
+    # capped to the latest two, which match one detector fed the whole series
+    det = OnlineAnomalyDetector()
+    det.score_new(raw.rename(columns={"date_time": "timestamp"}).assign(timestamp=lambda d: pd.to_datetime(d["timestamp"])), "electricity_kwh")
+    assert det.n_flagged > 2 and (det.flagged["value"] == 5000.0).sum() == 3
+    got = [r["energy_kwh"] for r in j["anomalies"] if r["energy_type"] == "electricity_kwh"]
+    assert len(got) == 2
+    np.testing.assert_allclose(got, det.flagged["value"].iloc[-2:], rtol=1e-6)
+
+def test_async_jobs_match_the_synchronous_response(client):
+    import time
+    from synth import generate
+    name = _upload(client, generate("household", 400, 3, "wide", seed=8), "async.csv")
+    body = {"cleaned_filename": name, "model": "ridge", "horizon": 6}
+    r = client.post("/forecast", json={**body, "format": "ndjson", "async": True})
+    assert r.status_code == 400 and "ndjson" in r.get_json()["error"]
+    r = client.post("/forecast", json={**body, "async": True})
+    assert r.status_code == 202 and r.headers["Location"] == f"/jobs/{r.get_json()['job_id']}"
+    deadline = time.time() + 30
+    while (job := client.get(r.headers["Location"]).get_json())["status"] in ("queued", "running") and time.time() < deadline:
+        time.sleep(0.05)
+    assert job["status"] == "done" and job["status_code"] == 200
+    sync = client.post("/forecast", json=body).get_json()
+    assert sync["model_cache"] == "hit"  # the job's fit went into the registry
+    assert job["result"]["predictions"] == sync["predictions"] and job["result"]["model"] == sync["model"]
+    assert client.get("/jobs/nope").status_code == 404
+
+def test_metrics_and_request_profiling(client, monkeypatch):
+    from config import Config
+    from synth import generate
+    monkeypatch.setattr(Config, "PROFILE_TOKEN", "secret")
+    name = _upload(client, generate("household", 300, 2, "wide", seed=9), "profile.csv")
+    body = {"cleaned_filename": name, "model": "ridge", "horizon": 6}
+    plain = client.post("/forecast", json=body)
+    assert "Server-Timing" not in plain.headers
+    r = client.post("/forecast", json=body, headers={"X-Profile": "stages", "X-Profile-Token": "secret"})
+    timing = r.headers["Server-Timing"]
+    assert "total;dur=" in timing and "model.predict;dur=" in timing
+    assert r.get_json()["predictions"] == plain.get_json()["predictions"]
+    r = client.post("/forecast", json=body, headers={"X-Profile": "cprofile", "X-Profile-Token": "secret"})
+    assert r.status_code == 200 and r.mimetype == "text/plain" and "cumulative" in r.get_data(as_text=True)
+    # a wrong token is answered as if no profile had been asked for
+    for mode in ("stages", "cprofile"):
+        r = client.post("/forecast", json=body, headers={"X-Profile": mode, "X-Profile-Token": "guess"})
+        assert "Server-Timing" not in r.headers and r.get_json()["predictions"] == plain.get_json()["predictions"]
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'energy_http_request_duration_seconds_count{endpoint="/forecast",method="POST",status="200"}' in text
+    assert "model.predict" in text
+
+def test_summary_after_appends_matches_a_fresh_scan(client):
+    import os
+    import app
+    from store import read_sidecar, write_sidecar
+    from summary import SUMMARY_FILE, DatasetSummary
+    from synth import generate
+    raw = generate("household", 900, 3, "wide", seed=10)
+    name = _upload(client, raw.iloc[:600], "summary-append.csv")
+    path = os.path.join(os.environ["UPLOAD_FOLDER"], name + ".cols")
+
+    def check():
+        got = client.get(f"/summary/{name}").get_json()["summary"]
+        want = DatasetSummary.from_frame(app.frames.get(name)).metrics()
+        assert got["rows"] == want["rows"] and (got["start"], got["end"]) == (want["start"], want["end"])
+        assert got["peak_hour"] == want["peak_hour"]
+        for k in ("totals", "shares"):
+            assert got[k] == pytest.approx(want[k])
+        for k in ("hourly_profile", "weekday_profile", "total", "base_load"):
+            assert got[k] == pytest.approx(want[k])
+    client.post("/append", json={"cleaned_filename": name, "rows": _standardized_rows(raw.iloc[600:750])})
+    assert read_sidecar(path, SUMMARY_FILE)["rows"] == 750 * 3  # extended in place, not rebuilt
+    check()
+    # a sidecar that no longer covers the manifest is skipped on append and rebuilt on read
+    stale = read_sidecar(path, SUMMARY_FILE)
+    stale["rows"] -= 1
+    stale["series"]["fridge"]["total"] += 1000.0
+    write_sidecar(path, SUMMARY_FILE, stale)
+    client.post("/append", json={"cleaned_filename": name, "rows": _standardized_rows(raw.iloc[750:])})
+    assert read_sidecar(path, SUMMARY_FILE)["rows"] == 750 * 3 - 1
+    check()
+    assert read_sidecar(path, SUMMARY_FILE)["rows"] == 900 * 3
+
+def test_identical_uploads_reuse_the_cleaned_dataset(client):
+    from synth import generate
+    raw = generate("household", 200, 2, "wide", seed=11)
+    post = lambda df, name: client.post("/upload", data={"file": (io.BytesIO(df.to_csv(index=False).encode()), name), "data_type": "household"},
+                                        content_type="multipart/form-data").get_json()
+    first = post(raw, "dedup-a.csv")
+    again = post(raw, "dedup-b.csv")
+    assert again["deduplicated"] and again["cleaned_filename"] == first["cleaned_filename"]
+    assert again["preview"] == first["preview"]
+    other = post(raw.iloc[:-1], "dedup-a.csv")
+    assert not other.get("deduplicated") and other["cleaned_filename"] != first["cleaned_filename"]
+    # once appended to, the dataset no longer matches those bytes
+    rows = _standardized_rows(generate("household", 210, 2, "wide", seed=11).iloc[200:])
+    assert client.post("/append", json={"cleaned_filename": first["cleaned_filename"], "rows": rows}).get_json()["appended"] == 20
+    fresh = post(raw, "dedup-c.csv")
+    assert not fresh.get("deduplicated") and fresh["cleaned_filename"] not in (first["cleaned_filename"], other["cleaned_filename"])
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+from dataset import SeriesMatrix
+
+def _long(hours=500, seed=0):
+    rng = np.random.default_rng(seed)
+    ts = pd.date_range("2024-01-01", periods=hours, freq="h", tz="Europe/Berlin")
+    frames = [pd.DataFrame({"timestamp": ts, "appliance": name, "energy_kwh": np.round(rng.gamma(2.0, scale, hours), 4)})
+              for name, scale in (("fridge", 0.2), ("hvac", 1.5), ("ev_charger", 4.0))]
+    long = pd.concat(frames, ignore_index=True)
+    return long.drop(long.sample(frac=0.1, random_state=seed).index)
+
+def test_round_trips_the_long_frame():
+    long = _long()
+    m = SeriesMatrix.from_long(long)
+    assert m.tz == "Europe/Berlin"
+    back = m.to_long().sort_values(["appliance", "timestamp"]).reset_index(drop=True)
+    expected = long.sort_values(["appliance", "timestamp"]).reset_index(drop=True)
+    # values under 7 significant digits come back exactly
+    pd.testing.assert_frame_equal(back, expected, check_dtype=False)
+
+def test_duplicates_are_summed_and_large_readings_rounded():
+    long = _long(48)
+    dup = long.iloc[:3].assign(energy_kwh=1.0)
+    big = long.iloc[[10]].assign(appliance="meter", energy_kwh=123456789.0)
+    back = SeriesMatrix.from_long(pd.concat([long, dup, big], ignore_index=True)).to_long()
+    assert len(back) == len(long) + 1
+    merged = back.merge(long.iloc[:3], on=["timestamp", "appliance"], suffixes=("", "_one"))
+    np.testing.assert_allclose(merged["energy_kwh"], merged["energy_kwh_one"] + 1.0)
+    meter = back.loc[back["appliance"] == "meter", "energy_kwh"].item()
+    assert meter == 123456800.0  # 7 significant digits
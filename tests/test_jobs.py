@@ -0,0 +1,40 @@
+import threading
+import time
+from jobs import JobQueue
+
+def _wait(queue, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while queue.get(job_id).active and time.time() < deadline:
+        time.sleep(0.01)
+    return queue.get(job_id)
+
+def test_identical_submissions_share_a_job_until_it_finishes():
+    queue = JobQueue(workers=2)
+    release = threading.Event()
+    calls = []
+
+    def work(x):
+        calls.append(x)
+        release.wait(5)
+        return {"x": x}, 200
+    first, coalesced = queue.submit("k", work, 1)
+    assert not coalesced
+    second, coalesced = queue.submit("k", work, 1)
+    assert coalesced and second is first
+    other, coalesced = queue.submit("other", work, 2)
+    assert not coalesced and other is not first
+    release.set()
+    assert _wait(queue, first.id).to_dict()["result"] == {"x": 1}
+    _wait(queue, other.id)
+    assert sorted(calls) == [1, 2]
+    # a finished job is not reused: the same key runs again
+    again, coalesced = queue.submit("k", work, 1)
+    assert not coalesced and again is not first
+    _wait(queue, again.id)
+
+def test_finished_jobs_expire_after_ttl():
+    queue = JobQueue(workers=1, ttl=0.2)
+    job, _ = queue.submit("k", lambda: ({}, 200))
+    assert _wait(queue, job.id).status == "done"
+    time.sleep(0.3)
+    assert queue.get(job.id) is None
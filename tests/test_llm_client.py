@@ -0,0 +1,136 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import llm_client
+from config import Config
+
+class _Upstream:
+    """OpenAI-compatible stand-in on an ephemeral port that replays scripted statuses."""
+    def __init__(self, script=(), delay=0.0):
+        self.script = list(script)
+        self.delay = delay
+        self.calls = 0
+        self.inflight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with upstream._lock:
+                    upstream.calls += 1
+                    upstream.inflight += 1
+                    upstream.peak = max(upstream.peak, upstream.inflight)
+                    status, headers = upstream.script.pop(0) if upstream.script else (200, {})
+                time.sleep(upstream.delay)
+                body = json.dumps({"choices": [{"message": {"content": f"reply {upstream.calls}"}}]}).encode()
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with upstream._lock:
+                    upstream.inflight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1/chat/completions"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def upstream(monkeypatch):
+    servers = []
+
+    def start(script=(), delay=0.0, **config):
+        s = _Upstream(script, delay)
+        servers.append(s)
+        settings = dict(OPENAI_API_KEY="test", OPENAI_API_URL=s.url, LLM_MAX_RETRIES=3,
+                        LLM_MAX_CONCURRENCY=4, LLM_RATE_PER_SEC=0.0, LLM_CACHE_DIR="")
+        settings.update(config)
+        for k, v in settings.items():
+            monkeypatch.setattr(Config, k, v)
+        return s
+
+    yield start
+    for s in servers:
+        s.close()
+
+@pytest.fixture
+def delays(monkeypatch):
+    """Records the backoff each retry asked for while sleeping only a fraction of it."""
+    seen = []
+    backoff = llm_client.LLMClient._backoff
+
+    def fast(attempt, retry_after=None):
+        seen.append(backoff(attempt, retry_after))
+        return seen[-1] / 100
+    monkeypatch.setattr(llm_client.LLMClient, "_backoff", staticmethod(fast))
+    return seen
+
+def test_retries_429_with_retry_after_then_503(upstream, delays):
+    s = upstream([(429, {"Retry-After": "2"}), (503, {})])
+    assert llm_client.LLMClient().generate("sys", "user") == "reply 3"
+    assert s.calls == 3
+    assert delays[0] == 2.0
+    assert 0.5 <= delays[1] <= 1.0  # second attempt: exponential backoff with jitter
+
+def test_gives_up_after_max_retries(upstream, delays):
+    s = upstream([(503, {})] * 10, LLM_MAX_RETRIES=2)
+    with pytest.raises(requests.HTTPError):
+        llm_client.LLMClient().generate("sys", "user")
+    assert s.calls == 3
+    assert len(delays) == 2
+
+def test_memory_and_disk_cache_hits(upstream, tmp_path):
+    s = upstream(LLM_CACHE_DIR=str(tmp_path))
+    assert llm_client.LLMClient().generate("sys", "user") == "reply 1"
+    client = llm_client.LLMClient()
+    assert client.generate("sys", "  user ") == "reply 1"  # disk: fresh client, empty LRU
+    assert client.generate("sys", "user") == "reply 1"  # memory
+    assert s.calls == 1
+    assert client.generate("sys", "other") == "reply 2"
+
+def test_concurrency_cap(upstream):
+    s = upstream(delay=0.1, LLM_MAX_CONCURRENCY=2)
+    client = llm_client.LLMClient()
+    threads = [threading.Thread(target=client.generate, args=("sys", f"prompt {i}")) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert s.calls == 6
+    assert s.peak == 2
+
+def test_disk_cache_evicts_expired_and_oldest(tmp_path):
+    cache = llm_client.ResponseCache(maxsize=8, ttl=3600, path=str(tmp_path), max_bytes=10 ** 6)
+    cache.put("stale", "x")
+    old = time.time() - 7200
+    os.utime(tmp_path / "stale.json", (old, old))
+    for i in range(3):
+        cache.put(f"k{i}", "y" * 100)
+        t = time.time() - 100 + i
+        os.utime(tmp_path / f"k{i}.json", (t, t))
+    assert sorted(os.listdir(tmp_path)) == ["k0.json", "k1.json", "k2.json"]
+
+    cache.max_bytes = os.path.getsize(tmp_path / "k1.json") + os.path.getsize(tmp_path / "k2.json")
+    cache.evict()
+    assert sorted(os.listdir(tmp_path)) == ["k1.json", "k2.json"]
+
+    (tmp_path / "k1.json").write_text(json.dumps([time.time() - 7200, "old"]))
+    assert llm_client.ResponseCache(path=str(tmp_path), ttl=3600).get("k1") is None
+    assert not (tmp_path / "k1.json").exists()
@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+import pytest
+from dataset import SeriesMatrix
+from ml_model import Forecaster, GlobalForecaster, LagFeatures, create_lag_features, forecast_total, series_arrays
+
+def _misaligned(hours=600, trim=6):
+    """Three hourly appliance series; ev_charger is missing its last `trim` readings."""
+    rng = np.random.default_rng(0)
+    ts = pd.date_range("2024-01-01", periods=hours, freq="h")
+    hod = ts.hour.to_numpy()
+    frames = []
+    for name, level in (("fridge", 0.3), ("hvac", 2.0), ("ev_charger", 5.0)):
+        v = level * (1 + 0.5 * np.sin(hod / 24 * 2 * np.pi)) + rng.normal(0, 0.05, hours)
+        df = pd.DataFrame({"timestamp": ts, "appliance": name, "energy_kwh": v})
+        frames.append(df.iloc[:-trim] if name == "ev_charger" else df)
+    return pd.concat(frames, ignore_index=True)
+
+def test_forecast_all_aligns_series_on_latest_reading():
+    long = _misaligned()
+    m = SeriesMatrix.from_long(long)
+    assert dict(zip(m.labels, m.gaps())) == {"fridge": 0, "hvac": 0, "ev_charger": 6}
+    fore = GlobalForecaster(engine="ridge", random_state=0)
+    fore.train(m)
+    per_series = fore.forecast_all(m, 24)
+    expected = pd.date_range(long["timestamp"].max() + pd.Timedelta(hours=1), periods=24, freq="h")
+    for p in per_series.values():
+        pd.testing.assert_index_equal(pd.DatetimeIndex(p["timestamp"]), expected, check_names=False)
+    total = forecast_total(per_series)
+    assert len(total) == 24
+    np.testing.assert_allclose(total["predicted"], sum(p["predicted"].to_numpy() for p in per_series.values()))
+    # the trailing series is rolled forward over its 6-hour gap, not restarted or zero-filled
+    rolled = fore.forecast_all(SeriesMatrix.from_long(long[long["appliance"] == "ev_charger"]), 30)["ev_charger"]
+    np.testing.assert_allclose(per_series["ev_charger"]["predicted"], rolled["predicted"].iloc[6:])
+    assert (per_series["ev_charger"]["predicted"] > 1).all()
+
+def test_forecast_all_gap_limits():
+    m = SeriesMatrix.from_long(_misaligned())
+    fore = GlobalForecaster(engine="ridge", random_state=0)
+    fore.train(m)
+    with pytest.raises(ValueError, match="ev_charger"):
+        fore.forecast_all(m, 24, max_gap=3)
+    direct = GlobalForecaster(horizon=24, random_state=0)
+    direct.train(m)
+    with pytest.raises(ValueError, match="horizon"):
+        direct.forecast_all(m, 24)
+    direct = GlobalForecaster(horizon=30, random_state=0)
+    direct.train(m)
+    assert {len(p) for p in direct.forecast_all(m, 24).values()} == {24}
+
+def _stepwise(model, series, last, n_steps, lags=24):
+    """The per-step recursive loop predict_batch replaced: one predict per hour, lags newest-first."""
+    history = list(series)
+    preds = []
+    for step in range(n_steps):
+        hour = (last + pd.Timedelta(hours=step + 1)).hour
+        yhat = float(model.predict(np.array(history[-lags:][::-1] + [hour]).reshape(1, -1))[0])
+        preds.append(yhat)
+        history.append(yhat)
+    return preds
+
+def test_ring_buffer_matches_stepwise_loop():
+    long = _misaligned()
+    fore = Forecaster(random_state=0)
+    fore.train(long[long["appliance"] == "hvac"])
+    windows, lasts, expected = [], [], []
+    for name, df in long.groupby("appliance"):
+        values = df["energy_kwh"].tolist()
+        last = df["timestamp"].iloc[-1]
+        windows.append(values[-24:])
+        lasts.append(last)
+        expected.append(_stepwise(fore.model, values, last, 36))
+        if name == "hvac":
+            out = fore.predict_next_n(df, 36)
+            np.testing.assert_allclose(out["predicted"], expected[-1])
+            assert out["timestamp"].iloc[0] == last + pd.Timedelta(hours=1)
+    # past one full turn of the ring, with series ending at different hours
+    np.testing.assert_allclose(fore.predict_batch(windows, lasts, 36), expected)
+
+def test_direct_mode_predicts_horizon_from_one_window():
+    df = _misaligned()
+    df = df[df["appliance"] == "fridge"]
+    fore = Forecaster(horizon=12, random_state=0)
+    fore.train(df)
+    assert fore.model.coef_.shape == (12, 25)
+    last = df["timestamp"].iloc[-1]
+    x = df["energy_kwh"].to_numpy()[-24:][::-1].tolist() + [(last + pd.Timedelta(hours=1)).hour]
+    expected = fore.model.predict(np.array([x]))[0]
+    np.testing.assert_allclose(fore.predict_next_n(df, 12)["predicted"], expected)
+    np.testing.assert_allclose(fore.predict_next_n(df, 5)["predicted"], expected[:5])
+    with pytest.raises(ValueError, match="horizon"):
+        fore.predict_next_n(df, 13)
+
+def test_lag_features_match_create_lag_features():
+    long = _misaligned(hours=200)
+    long.loc[long.groupby("appliance").head(5).index, "energy_kwh"] = np.nan  # leading gaps
+    long.loc[long.sample(20, random_state=0).index, "energy_kwh"] = np.nan
+    features = LagFeatures(24)
+    for name, df in long.sample(frac=1, random_state=1).groupby("appliance"):
+        values, index = series_arrays(df)
+        X, Y = features.training_matrix(values, index)
+        ref = create_lag_features(df, lags=24)
+        assert len(ref) < len(df) - 24 - 5
+        np.testing.assert_array_equal(X, ref[features.names].to_numpy(), err_msg=name)
+        np.testing.assert_array_equal(Y[:, 0], ref["energy_kwh"].to_numpy(), err_msg=name)
+
+def test_online_detector_state_round_trips_through_json():
+    import json
+    from ml_model import OnlineAnomalyDetector
+    ts = pd.date_range("2024-01-01", periods=2000, freq="h", tz="Europe/Berlin")
+    v = np.random.default_rng(2).normal(1.0, 0.1, 2000)
+    v[[1500, 1700, 1900]] = 9.0
+    df = pd.DataFrame({"timestamp": ts, "energy_kwh": v})
+    whole = OnlineAnomalyDetector(max_flagged=2)
+    whole.score_new(df)
+    det = OnlineAnomalyDetector(max_flagged=2)
+    det.score_new(df.iloc[:1600])
+    det = OnlineAnomalyDetector.from_dict(json.loads(json.dumps(det.to_dict())), max_flagged=2)
+    det.score_new(df)
+    assert det.n_flagged == whole.n_flagged >= 3 and len(det.flagged) == 2
+    pd.testing.assert_frame_equal(det.flagged, whole.flagged)
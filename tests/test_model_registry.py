@@ -0,0 +1,65 @@
+import io
+import os
+import time
+import numpy as np
+import pandas as pd
+from ml_model import Forecaster, fit_series
+from model_registry import ModelRegistry
+
+def _series(hours=300, seed=0):
+    rng = np.random.default_rng(seed)
+    ts = pd.date_range("2024-01-01", periods=hours, freq="h")
+    return pd.DataFrame({"timestamp": ts, "energy_kwh": 1 + np.sin(ts.hour / 24 * 2 * np.pi) + rng.normal(0, 0.1, hours)})
+
+def _fit(registry, df, key="total"):
+    calls = []
+
+    def fit(model, data):
+        calls.append(key)
+        return fit_series(model, data)
+    model, hit = registry.get_or_fit(Forecaster(engine="ridge", random_state=0), df, key, fit)
+    return model, hit, len(calls)
+
+def test_hits_are_keyed_by_content(tmp_path):
+    registry = ModelRegistry(str(tmp_path))
+    df = _series()
+    model, hit, fits = _fit(registry, df)
+    assert (hit, fits) == (False, 1)
+    # same values under another index (another frame object) hit; a changed value or series key misses
+    cached, hit, fits = _fit(registry, df.copy().set_index(df.index + 1000))
+    assert (hit, fits) == (True, 0)
+    np.testing.assert_array_equal(cached.model.coef_, model.model.coef_)
+    changed = df.copy()
+    changed.loc[5, "energy_kwh"] += 1e-9
+    assert _fit(registry, changed)[1:] == (False, 1)
+    assert _fit(registry, df, key="other")[1:] == (False, 1)
+    assert (registry.hits, registry.misses) == (1, 3)
+
+def test_evicts_idle_then_least_recently_used(tmp_path):
+    registry = ModelRegistry(str(tmp_path), max_age=3600, max_bytes=10 ** 9)
+    for name in ("a", "b", "c", "d"):
+        registry.save(name, np.zeros(1000))
+    now = time.time()
+    for name, age in (("a", 7200), ("b", 300), ("c", 200), ("d", 100)):
+        os.utime(tmp_path / f"{name}.joblib", (now - age, now - age))
+    registry.load("b")  # a hit refreshes b
+    size = os.path.getsize(tmp_path / "b.joblib")
+    registry.max_bytes = 2 * size
+    registry.evict()
+    assert sorted(os.listdir(tmp_path)) == ["b.joblib", "d.joblib"]
+    assert registry.load("c") is None
+
+def test_datasets_with_identical_content_share_a_model(client):
+    from synth import generate
+    raw = generate("household", 300, 2, "wide", seed=12).to_csv(index=False).encode()
+    names = []
+    # different bytes (a trailing blank line), same cleaned content
+    for data, name in ((raw, "shared-a.csv"), (raw + b"\n", "shared-b.csv")):
+        r = client.post("/upload", data={"file": (io.BytesIO(data), name), "data_type": "household"}, content_type="multipart/form-data")
+        names.append(r.get_json()["cleaned_filename"])
+    assert names[0] != names[1]
+    body = {"model": "ridge", "horizon": 6}
+    first = client.post("/forecast", json={**body, "cleaned_filename": names[0]}).get_json()
+    second = client.post("/forecast", json={**body, "cleaned_filename": names[1]}).get_json()
+    assert (first["model_cache"], second["model_cache"]) == ("miss", "hit")
+    assert first["predictions"] == second["predictions"]
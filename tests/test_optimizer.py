@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+import optimizer
+from test_app import _upload
+
+def _problem(households=3, steps=24, seed=0):
+    rng = np.random.default_rng(seed)
+    base = rng.uniform(0.5, 3.0, (households, 2, steps))
+    price = np.tile(np.where(np.arange(steps) % 24 < 17, 0.10, 0.35), (households, 1))
+    limits = np.full((households, 2), 7.0)
+    return base, price, limits
+
+def test_lp_keeps_households_under_max_kw():
+    pytest.importorskip("cvxpy")
+    base, price, limits = _problem()
+    # the greedy schedule piles everything into the cheap hours, well over this cap
+    headroom = np.full((3, 24), 5.0)
+    assert (optimizer.shift_loads(base, price, limits)[0].sum(axis=1) > headroom).any()
+    x, fits, capped = optimizer.shift_loads(base, price, limits, headroom=headroom)
+    assert capped and fits.all()
+    assert (x.sum(axis=1) <= headroom + 1e-6).all()
+    assert (x <= limits[:, :, None] + 1e-6).all()
+    np.testing.assert_allclose(x.sum(axis=2), base.sum(axis=2), rtol=1e-6)
+    assert ((x * price[:, None]).sum() < (base * price[:, None]).sum())
+
+def test_max_kw_without_cvxpy_is_501(client, monkeypatch):
+    from test_ml_model import _misaligned
+    long = _misaligned()
+    wide = long.pivot(index="timestamp", columns="appliance", values="energy_kwh").add_suffix("_kwh").reset_index()
+    name = _upload(client, wide, "optimize-cap.csv")
+    monkeypatch.setattr(optimizer, "cp", None)
+    body = {"cleaned_filename": name, "prices": [0.1] * 17 + [0.35] * 7, "horizon": 24}
+    assert client.post("/optimize", json=body).status_code == 200
+    r = client.post("/optimize", json={**body, "max_kw": 6.0})
+    assert r.status_code == 501 and "cvxpy" in r.get_json()["error"]
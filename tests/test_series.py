@@ -0,0 +1,81 @@
+import os
+import numpy as np
+import pandas as pd
+from series import ROLLUPS_DIR, Rollups, load_rollups
+from test_app import _standardized_rows, _upload
+
+ALL = (np.iinfo(np.int64).min + 1, np.iinfo(np.int64).max)
+
+def _long(hours=2000, seed=0):
+    from synth import generate
+    from utils import standardize_household
+    return standardize_household(generate("household", hours, 3, "wide", seed=seed))
+
+def _assert_same(a, b):
+    assert a.levels == b.levels and a.labels == b.labels
+    for level in a.levels:
+        for code in range(len(a.labels)):
+            x, y = a._read(level, code), b._read(level, code)
+            np.testing.assert_array_equal(x["bucket"], y["bucket"])
+            np.testing.assert_array_equal(x["count"], y["count"])
+            np.testing.assert_allclose(x["sum"], y["sum"])
+            np.testing.assert_array_equal(x["min"], y["min"])
+            np.testing.assert_array_equal(x["max"], y["max"])
+
+def test_streamed_chunks_match_one_pass(tmp_path):
+    df = _long()
+    chunks = [df.iloc[i:i + 333] for i in range(0, len(df), 333)]
+    chunks.insert(1, chunks.pop(7))  # readings from before the trailing bucket force a rewrite
+    r = Rollups(str(tmp_path / ROLLUPS_DIR))
+    for chunk in chunks:
+        r.update(chunk)
+    r.save()
+    whole = Rollups.from_frame(df)
+    # hourly readings: a 1h level would only copy them
+    assert whole.levels == ["6h", "1D", "7D"]
+    _assert_same(Rollups.load(str(tmp_path)), whole)
+
+def test_query_never_exceeds_points():
+    r = Rollups.from_frame(_long())
+    level, agg = r.query("fridge", *ALL, 5)
+    assert level == "7D" and len(agg) == 5
+    level, agg = r.query("fridge", *ALL, 100)
+    assert level == "1D" and len(agg) <= 100
+
+def test_append_extends_rollups_in_place(client):
+    from synth import generate
+    raw = generate("household", 1200, 3, "wide", seed=5)
+    name = _upload(client, raw.iloc[:1000], "rollups.csv")
+    assert client.get(f"/series/{name}?points=50").get_json()["series"]["fridge"]["resolution"] == "1D"
+    path = os.path.join(os.environ["UPLOAD_FOLDER"], name + ".cols")
+    rows = _standardized_rows(raw.iloc[1000:])
+    assert client.post("/append", json={"cleaned_filename": name, "rows": rows}).get_json()["appended"] == len(rows)
+    r = Rollups.load(path)
+    assert r.rows == 3600
+    _assert_same(r, Rollups.from_frame(_long(1200, seed=5)))
+    assert load_rollups(path, lambda: None) is not None  # fresh: not rebuilt
+
+def test_series_caps_raw_points_without_rollup_levels(client):
+    ts = pd.date_range("2020-01-05", periods=400, freq="14D")
+    wide = pd.DataFrame({"timestamp": ts, "fridge_kwh": np.arange(400.0)})
+    name = _upload(client, wide, "fortnightly.csv")
+    out = client.get(f"/series/{name}?points=100").get_json()["series"]["fridge"]
+    assert out["resolution"] == "lttb" and len(out["timestamp"]) == 100
+
+def test_text_only_series_has_no_key(client):
+    from test_utils import _industrial
+    name = _upload(client, _industrial(500), "fuel.csv", kind="industrial")
+    body = client.get(f"/series/{name}?points=50").get_json()
+    assert body["keys"] and "fuel_mix" not in body["keys"]
+
+def test_reads_wait_for_an_append_in_progress(tmp_path):
+    import threading
+    from store import dataset_lock
+    r = Rollups(str(tmp_path / ROLLUPS_DIR)).update(_long())
+    done = threading.Event()
+    with dataset_lock(str(tmp_path)):
+        reader = threading.Thread(target=lambda: (r._read("1D", 0), done.set()))
+        reader.start()
+        assert not done.wait(0.2)
+    reader.join(5)
+    assert done.is_set()
@@ -0,0 +1,67 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from store import (MANIFEST, append_dataset, read_dataset, read_manifest, read_matrix, write_dataset,
+                   write_sidecar)
+
+def _industrial(hours=48, start="2024-01-01"):
+    ts = pd.date_range(start, periods=hours, freq="h")
+    rng = np.random.default_rng(0)
+    power = pd.DataFrame({"timestamp": ts, "energy_type": "electricity_kwh", "energy_value": rng.random(hours)})
+    # a text column the wide->long reshape picked up as an energy type: unique strings per row
+    fuel = pd.DataFrame({"timestamp": ts, "energy_type": "fuel_mix",
+                         "energy_value": pd.Series([f"grid {i}%" for i in range(hours)], dtype=object)})
+    return pd.concat([power, fuel], ignore_index=True)
+
+def test_value_text_is_nan_and_categories_stay_out_of_manifest(tmp_path):
+    path = str(tmp_path / "plant.cols")
+    df = _industrial()
+    write_dataset(df, path)
+    manifest = read_manifest(path)
+    cols = {c["name"]: c for c in manifest["columns"]}
+    assert cols["timestamp"]["kind"] == "datetime" and cols["energy_value"]["kind"] == "float"
+    assert "categories" not in cols["energy_type"] and cols["energy_type"]["n_categories"] == 2
+    assert os.path.getsize(os.path.join(path, MANIFEST)) < 1024
+
+    back = read_dataset(path)
+    assert back["energy_type"].tolist() == df["energy_type"].tolist()
+    assert back["energy_value"].iloc[:48].tolist() == df["energy_value"].iloc[:48].tolist()
+    assert back["energy_value"].iloc[48:].isna().all()
+
+    append_dataset(path, _industrial(24, "2024-01-03").assign(energy_type="gas_therms"))
+    # fuel_mix has no numeric readings, so it is not a series
+    assert sorted(read_matrix(path).labels) == ["electricity_kwh", "gas_therms"]
+    assert read_manifest(path)["rows"] == 48 * 2 + 24 * 2
+
+def test_reads_and_migrates_inline_categories(tmp_path):
+    path = str(tmp_path / "old.cols")
+    write_dataset(_industrial(), path)
+    manifest = read_manifest(path)
+    # the layout from before category lists moved to sidecars
+    for i, col in enumerate(manifest["columns"]):
+        if col["kind"] == "category":
+            with open(os.path.join(path, f"{i}.cats.json"), encoding="utf-8") as fh:
+                col["categories"] = json.load(fh)
+            del col["n_categories"]
+            os.remove(os.path.join(path, f"{i}.cats.json"))
+    write_sidecar(path, MANIFEST, manifest)
+    assert read_matrix(path).labels == ["electricity_kwh"]
+    assert read_dataset(path)["energy_type"].nunique() == 2
+
+    append_dataset(path, _industrial(24, "2024-01-03").assign(energy_type="gas_therms"))
+    assert all("categories" not in c for c in read_manifest(path)["columns"])
+    back = read_dataset(path)
+    assert back["energy_type"].value_counts().to_dict() == {"electricity_kwh": 48, "fuel_mix": 48, "gas_therms": 48}
+
+def test_categories_left_by_interrupted_append_are_ignored(tmp_path):
+    path = str(tmp_path / "plant.cols")
+    write_dataset(_industrial(), path)
+    i = [c["name"] for c in read_manifest(path)["columns"]].index("energy_type")
+    write_sidecar(path, f"{i}.cats.json", ["electricity_kwh", "fuel_mix", "never_committed"])
+    append_dataset(path, _industrial(24, "2024-01-03").assign(energy_type="gas_therms"))
+    with open(os.path.join(path, f"{i}.cats.json"), encoding="utf-8") as fh:
+        assert json.load(fh) == ["electricity_kwh", "fuel_mix", "gas_therms"]
+    assert read_dataset(path)["energy_type"].value_counts().to_dict() == {"electricity_kwh": 48, "fuel_mix": 48, "gas_therms": 48}